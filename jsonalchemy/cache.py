@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of JSONAlchemy.
+# Copyright (C) 2015 CERN.
+#
+# JSONAlchemy is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# JSONAlchemy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JSONAlchemy; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Persistent cache of the parsed field and model definitions.
+
+Parsing the configuration files is by far the most expensive part of the
+start up of any process using JSONAlchemy.  The result of
+:meth:`~jsonalchemy.parser.FieldParser._create` and
+:meth:`~jsonalchemy.parser.ModelParser._create` can be stored on disk and
+loaded back by the next process with the same configuration:
+
+.. code-block:: python
+
+    >>> from jsonalchemy.registry import MetaData
+    >>> metadata = MetaData(['jsonalchemy.jsonext'], cache_dir='/tmp/jsonalc')
+
+Each cache entry is identified by the content of the configuration files, the
+registered parsers and functions and the python version, therefore a cache
+entry built from a different configuration is never used, it simply gets
+rebuilt.
+"""
+
+import hashlib
+import importlib
+import marshal
+import os
+import pickle
+import sys
+import tempfile
+import types
+import warnings
+
+import six
+
+from pyparsing import ParseResults
+from six.moves import builtins
+
+CACHE_VERSION = 3
+"""Version of the format of the cache files, bump it if the layout of the
+field or model definitions changes."""
+
+
+def _code_names(code):
+    """Get the names used by ``code`` and by the code nested in it."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(_code_names(const))
+    return names
+
+
+class DefinitionsPickler(pickle.Pickler):
+
+    """Pickler able to store code objects and anonymous functions.
+
+    The field definitions contain the compiled code of the rules and also
+    anonymous functions (``lambda``) coming from ``schema`` or ``json``
+    sections which the default pickler refuses to store.  It also handles the
+    ``ParseResults`` from :mod:`pyparsing`, used to send the parsed rules
+    between processes.
+
+    The lambdas created by :func:`~jsonalchemy.utils.try_to_eval` don't
+    belong to any module, the globals they use are stored with them (the
+    modules only by name).
+    """
+
+    def persistent_id(self, obj):
+        """Store code objects and lambdas using :mod:`marshal`."""
+        if isinstance(obj, types.CodeType):
+            return ('code', marshal.dumps(obj))
+        if isinstance(obj, types.ModuleType):
+            return ('module', obj.__name__)
+        if isinstance(obj, ParseResults):
+            # The reference to the parent is not kept, it isn't needed once
+            # the parsing is done and it would create cycles.
+            toklist, (tokdict, parent, accum_names, name) = obj.__getstate__()
+            return ('parse_results', toklist, tokdict, accum_names, name)
+        if isinstance(obj, types.FunctionType):
+            module = sys.modules.get(obj.__module__)
+            if getattr(module, obj.__name__, None) is obj:
+                # Importable function, the default pickle behavior is fine
+                return None
+            if six.get_function_closure(obj):
+                raise pickle.PicklingError(
+                    "Can't store function '%s' with closure" % (obj, ))
+            code = six.get_function_code(obj)
+            namespace = None
+            if module is None:
+                function_globals = six.get_function_globals(obj)
+                namespace = dict(
+                    (name, function_globals[name])
+                    for name in _code_names(code)
+                    if name in function_globals and name != '__builtins__')
+            return ('function', marshal.dumps(code),
+                    obj.__module__, obj.__name__,
+                    six.get_function_defaults(obj), namespace)
+        return None
+
+
+class DefinitionsUnpickler(pickle.Unpickler):
+
+    """Counterpart of :class:`DefinitionsPickler`."""
+
+    def persistent_load(self, pid):
+        """Rebuild code objects and lambdas."""
+        if pid[0] == 'code':
+            return marshal.loads(pid[1])
+        elif pid[0] == 'module':
+            return importlib.import_module(pid[1])
+        elif pid[0] == 'parse_results':
+            toklist, tokdict, accum_names, name = pid[1:]
+            results = ParseResults([])
+            results.__setstate__(
+                (toklist, (tokdict, None, accum_names, name)))
+            return results
+        elif pid[0] == 'function':
+            code, module, name, defaults, namespace = pid[1:]
+            if namespace is None:
+                function_globals = vars(importlib.import_module(module))
+            else:
+                function_globals = dict(namespace, __builtins__=builtins)
+            return types.FunctionType(
+                marshal.loads(code), function_globals, name, defaults)
+        raise pickle.UnpicklingError("Unknown persistent id %r" % (pid, ))
+
+
+def file_digest(filename):
+    """Return the hash of the content of ``filename``."""
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class DefinitionsCache(object):
+
+    """On-disk cache of field and model definitions."""
+
+    def __init__(self, cache_dir):
+        """Initialize the cache inside ``cache_dir``."""
+        self.cache_dir = cache_dir
+
+    def key(self, metadata, section):
+        """Compute the key of ``section`` (``fields`` or ``models``).
+
+        The key depends on the content of the configuration files, on the
+        registered parsers and functions and on the python version (the code
+        objects are stored with :mod:`marshal`).  The key of the models also
+        includes the key of the fields, as the models depend on them.
+        """
+        digest = hashlib.sha1()
+
+        def update(*values):
+            for value in values:
+                digest.update(six.text_type(value).encode('utf-8'))
+                digest.update(b'\0')
+
+        update(CACHE_VERSION, sys.version, metadata.parser_backend)
+        for name, parser in sorted(six.iteritems(metadata.parsers)):
+            update(name, parser.__module__, parser.__name__)
+        for name, function in sorted(six.iteritems(metadata.functions)):
+            update(name, getattr(function, '__module__', None))
+        if section == 'models':
+            update(self.key(metadata, 'fields'))
+        for filename in getattr(metadata, section):
+            update(filename, file_digest(filename))
+        return digest.hexdigest()
+
+    def _filename(self, section, key):
+        return os.path.join(self.cache_dir, '%s-%s.pickle' % (section, key))
+
+    def load(self, section, key):
+        """Load the content stored for ``section`` and ``key``.
+
+        :return: the stored content or ``None`` if it is not there.
+        """
+        try:
+            with open(self._filename(section, key), 'rb') as f:
+                return DefinitionsUnpickler(f).load()
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def dump(self, section, key, content):
+        """Store ``content`` for ``section`` and ``key``.
+
+        The file is written atomically, so several processes can share the
+        same cache directory.  If the content can't be stored the cache is
+        simply not written.
+        """
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir,
+                                            prefix='.%s-' % (section, ))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    DefinitionsPickler(f, pickle.HIGHEST_PROTOCOL).dump(
+                        content)
+                os.rename(tmp_name, self._filename(section, key))
+            except:
+                os.remove(tmp_name)
+                raise
+        except (IOError, OSError, TypeError, AttributeError,
+                pickle.PicklingError) as e:
+            warnings.warn("Unable to store the %s definitions cache: %s"
+                          % (section, e))
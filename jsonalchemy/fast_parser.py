@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of JSONAlchemy.
+# Copyright (C) 2015 CERN.
+#
+# JSONAlchemy is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# JSONAlchemy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JSONAlchemy; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Hand written parser for the field configuration files.
+
+The grammar built by :func:`jsonalchemy.parser._create_field_parser` is slow,
+and gets slower with every registered extension.  This parser reads the same
+language line by line: first the file is split into *logical lines* (a
+physical line plus all the lines needed to close its brackets or triple
+quoted strings), then they are arranged in a tree using their indentation and
+finally each rule is built from its branch of the tree.
+
+The rules it creates are the same ``ParseResults`` the pyparsing grammar
+creates, so :meth:`jsonalchemy.parser.FieldParser._create_rule` and the
+``create_element`` of every extension work with both of them.
+
+The extensions are parsed by
+:meth:`~jsonalchemy.parser.BaseExtensionParser.parse_lines`, which receives
+the logical lines of the decorator or the section, e.g.
+``["@depends_on('title')"]`` or ``['schema:', "{'title': {}}"]``.
+
+Whenever a file can not be parsed a :class:`FieldParserException` is raised,
+:class:`~jsonalchemy.parser.FieldParser` then parses it again with the
+pyparsing grammar, which remains the reference implementation.
+"""
+
+import re
+
+import six
+
+from pyparsing import ParseResults
+
+from .errors import FieldParserException
+
+QUOTED_STRING = r'''(?:"(?:[^"\n\r\\]|\\.)*"|'(?:[^'\n\r\\]|\\.)*')'''
+"""Regular expression matching a single line quoted string."""
+
+_QUOTED_STRING_RE = re.compile(QUOTED_STRING)
+_JSON_ID_RE = re.compile(r'(\w+)\s*((?:,\s*\w+\s*)*):\Z')
+_DECORATOR_RE = re.compile(r'@(\w+)\s*')
+_CREATOR_RE = re.compile(r'([A-Za-z]\w*)\s*,\s*(%s)\s*,' % (QUOTED_STRING, ))
+_BRACKETS = {'(': ')', '[': ']', '{': '}'}
+
+
+class _Line(object):
+
+    """Logical line of a configuration file."""
+
+    __slots__ = ('lineno', 'indent', 'text', 'children')
+
+    def __init__(self, lineno, indent, text):
+        self.lineno = lineno
+        self.indent = indent
+        self.text = text
+        self.children = []
+
+
+def _tokens(value):
+    return list(value) if isinstance(value, ParseResults) else [value]
+
+
+def _error(message, lineno):
+    return FieldParserException("%s (line %d)" % (message, lineno))
+
+
+def skip_string(text, pos):
+    """Return the position right after the string starting at ``pos``."""
+    quote = text[pos:pos + 3]
+    if quote in ('"""', "'''"):
+        end = text.find(quote, pos + 3)
+        if end < 0:
+            raise _error("Unterminated string",
+                         text.count('\n', 0, pos) + 1)
+        return end + 3
+    quote = text[pos]
+    pos += 1
+    while pos < len(text) and text[pos] not in '\r\n':
+        if text[pos] == '\\':
+            pos += 1
+        elif text[pos] == quote:
+            return pos + 1
+        pos += 1
+    raise _error("Unterminated string", text.count('\n', 0, pos) + 1)
+
+
+def skip_brackets(text, pos):
+    """Return the position right after the bracket opened at ``pos``.
+
+    Strings and comments are taken into account, so their brackets don't
+    count.
+    """
+    stack = [_BRACKETS[text[pos]]]
+    pos += 1
+    while pos < len(text):
+        char = text[pos]
+        if char in '"\'':
+            pos = skip_string(text, pos)
+            continue
+        if char == '#':
+            pos = text.find('\n', pos)
+            if pos < 0:
+                break
+        elif char in _BRACKETS:
+            stack.append(_BRACKETS[char])
+        elif char in ')]}':
+            if char != stack.pop():
+                break
+            if not stack:
+                return pos + 1
+        pos += 1
+    raise _error("Unbalanced brackets", text.count('\n', 0, pos) + 1)
+
+
+def decorator_arguments(text, name):
+    """Get the arguments of the decorator ``name`` from ``text``.
+
+    :return: the arguments, parentheses included, or ``None`` if ``text``
+        is not exactly a call to ``@name``.
+    """
+    match = _DECORATOR_RE.match(text)
+    if match is None or match.group(1) != name or \
+            text[match.end():match.end() + 1] != '(':
+        return None
+    try:
+        end = skip_brackets(text, match.end())
+    except FieldParserException:
+        return None
+    if end != len(text):
+        return None
+    return text[match.end():]
+
+
+def quoted_strings(text):
+    """Get the content of a comma separated list of quoted strings.
+
+    :return: list of strings, without quotes, or ``None`` if ``text`` is
+        not such a list.
+    """
+    values = []
+    pos = 0
+    while True:
+        match = _QUOTED_STRING_RE.match(text, pos)
+        if match is None:
+            return None
+        values.append(match.group()[1:-1])
+        pos = match.end()
+        rest = text[pos:].lstrip()
+        if not rest:
+            return values
+        if rest[0] != ',':
+            return None
+        pos = len(text) - len(rest[1:].lstrip())
+
+
+def logical_lines(text):
+    """Split ``text`` into logical lines, skipping blanks and comments."""
+    lines = []
+    pos = 0
+    length = len(text)
+    lineno = 1
+    while pos < length:
+        start = pos
+        while start < length and text[start] in ' \t':
+            start += 1
+        end = start
+        while end < length and text[end] not in '#\r\n':
+            if text[end] in '"\'':
+                end = skip_string(text, end)
+            elif text[end] in _BRACKETS:
+                end = skip_brackets(text, end)
+            else:
+                end += 1
+        eol = text.find('\n', end)
+        if eol < 0:
+            eol = length
+        if end > start:
+            lines.append(_Line(lineno, start - pos,
+                               text[start:eol].rstrip()))
+        lineno += text.count('\n', pos, eol) + 1
+        pos = eol + 1
+    return lines
+
+
+def indentation_tree(lines, depth):
+    """Arrange the logical lines in a tree using their indentation.
+
+    The lines below ``depth`` levels are not nested any more, they are all
+    children of their ancestor at that level.  Their indentation doesn't need
+    to be consistent, as it happens in the body of the sections.
+
+    :return: the top level lines.
+    """
+    root = _Line(0, -1, '')
+    stack = [root]
+    for line in lines:
+        while line.indent <= stack[-1].indent:
+            stack.pop()
+        parent = stack[-1]
+        if len(stack) > depth:
+            parent.children.append(line)
+            continue
+        if parent.children and parent.children[0].indent != line.indent:
+            raise _error("Unexpected indentation", line.lineno)
+        parent.children.append(line)
+        stack.append(line)
+    return root.children
+
+
+class FastFieldParser(object):
+
+    """Parser of the field configuration files not using pyparsing."""
+
+    def __init__(self, metadata):
+        """Initialize with the extensions registered in ``metadata``."""
+        self.field_extensions = sorted(six.iteritems(
+            metadata.field_extensions))
+        self.decorators = {}
+        for extensions in (metadata.decorator_before_extensions,
+                           metadata.decorator_on_extensions,
+                           metadata.decorator_after_extensions):
+            self.decorators.update(extensions)
+
+    def parse_file(self, field_file):
+        """Parse one configuration file and return the list of its rules."""
+        with open(field_file) as f:
+            text = f.read()
+        try:
+            return self.parse_string(text)
+        except FieldParserException as e:
+            raise FieldParserException(
+                "Cannot parse file '%s',\n%s" % (field_file, str(e)))
+
+    def parse_string(self, text):
+        """Parse the content of a configuration file."""
+        rules = []
+        decorators = []
+        for line in indentation_tree(logical_lines(text), 2):
+            if line.text.startswith('@'):
+                if line.children:
+                    raise _error("Unexpected indentation",
+                                 line.children[0].lineno)
+                decorators.append(line)
+            else:
+                rules.append(self._parse_rule(decorators, line))
+                decorators = []
+        if decorators:
+            raise _error("Decorator without field", decorators[-1].lineno)
+        return rules
+
+    def _parse_rule(self, decorator_lines, line):
+        """Create the rule of a field definition."""
+        rule = ParseResults([])
+
+        for decorator_line in decorator_lines:
+            text = decorator_line.text
+            while text:
+                name, arguments, text = self._split_decorator(
+                    text, decorator_line.lineno)
+                if name not in ('pid', 'extend', 'override', 'hidden') \
+                        or name in rule \
+                        or (name == 'pid') != (arguments is not None):
+                    raise _error("Wrong decorator '%s'" % (name, ),
+                                 decorator_line.lineno)
+                if name == 'pid':
+                    try:
+                        rule['pid'] = int(arguments[1:-1].strip())
+                    except ValueError:
+                        raise _error("Wrong persistent identifier",
+                                     decorator_line.lineno)
+                else:
+                    rule[name] = True
+
+        match = _JSON_ID_RE.match(line.text)
+        if match is None:
+            raise _error("Field definition expected", line.lineno)
+        if not line.children:
+            raise _error("Empty field definition", line.lineno)
+        rule['field'] = {
+            'json_id': match.group(1),
+            'aliases': [alias.strip()
+                        for alias in match.group(2).split(',')[1:]],
+        }
+
+        for section in line.children:
+            body = section.children
+            if section.text in ('creator:', 'derived:', 'calculated:'):
+                name = section.text[:-1] + '_def'
+                if name in rule or not body:
+                    raise _error("Wrong section", section.lineno)
+                if name == 'creator_def':
+                    rule[name] = ParseResults(self._parse_creator(body))
+                else:
+                    rule[name] = self._parse_derived_or_calculated(
+                        section.text[:-1], body)
+                continue
+
+            lines = [section.text] + [body_line.text for body_line in body]
+            for name, parser in self.field_extensions:
+                value = parser.parse_lines(lines)
+                if value is not None:
+                    break
+            else:
+                raise _error("Unknown section", section.lineno)
+            if name in rule:
+                raise _error("Duplicated section '%s'" % (name, ),
+                             section.lineno)
+            rule[name] = value
+
+        return rule
+
+    def _split_decorator(self, text, lineno):
+        """Take the first decorator from ``text``.
+
+        :return: name, arguments (or ``None``) and the rest of the text.
+        """
+        match = _DECORATOR_RE.match(text)
+        if match is None:
+            raise _error("Decorator expected", lineno)
+        name = match.group(1)
+        name = 'pid' if name == 'persistent_identifier' else name
+        end = match.end()
+        if text[end:end + 1] != '(':
+            return name, None, text[end:]
+        start = end
+        end = skip_brackets(text, start)
+        return name, text[start:end], text[end:].lstrip()
+
+    def _parse_decorators(self, text, decorators, lineno):
+        """Move the leading field decorators of ``text`` to ``decorators``.
+
+        :return: the rest of the text.
+        """
+        while text.startswith('@'):
+            name, arguments, rest = self._split_decorator(text, lineno)
+            source = text[:len(text) - len(rest)].rstrip()
+            text = rest
+            parser = self.decorators.get(name)
+            value = parser.parse_lines([source]) if parser else None
+            if value is None:
+                raise _error("Wrong decorator '%s'" % (name, ), lineno)
+            if name in decorators:
+                # Like pyparsing, the tokens of all of them are put together
+                tokens = _tokens(decorators[name]) + _tokens(value)
+                if any(isinstance(token, ParseResults) for token in tokens):
+                    raise _error("Repeated decorator '%s'" % (name, ),
+                                 lineno)
+                value = ParseResults(tokens)
+            decorators[name] = value
+        return text
+
+    def _compile(self, expression, lineno):
+        try:
+            return compile(expression.strip(), '', 'eval')
+        except SyntaxError as e:
+            raise _error("Wrong expression, %s" % (e, ), lineno)
+
+    def _parse_creator(self, lines):
+        """Create the creator definitions from the body of the section."""
+        definitions = []
+        decorators = {}
+        for line in lines:
+            text = self._parse_decorators(line.text, decorators, line.lineno)
+            if not text:
+                continue
+            match = _CREATOR_RE.match(text)
+            if match is None:
+                raise _error("Creator rule expected", line.lineno)
+            expression = text[match.end():].strip()
+            definitions.append({
+                'source_format': match.group(1),
+                'source_tags': match.group(2)[1:-1].split(' '),
+                'expression': expression,
+                'function': self._compile(expression, line.lineno),
+                'type': 'creator',
+                'decorators': decorators})
+            decorators = {}
+        if decorators:
+            raise _error("Decorator without rule", lines[-1].lineno)
+        return definitions
+
+    def _parse_derived_or_calculated(self, type_, lines):
+        """Create the derived or calculated definition."""
+        decorators = {}
+        expression = None
+        for line in lines:
+            text = self._parse_decorators(line.text, decorators, line.lineno)
+            if not text:
+                continue
+            if expression is not None:
+                raise _error("Only one expression allowed", line.lineno)
+            expression = text.strip()
+            function = self._compile(expression, line.lineno)
+        if expression is None:
+            raise _error("Expression expected", lines[-1].lineno)
+        return {'source_format': type_,
+                'source_tags': None,
+                'expression': expression,
+                'function': function,
+                'type': type_,
+                'decorators': decorators}
@@ -17,10 +17,13 @@
 # along with JSONAlchemy; if not, write to the Free Software Foundation, Inc.,
 # 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
+import re
+
 from pyparsing import Keyword, Literal, SkipTo, Optional, quotedString, \
     removeQuotes
 
 from jsonalchemy.errors import FieldParserException
+from jsonalchemy.fast_parser import QUOTED_STRING, decorator_arguments
 from jsonalchemy.parser import DecoratorAfterEvalBaseExtensionParser
 from jsonalchemy.utils import try_to_eval
 
@@ -41,6 +44,9 @@ class ConnectParser(DecoratorAfterEvalBaseExtensionParser):
 
     __parsername__ = 'connect'
 
+    _arguments_re = re.compile(r'\(\s*(%s)\s*(?:,\s*([^)]*))?\)\Z' %
+                               (QUOTED_STRING, ))
+
     @classmethod
     def parse_element(cls, indent_stack):
         """Sets ``connect`` attribute to the rule"""
@@ -58,6 +64,16 @@ class ConnectParser(DecoratorAfterEvalBaseExtensionParser):
                         if toks.func else None
                     })
 
+    @classmethod
+    def parse_lines(cls, lines):
+        """Same as :meth:`parse_element` without pyparsing."""
+        arguments = decorator_arguments(lines[0], 'connect')
+        match = cls._arguments_re.match(arguments or '')
+        if match is None:
+            return None
+        return {'connected_field': match.group(1)[1:-1],
+                'update_function': match.group(2)}
+
     @classmethod
     def create_element(cls, rule, field_def, content, args):
         """Simply returns the list with the tuples"""
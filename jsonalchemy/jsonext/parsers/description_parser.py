@@ -17,6 +17,8 @@
 # along with JSONAlchemy; if not, write to the Free Software Foundation, Inc.,
 # 60 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
+import re
+
 from pyparsing import QuotedString, Keyword
 
 from jsonalchemy.parser import FieldBaseExtensionParser, \
@@ -49,6 +51,17 @@ class DescriptionParser(FieldBaseExtensionParser, ModelBaseExtensionParser):
         return (description | doc_double | doc_single)\
             .setResultsName('description')
 
+    @classmethod
+    def parse_lines(cls, lines):
+        """Same as :meth:`parse_element` without pyparsing."""
+        if len(lines) == 2 and lines[0] == 'description:':
+            lines = lines[1:]
+        match = re.match(r'(\"{3}|\'{3})(.*)\1\Z', lines[0], re.DOTALL)
+        if len(lines) != 1 or match is None or \
+                match.group(1) in match.group(2):
+            return None
+        return match.group(2)
+
     @classmethod
     def create_element(cls, rule, metadata):
         """Simply return of the string."""
@@ -64,6 +77,11 @@ class DescriptionParser(FieldBaseExtensionParser, ModelBaseExtensionParser):
         """The description should remain the one from the child model."""
         return current_value
 
+    @classmethod
+    def needed_for(cls, args, projection):
+        """The description never changes the record."""
+        return False
+
     @classmethod
     def evaluate(cls, *args, **kwargs):
         """Evaluate parser.
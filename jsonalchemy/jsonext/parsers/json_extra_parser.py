@@ -19,7 +19,9 @@
 
 """JSON parser extension."""
 
-from pyparsing import Keyword, Literal
+import re
+
+from pyparsing import Keyword, Literal, ParseResults
 
 from jsonalchemy.utils import try_to_eval
 from jsonalchemy.parser import FieldBaseExtensionParser, \
@@ -66,6 +68,20 @@ class JsonExtraParser(FieldBaseExtensionParser):
                 indentedBlock((json_dumps & json_loads), indent_stack)
                 ).setResultsName('json_ext')
 
+    @classmethod
+    def parse_lines(cls, lines):
+        """Same as :meth:`parse_element` without pyparsing."""
+        if lines[0] != 'json:' or len(lines) != 3:
+            return None
+        matches = [re.match(r'(dumps|loads)\s*,(.*)\Z', line, re.DOTALL)
+                   for line in lines[1:]]
+        if None in matches or matches[0].group(1) == matches[1].group(1):
+            return None
+        json_ext = ParseResults([match.group(2).strip() for match in matches])
+        for match in matches:
+            json_ext[match.group(1)] = match.group(2).strip()
+        return json_ext
+
     @classmethod
     def create_element(cls, rule, metadata):
         """Create the dictionary with the dump and load functions."""
@@ -86,14 +102,12 @@ class JsonExtraParser(FieldBaseExtensionParser):
     @classmethod
     def evaluate(cls, json, field_name, action, args):
         """Evaluate the dumps and loads functions depending on the action."""
-        from jsonalchemy.parser import FieldParser
         if action == 'set':
             try:
                 json._dict[field_name] = reduce(
                     lambda obj, key: obj[key],
                     args['dumps'],
-                    FieldParser.field_definitions(
-                        json.additional_info.namespace)
+                    json.metadata.field_parser.field_definitions()
                 )(json._dict_bson[field_name])
             except (KeyError, IndexError, TypeError):
                 json._dict[field_name] = json._dict_bson[field_name]
@@ -102,8 +116,7 @@ class JsonExtraParser(FieldBaseExtensionParser):
                 json._dict_bson[field_name] = reduce(
                     lambda obj, key: obj[key],
                     args['loads'],
-                    FieldParser.field_definitions(
-                        json.additional_info.namespace)
+                    json.metadata.field_parser.field_definitions()
                 )(json._dict[field_name])
             except (KeyError, IndexError, TypeError):
                 json._dict_bson[field_name] = json._dict[field_name]
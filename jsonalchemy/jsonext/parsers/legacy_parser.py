@@ -19,8 +19,9 @@
 
 import six
 
-from pyparsing import Keyword, originalTextFor, nestedExpr
+from pyparsing import Keyword, ParseResults, originalTextFor, nestedExpr
 
+from jsonalchemy.fast_parser import decorator_arguments
 from jsonalchemy.parser import DecoratorOnEvalBaseExtensionParser
 
 
@@ -58,6 +59,14 @@ class LegacyParser(DecoratorOnEvalBaseExtensionParser):
                 originalTextFor(nestedExpr("(", ")"))
                 ).setResultsName("legacy", listAllMatches=True)
 
+    @classmethod
+    def parse_lines(cls, lines):
+        """Same as :meth:`parse_element` without pyparsing."""
+        arguments = decorator_arguments(lines[0], 'legacy')
+        if arguments is None:
+            return None
+        return ParseResults([ParseResults([arguments])])
+
     @classmethod
     def create_element(cls, rule, field_def, content, metadata):
         """Special case of decorator.
@@ -105,7 +114,7 @@ class LegacyParser(DecoratorOnEvalBaseExtensionParser):
                         legacy_field].append(json_field)
 
     @classmethod
-    def evaluate(cls, value, metadata, args):
+    def evaluate(cls, value, metadata, args, source_tag=None):
         """Evaluate parser.
 
         This is a special case where the real evaluation of the decorator
@@ -18,12 +18,12 @@
 # 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
 import datetime
+import re
 import six
-from pyparsing import Keyword, Literal, SkipTo
+from pyparsing import Keyword, Literal, ParseResults, SkipTo
 
 # FIXME from invenio.base.globals import cfg
-from jsonalchemy.utils import try_to_eval
-
+from jsonalchemy.fast_parser import decorator_arguments
 from jsonalchemy.parser import DecoratorAfterEvalBaseExtensionParser
 
 
@@ -100,6 +100,13 @@ class MemoizeParser(DecoratorAfterEvalBaseExtensionParser):
                 Literal(')').suppress()
                 ).setResultsName("memoize")
 
+    @classmethod
+    def parse_lines(cls, lines):
+        """Same as :meth:`parse_element` without pyparsing."""
+        match = re.match(r'\(\s*([^)]*)\)\Z',
+                         decorator_arguments(lines[0], 'memoize') or '')
+        return None if match is None else ParseResults([match.group(1)])
+
     @classmethod
     def create_element(cls, rule, field_def, content, args):
         """Try to evaluate the memoize value to int.
@@ -133,28 +140,29 @@ class MemoizeParser(DecoratorAfterEvalBaseExtensionParser):
         #                                         'invenio.ext.cache:cache'))
         #
         # @cls.__cache.memoize(timeout=args)
+        def calculate(field_name):
+            # The path ends with 'function', the expression is next to it
+            field_def = reduce(
+                lambda obj, key: obj[key],
+                json.meta_metadata[field_name]['function'][:-1],
+                json.metadata.field_parser.field_definitions())
+            return json.metadata.field_parser.expression_function(
+                field_def['expression'], ('self', ))(json)
+
         def memoize(_id, field_name):
-            func = reduce(lambda obj, key: obj[key],
-                          json.meta_metadata[field_name]['function'],
-                          json.metadata.field_parser.field_definitions())
-            return try_to_eval(func, json.metadata.functions, self=json)
+            return calculate(field_name)
 
         if args == cls.DEFAULT_TIMEOUT:
             return
         if action == 'get':
             if args == 0:  # No cached version is stored, retrieve it
-                func = reduce(lambda obj, key: obj[key],
-                              json.meta_metadata[field_name]['function'],
-                              json.metadata.field_parser.field_definitions())
-                json._dict_bson[field_name] = try_to_eval(
-                    func,
-                    json.metadata.functions,
-                    self=json)
+                json._dict_bson[field_name] = calculate(field_name)
             else:
                 json._dict_bson[field_name] = memoize(json.get('_id'),
                                                       field_name)
         elif action == 'set':
             if args >= 0:  # Don't store anything
                 json._dict_bson[field_name] = None
+                json.invalidate(field_name)
 
 parser = MemoizeParser
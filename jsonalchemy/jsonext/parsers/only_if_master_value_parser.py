@@ -19,8 +19,7 @@
 
 from pyparsing import Keyword, originalTextFor, nestedExpr
 
-from jsonalchemy.utils import try_to_eval
-
+from jsonalchemy.fast_parser import decorator_arguments
 from jsonalchemy.parser import \
     DecoratorOnEvalBaseExtensionParser
 
@@ -51,18 +50,32 @@ class OnlyIfMasterValueParser(DecoratorOnEvalBaseExtensionParser):
                 ).setResultsName("only_if_master_value").setParseAction(
                     lambda toks: toks[0])
 
+    @classmethod
+    def parse_lines(cls, lines):
+        """Same as :meth:`parse_element` without pyparsing."""
+        return decorator_arguments(lines[0], 'only_if_master_value')
+
     @classmethod
     def create_element(cls, rule, field_def, content, metadata):
         """Simply return the list of boolean expressions."""
-        return compile(content, '', 'eval')
+        compile(content, '', 'eval')
+        return content
+
+    @classmethod
+    def prepare_arguments(cls, args, field_parser):
+        """Create the function evaluating the expressions.
+
+        The expressions can use ``value`` and ``source_tag``.
+        """
+        return field_parser.expression_function(args, ('value', 'source_tag'))
 
     @classmethod
-    def evaluate(cls, value, metadata, args):
+    def evaluate(cls, value, metadata, args, source_tag=None):
         """Evaluate ``args`` with the master value from the input.
 
         :returns: a boolean depending on evaluated ``value``.
         """
-        evaluated = try_to_eval(args, metadata.functions, value=value)
+        evaluated = args(value, source_tag)
         if not isinstance(evaluated, (list, tuple)):
             return evaluated
         else:
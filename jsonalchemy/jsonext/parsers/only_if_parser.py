@@ -19,8 +19,7 @@
 
 from pyparsing import Keyword, originalTextFor, nestedExpr
 
-from jsonalchemy.utils import try_to_eval
-
+from jsonalchemy.fast_parser import decorator_arguments
 from jsonalchemy.parser import \
     DecoratorBeforeEvalBaseExtensionParser
 
@@ -47,9 +46,21 @@ class OnlyIfParser(DecoratorBeforeEvalBaseExtensionParser):
                 ).setResultsName("only_if").setParseAction(
                     lambda toks: toks[0])
 
+    @classmethod
+    def parse_lines(cls, lines):
+        """Same as :meth:`parse_element` without pyparsing."""
+        return decorator_arguments(lines[0], 'only_if')
+
     @classmethod
     def create_element(cls, rule, field_def, content, metadata):
-        return compile(content, '', 'eval')
+        """Keep the expression, checking its syntax."""
+        compile(content, '', 'eval')
+        return content
+
+    @classmethod
+    def prepare_arguments(cls, args, field_parser):
+        """Create the function evaluating the expression with ``self``."""
+        return field_parser.expression_function(args, ('self', ))
 
     @classmethod
     def evaluate(cls, reader, args):
@@ -58,9 +69,7 @@ class OnlyIfParser(DecoratorBeforeEvalBaseExtensionParser):
         This is a special case where the real evaluation of the decorator
         is happening before the evaluation.
         """
-        evaluated = try_to_eval(
-            args, reader.metadata.functions,
-            self=reader._json)
+        evaluated = args(reader._json)
         if not isinstance(evaluated, (list, tuple)):
             return evaluated
         else:
@@ -17,8 +17,10 @@
 # along with JSONAlchemy; if not, write to the Free Software Foundation, Inc.,
 # 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
-from pyparsing import Keyword, Literal, delimitedList, quotedString, \
-    removeQuotes
+from pyparsing import Keyword, Literal, ParseResults, delimitedList, \
+    quotedString, removeQuotes
+
+from jsonalchemy.fast_parser import decorator_arguments, quoted_strings
 
 from jsonalchemy.parser import \
     DecoratorBeforeEvalBaseExtensionParser
@@ -47,6 +49,15 @@ class ParseFirstParser(DecoratorBeforeEvalBaseExtensionParser):
                 Literal(')').suppress()
                 ).setResultsName("parse_first")
 
+    @classmethod
+    def parse_lines(cls, lines):
+        """Same as :meth:`parse_element` without pyparsing."""
+        arguments = decorator_arguments(lines[0], 'parse_first')
+        if arguments is None:
+            return None
+        field_names = quoted_strings(arguments[1:-1].strip())
+        return None if field_names is None else ParseResults(field_names)
+
     @classmethod
     def create_element(cls, rule, field_def, content, metadata):
         return content.asList()
@@ -19,9 +19,13 @@
 
 """Producer parser extension."""
 
+import re
+
 from pyparsing import Suppress, OneOrMore, Word, alphanums, nestedExpr, \
-    originalTextFor, Keyword
+    originalTextFor, Keyword, ParseResults
 
+from jsonalchemy.errors import FieldParserException
+from jsonalchemy.fast_parser import skip_brackets
 from jsonalchemy.parser import FieldBaseExtensionParser, \
     FieldParser, PYTHON_ALLOWED_EXPR, indentedBlock
 
@@ -76,6 +80,28 @@ class ProducerParser(FieldBaseExtensionParser):
                 indentedBlock(OneOrMore(producer_body), indent_stack)
                 ).setResultsName('producer')
 
+    @classmethod
+    def parse_lines(cls, lines):
+        """Same as :meth:`parse_element` without pyparsing."""
+        if lines[0] != 'producer:' or len(lines) < 2:
+            return None
+        producers = []
+        for line in lines[1:]:
+            match = re.match(r'\w+\s*\(', line)
+            if match is None:
+                return None
+            try:
+                end = skip_brackets(line, match.end() - 1)
+            except FieldParserException:
+                return None
+            rule = line[end:].lstrip()
+            if not rule.startswith(','):
+                return None
+            producers.append({'code': match.group().rstrip('( \t'),
+                              'params': eval(line[match.end() - 1:end]),
+                              'rule': eval(rule[1:].strip())})
+        return ParseResults(producers)
+
     @classmethod
     def create_element(cls, rule, metadata):
         """Prepare the list of producers with their names and parameters."""
@@ -19,6 +19,8 @@
 
 from pyparsing import Keyword
 
+from jsonalchemy.errors import FieldParserException
+from jsonalchemy.fast_parser import skip_brackets
 from jsonalchemy.utils import try_to_eval
 from jsonalchemy.parser import FieldBaseExtensionParser, \
     DICT_DEF, indentedBlock
@@ -46,6 +48,19 @@ class SchemaParser(FieldBaseExtensionParser):
                 indentedBlock(DICT_DEF, indent_stack)
                 ).setParseAction(lambda toks: toks[0]).setResultsName('schema')
 
+    @classmethod
+    def parse_lines(cls, lines):
+        """Same as :meth:`parse_element` without pyparsing."""
+        if lines[0] != 'schema:' or len(lines) != 2 or \
+                not lines[1].startswith('{'):
+            return None
+        try:
+            if skip_brackets(lines[1], 0) != len(lines[1]):
+                return None
+        except FieldParserException:
+            return None
+        return lines[1]
+
     @classmethod
     def create_element(cls, rule, metadata):
         """Just evaluate the content of the schema to a python dictionary."""
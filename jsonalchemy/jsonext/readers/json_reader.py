@@ -19,65 +19,141 @@
 
 """Json Reader."""
 
-import re
+import importlib
+import json
 
+from six import BytesIO, StringIO, binary_type
+
+from jsonalchemy.errors import ReaderException
 from jsonalchemy.reader import Reader
 
 
+def json_decoder(decoder=None):
+    """Get the function decoding one JSON document.
+
+    :param decoder: ``None`` for :func:`json.loads`, the name of a module
+        with a compatible ``loads`` function (like ``'ujson'``, ``'orjson'``
+        or ``'simplejson'``) or the function itself.
+    :raises: :class:`~jsonalchemy.errors.ReaderException` if the module is
+        not installed.
+    """
+    if decoder is None:
+        return json.loads
+    if callable(decoder):
+        return decoder
+    try:
+        return importlib.import_module(decoder).loads
+    except (ImportError, AttributeError) as e:
+        raise ReaderException("Unable to use the JSON decoder '%s': %s"
+                              % (decoder, e))
+
+
+def split_ndjson(source, buffer_size=1024 * 1024, decoder=None):
+    """Decode the newline delimited JSON documents of ``source`` one by one.
+
+    ``source`` could be a string or an open file (in text or binary mode)
+    which is read in pieces of ``buffer_size`` characters, only the lines
+    not yet decoded are kept in memory.  Empty lines are ignored.
+
+    :param decoder: see :func:`json_decoder`.
+    :raises: :class:`~jsonalchemy.errors.ReaderException` if a line is not
+        valid JSON.
+    """
+    loads = json_decoder(decoder)
+    if not hasattr(source, 'read'):
+        source = (BytesIO if isinstance(source, binary_type)
+                  else StringIO)(source)
+
+    def decode(line, number):
+        try:
+            return loads(line)
+        except ValueError as e:
+            raise ReaderException("Invalid JSON in line %d: %s"
+                                  % (number, e))
+
+    number = 0
+    pieces = []
+    empty = ''
+    while True:
+        data = source.read(buffer_size)
+        if not data:
+            break
+        empty = data[:0]
+        lines = data.split(b'\n' if isinstance(data, binary_type)
+                           else u'\n')
+        if len(lines) == 1:
+            # The line goes on in the next piece
+            pieces.append(data)
+            continue
+        pieces.append(lines[0])
+        lines[0] = empty.join(pieces)
+        pieces = [lines.pop()]
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield decode(line, number)
+    line = empty.join(pieces)
+    if line.strip():
+        yield decode(line, number + 1)
+
+
 class JsonReader(Reader):
     """JSON reader."""
 
     __master_format__ = 'json'
 
     @staticmethod
-    def split_blob(blob, schema=None, **kwargs):
-        """
-        In case of several objs inside the blob this method specify how to
-        split then and work one by one afterwards.
+    def split_blob(blob, schema=None, buffer_size=1024 * 1024, decoder=None,
+                   **kwargs):
+        """Split newline delimited JSON, one document per line.
+
+        The documents are decoded as they are read, so they can be
+        translated straight away, see :func:`split_ndjson`.  The blob could
+        also be an open file, it is read in pieces of ``buffer_size``
+        characters so the memory used doesn't depend on its size.
+
+        .. code-block:: python
+
+            >>> with open('dump.ndjson', 'rb') as f:
+            ...     for json in translate_many(
+            ...             split_blob(f, 'json', decoder='ujson')):
+            ...         storage.save_one(json.dumps())
         """
-        return blob.splitlines()
+        return split_ndjson(blob, buffer_size, decoder)
 
     def _prepare_blob(self):
         """
 
         """
         model_fields = self.model_parser.resolve_models(
-            self._json.model_info.names).get('fields', {})
-        model_json_ids = list(model_fields.keys())
-        model_field_names = list(model_fields.values())
+            self._json.model_info.names)['fields']
+        field_names = self.model_parser.resolve_field_names(
+            self._json.model_info.names)
         for key in list(self._blob.keys()):
-            if key in model_field_names and key not in model_json_ids:
-                _key = model_json_ids[model_field_names.index(key)]
-                self._blob[_key] = self._blob[key]
-                del self._blob[key]
+            if key in field_names and key not in model_fields:
+                self._blob[field_names[key]] = self._blob.pop(key)
 
     def _get_elements_from_blob(self, regex_key):
         if regex_key in ('entire_record', '*'):
             return self._blob
         elements = []
         for k in regex_key:
-            regex = re.compile(k)
-            keys = filter(regex.match, self._blob.keys())
-            values = []
-            for key in keys:
-                values.append(self._blob.get(key))
-            elements.extend(values)
+            elements.extend(self._blob.get(key)
+                            for key in self._source_tag_keys(k, self._blob))
         return elements
 
     def _unpack_rule(self, json_id, field_name=None):
-        super(JsonReader, self)._unpack_rule(json_id, field_name)
+        return super(JsonReader, self)._unpack_rule(json_id, field_name)
 
-    def _apply_virtual_rules(self, json_id, field_name, rule):
+    def _apply_virtual_rules(self, json_id, field_name, field_plan):
         """JSON if a bit special as you can set the value of this fields"""
         if json_id in self._blob:
-            field_defs = []
-            field_defs.append(('calculated',
-                               rule['rules'].get('calculated', [])))
-            field_defs.append(('derived', rule['rules'].get('derived', [])))
-            for (field_type, ffield_def) in field_defs:
-                for field_def in ffield_def:
+            for field_type, rules in (('calculated', field_plan.calculated),
+                                      ('derived', field_plan.derived)):
+                for rule in rules:
                     info = self._find_field_metadata(json_id, field_name,
-                                                     field_type, field_def)
+                                                     field_type,
+                                                     rule.field_def)
                     self._json['__meta_metadata__'][field_name] = info
                     self._json.__setitem__(
                         field_name, self._blob[json_id], extend=False,
@@ -86,7 +162,7 @@ class JsonReader(Reader):
                     return
         else:
             super(JsonReader, self)._apply_virtual_rules(json_id, field_name,
-                                                         rule)
+                                                         field_plan)
 
 
 reader = JsonReader
@@ -23,39 +23,88 @@ Marc reader.
 This reader (or any) shouldn't be used directly, at least in the normal use
 cases. Instead :class:`~jsonalchemy.readers.Reader` should be
 used with the explicit format.
+
+Besides MARCXML the reader understands binary MARC21 (ISO 2709) records,
+see :func:`split_iso2709` and :func:`create_rec_tree_iso2709`.
 """
 
-import copy
+import mmap
 import re
+import threading
+import warnings
 import pkg_resources
 
-from six import iteritems, StringIO
+import six
+
+from six import BytesIO, StringIO, text_type
 from lxml import etree
 
 # FIXME from invenio.base.globals import cfg
 from jsonalchemy.errors import ReaderException
 from jsonalchemy.reader import Reader
-from jsonalchemy.utils import try_to_eval
 
 CFG_MARC21_DTD = pkg_resources.resource_filename(
     'jsonalchemy', 'MARC21slim.dtd')
 """Location of the MARC21 DTD file"""
 
+_thread_local = threading.local()
+"""Parser and DTD objects of each thread, lxml doesn't allow to share
+them between threads."""
+
+
+def xml_parser():
+    """Get the MARCXML parser of the current thread.
+
+    Creating a parser is expensive compared to the parsing of one record,
+    so each thread keeps using the same one.
+    """
+    parser = getattr(_thread_local, 'parser', None)
+    if parser is None:
+        parser = _thread_local.parser = etree.XMLParser(recover=True)
+    return parser
+
+
+def marc21_dtd():
+    """Get the MARC21 DTD, see :data:`CFG_MARC21_DTD`.
+
+    The DTD is loaded only once by each thread.
+
+    :return: :class:`lxml.etree.DTD` or ``None`` if the file can't be
+        loaded, in which case a warning is issued.
+    """
+    dtds = _thread_local.__dict__.setdefault('dtds', {})
+    try:
+        return dtds[CFG_MARC21_DTD]
+    except KeyError:
+        pass
+    try:
+        dtd = etree.DTD(CFG_MARC21_DTD)
+    except (etree.DTDParseError, IOError) as e:
+        warnings.warn("Unable to load the MARC21 DTD, the records are not "
+                      "validated: %s" % (e, ))
+        dtd = None
+    dtds[CFG_MARC21_DTD] = dtd
+    return dtd
+
 
 def create_record(marcxml, correct=False, keep_singletons=True):
     """Create a record object using the LXML parser.
 
-    If correct == 1, then perform DTD validation
+    If correct == 1, then perform DTD validation, see :func:`marc21_dtd`
     If correct == 0, then do not perform DTD validation
-    """
-    parser = etree.XMLParser(dtd_validation=correct, recover=True)
 
+    :raises: :class:`~jsonalchemy.errors.ReaderException` if the record
+        doesn't follow the DTD.
+    """
     if correct:
-        marcxml = '<?xml version="1.0" encoding="UTF-8"?>\n' \
-                  '<!DOCTYPE collection SYSTEM "file://%s">\n' \
-                  '<collection>\n%s\n</collection>' % (CFG_MARC21_DTD, marcxml)
+        marcxml = '<collection>\n%s\n</collection>' % (marcxml, )
 
-    tree = etree.parse(StringIO(marcxml), parser)
+    tree = etree.parse(StringIO(marcxml), xml_parser())
+    if correct:
+        dtd = marc21_dtd()
+        if dtd is not None and not dtd.validate(tree):
+            raise ReaderException("Invalid MARCXML record: %s"
+                                  % (dtd.error_log.last_error, ))
     record = {}
     field_position_global = 0
 
@@ -105,6 +154,374 @@ def create_record(marcxml, correct=False, keep_singletons=True):
     return record
 
 
+class SaveDict(dict):
+
+    """Dictionary returning ``None`` for missing keys."""
+
+    __getitem__ = dict.get
+
+
+def dict_extend_helper(d, key, value):
+    """Helper function.
+
+    If the key is present inside the dictionary it creates a list (if
+    not present) and extends it with the new value.
+    Almost as in `list.extend`
+    """
+    if key in d:
+        current_value = d.get(key)
+        if not isinstance(current_value, list):
+            current_value = [current_value]
+        current_value.append(value)
+        value = current_value
+    d[key] = value
+
+
+def _element_text(element):
+    text = element.text
+    return '' if text is None else text.encode("UTF-8")
+
+
+def create_rec_tree(tree, keep_singletons=True):
+    """Create the intermediate structure used by :class:`MarcReader`.
+
+    It is built straight from a parsed ``<record>`` element (or a tree
+    containing one).  The control fields are lists of values and the data
+    fields dictionaries of subfields, using ``tag + ind1 + ind2`` as key.
+    """
+    rec_tree = SaveDict()
+
+    def add_field(tag, ind1, ind2, text, field):
+        if tag < '010' and tag.isdigit():
+            rec_tree.setdefault(tag, []).append(text)
+        else:
+            dict_extend_helper(
+                rec_tree, (tag + ind1 + ind2).replace(' ', '_'), field)
+
+    for controlfield in tree.iter(tag='{*}controlfield'):
+        tag = controlfield.attrib.get('tag', '!').encode("UTF-8")
+        text = _element_text(controlfield)
+        if text or keep_singletons:
+            add_field(tag, ' ', ' ', text, SaveDict())
+
+    for datafield in tree.iter(tag='{*}datafield'):
+        tag = datafield.attrib.get('tag', '!').encode("UTF-8")
+        ind1 = datafield.attrib.get('ind1', '!').encode("UTF-8")
+        ind2 = datafield.attrib.get('ind2', '!').encode("UTF-8")
+        if ind1 in ('', '_'):
+            ind1 = ' '
+        if ind2 in ('', '_'):
+            ind2 = ' '
+        field = SaveDict()
+        for subfield in datafield.iter(tag='{*}subfield'):
+            text = _element_text(subfield)
+            if text or keep_singletons:
+                dict_extend_helper(
+                    field, subfield.attrib.get('code', '!').encode("UTF-8"),
+                    text)
+        if field or keep_singletons:
+            add_field(tag, ind1, ind2, '', field)
+
+    return rec_tree
+
+
+ISO2709_FIELD_TERMINATOR = b'\x1e'
+"""End of each variable field and of the directory."""
+
+ISO2709_SUBFIELD_DELIMITER = b'\x1f'
+"""Start of each subfield, followed by its code."""
+
+_ISO2709_LEADER_LENGTH = 24
+_ISO2709_DIRECTORY_ENTRY_LENGTH = 12
+
+if six.PY2:  # pragma: no cover
+    _binary_types = (bytearray, memoryview, mmap.mmap,
+                     buffer)  # noqa pylint: disable=E0602
+
+    def _record_view(data, start, length):
+        # memoryview doesn't support mmap in python 2
+        return buffer(data, start, length)  # noqa pylint: disable=E0602
+
+    def _bytes(data):
+        if isinstance(data, memoryview):
+            return data.tobytes()
+        return bytes(data)
+else:
+    _binary_types = (bytearray, memoryview, mmap.mmap)
+    _bytes = bytes
+
+    def _record_view(data, start, length):
+        return memoryview(data)[start:start + length]
+
+
+def _record_length(data, start):
+    """Read the length of the record starting at ``start`` from its leader."""
+    length = _bytes(data[start:start + 5])
+    if not length.isdigit() or int(length) < _ISO2709_LEADER_LENGTH:
+        raise ReaderException("Invalid ISO 2709 leader at byte %d: %r"
+                              % (start, _bytes(data[start:start + 24])))
+    return int(length)
+
+
+def split_iso2709(source, buffer_size=1024 * 1024):
+    """Split binary MARC21 (ISO 2709) records using the length in the leader.
+
+    ``source`` could be a byte string, any object with the buffer interface
+    or an open file.  Each record is yielded as a view of ``source`` (or of
+    the file, mapped in memory with :mod:`mmap`) so no record is ever
+    copied.  The files which can't be mapped (i.e. pipes) are read in pieces
+    of ``buffer_size`` bytes and their records are copied instead.
+
+    The memory map is closed once all the records are read (or the
+    generator is closed), the views of a mapped file can't be used after
+    that, copy them with ``bytes()`` to keep them.
+
+    The line breaks some tools add between the records are ignored.
+
+    :raises: :class:`~jsonalchemy.errors.ReaderException` if a leader is not
+        valid or the last record is truncated.
+    """
+    if hasattr(source, 'read'):
+        try:
+            data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError):
+            # Not a real file (or an empty one)
+            for record in _split_iso2709_stream(source, buffer_size):
+                yield record
+            return
+        try:
+            for record in _split_iso2709_data(data):
+                yield record
+        finally:
+            try:
+                data.close()
+            except BufferError:
+                # Python 3 doesn't close it while a view is still used, it
+                # is closed when the views are garbage collected.
+                pass
+    else:
+        for record in _split_iso2709_data(source):
+            yield record
+
+
+def _split_iso2709_data(data):
+    """Split the records of ``data``, see :func:`split_iso2709`."""
+    start, size = 0, len(data)
+    while start < size:
+        if _bytes(data[start:start + 1]) in b'\r\n':
+            start += 1
+            continue
+        length = _record_length(data, start)
+        if start + length > size:
+            raise ReaderException("Truncated ISO 2709 record at byte %d"
+                                  % (start, ))
+        yield _record_view(data, start, length)
+        start += length
+
+
+def _split_iso2709_stream(source, buffer_size):
+    """Split the records of a file which can't be mapped in memory."""
+    buf = bytearray()
+    offset = 0
+    while True:
+        data = source.read(buffer_size)
+        buf.extend(data)
+        start = 0
+        while start < len(buf):
+            if _bytes(buf[start:start + 1]) in b'\r\n':
+                start += 1
+                continue
+            if len(buf) - start < 5:
+                break
+            length = _record_length(buf, start)
+            if start + length > len(buf):
+                break
+            yield bytes(buf[start:start + length])
+            start += length
+        offset += start
+        del buf[:start]
+        if not data:
+            if buf:
+                raise ReaderException("Truncated ISO 2709 record at byte %d"
+                                      % (offset, ))
+            return
+
+
+class Iso2709RecTree(SaveDict):
+
+    """Intermediate structure of a binary MARC21 record.
+
+    It has the same keys and values as the one created by
+    :func:`create_rec_tree`, however only the directory of the record is
+    read up front.  The value of each key is decoded from the record the
+    first time it is used, most of the fields of a record are never used by
+    the field definitions.
+    """
+
+    def __init__(self, record, fields):
+        """Initialize the structure.
+
+        :param record: the binary record.
+        :param fields: dictionary ``{key: [(tag, start, end), ...]}`` with the
+            position of the data of each field in ``record``.
+        """
+        super(Iso2709RecTree, self).__init__(
+            (key, None) for key in fields)
+        self._record = record
+        self._pending = fields
+
+    def _decode(self, key):
+        """Decode the fields of ``key`` and store them."""
+        value = None
+        for tag, start, end in self._pending.pop(key):
+            data = _bytes(self._record[start:end])
+            if tag < '010' and tag.isdigit():
+                value = (value or []) + [data]
+                continue
+            field = SaveDict()
+            for subfield in data.split(ISO2709_SUBFIELD_DELIMITER)[1:]:
+                dict_extend_helper(field, subfield[:1], subfield[1:])
+            if value is None:
+                value = field
+            else:
+                value = value if isinstance(value, list) else [value]
+                value.append(field)
+        dict.__setitem__(self, key, value)
+        return value
+
+    def decode_all(self):
+        """Decode all the fields not used yet."""
+        for key in list(self._pending):
+            self._decode(key)
+
+    def get(self, key, default=None):
+        """Get the value of ``key``, decoding it if needed."""
+        if key in self._pending:
+            return self._decode(key)
+        return dict.get(self, key, default)
+
+    __getitem__ = get
+
+    def __setitem__(self, key, value):
+        self._pending.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._pending.pop(key, None)
+        dict.__delitem__(self, key)
+
+    def __eq__(self, other):
+        self.decode_all()
+        if isinstance(other, Iso2709RecTree):
+            other.decode_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        self.decode_all()
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        self.decode_all()
+        return (SaveDict, (dict(self), ))
+
+    def _decoding(method):  # pylint: disable=E0213
+        def wrapper(self, *args, **kwargs):
+            self.decode_all()
+            return method(self, *args, **kwargs)
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+    copy = _decoding(dict.copy)
+    items = _decoding(dict.items)
+    values = _decoding(dict.values)
+    pop = _decoding(dict.pop)
+    popitem = _decoding(dict.popitem)
+    setdefault = _decoding(dict.setdefault)
+    if six.PY2:  # pragma: no cover
+        iteritems = _decoding(dict.iteritems)  # pylint: disable=E1101
+        itervalues = _decoding(dict.itervalues)  # pylint: disable=E1101
+        viewitems = _decoding(dict.viewitems)  # pylint: disable=E1101
+        viewvalues = _decoding(dict.viewvalues)  # pylint: disable=E1101
+    del _decoding
+
+
+def create_rec_tree_iso2709(record):
+    """Create the intermediate structure of a binary MARC21 record.
+
+    Only the leader and the directory are read, the data of the fields is
+    decoded on demand, see :class:`Iso2709RecTree`.  As for MARCXML the
+    values are UTF-8 encoded byte strings, the records whose leader declares
+    a different character coding (MARC-8) are not converted.
+
+    :param record: the binary record, i.e. as yielded by
+        :func:`split_iso2709`.
+    :raises: :class:`~jsonalchemy.errors.ReaderException` if the directory
+        of the record is not valid.
+    """
+    length = _record_length(record, 0)
+    leader = _bytes(record[:_ISO2709_LEADER_LENGTH])
+    base_address = leader[12:17]
+    if len(record) < length or not base_address.isdigit() or \
+            not _ISO2709_LEADER_LENGTH < int(base_address) <= length:
+        raise ReaderException("Invalid ISO 2709 leader: %r" % (leader, ))
+    base_address = int(base_address)
+    directory = _bytes(record[_ISO2709_LEADER_LENGTH:base_address - 1])
+
+    fields = {}
+    for entry in range(0, len(directory) - _ISO2709_DIRECTORY_ENTRY_LENGTH + 1,
+                       _ISO2709_DIRECTORY_ENTRY_LENGTH):
+        tag = directory[entry:entry + 3]
+        field_length = directory[entry + 3:entry + 7]
+        field_start = directory[entry + 7:entry + 12]
+        if not field_length.isdigit() or not field_start.isdigit():
+            raise ReaderException("Invalid ISO 2709 directory entry: %r"
+                                  % (directory[entry:entry + 12], ))
+        start = base_address + int(field_start)
+        end = start + int(field_length)
+        if end > length:
+            raise ReaderException("ISO 2709 field %r out of the record"
+                                  % (tag, ))
+        if _bytes(record[end - 1:end]) == ISO2709_FIELD_TERMINATOR:
+            end -= 1
+        if not isinstance(tag, str):
+            tag = tag.decode('ascii')
+        if tag < '010' and tag.isdigit():
+            key = tag
+        else:
+            indicators = _bytes(record[start:start + 2])
+            if not isinstance(indicators, str):
+                indicators = indicators.decode('utf-8', 'replace')
+            key = (tag + indicators).replace(' ', '_')
+        fields.setdefault(key, []).append((tag, start, end))
+
+    return Iso2709RecTree(record, fields)
+
+
+def iterparse_records(source):
+    """Parse the ``<record>`` elements of a MARCXML file one at a time.
+
+    ``source`` is an open file (or a file name) which is read incrementally.
+    The intermediate structure of each record is yielded, see
+    :func:`create_rec_tree`.  The elements are cleared, together with the
+    references kept by their parent, once their structure is created,
+    therefore the memory used doesn't depend on the size of the collection
+    and the records can be kept as long as needed.
+    """
+    for dummy, element in etree.iterparse(source, events=('end', ),
+                                          tag='{*}record', recover=True):
+        rec_tree = create_rec_tree(element)
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+        yield rec_tree
+
+
 class MarcReader(Reader):
 
     """Marc reader."""
@@ -113,18 +530,64 @@ class MarcReader(Reader):
 
     split_marc = re.compile('<record.*?>.*?</record>', re.DOTALL)
 
+    def __init__(self, json, blob=None, metadata=None, schema=None,
+                 **kwargs):
+        """Keep the ``schema`` of the blob, see :meth:`_prepare_blob`."""
+        self._schema = schema
+        super(MarcReader, self).__init__(json, blob=blob, metadata=metadata,
+                                         **kwargs)
+
     @staticmethod
-    def split_blob(blob, schema=None, **kwargs):
+    def split_blob(blob, schema=None, buffer_size=1024 * 1024, parsed=False,
+                   **kwargs):
         """Split the blob using <record.*?>.*?</record> as pattern.
 
+        If ``schema`` is ``'iso2709'`` the blob contains binary MARC21
+        records instead, see :func:`split_iso2709`.
+
+        The blob could be also an open file, it is read in pieces of
+        ``buffer_size`` characters, therefore only the records not yet
+        consumed are kept in memory.
+
+        If ``parsed`` is set the intermediate structures of the records are
+        yielded instead, see :func:`iterparse_records`.  They can be
+        translated directly and the XML is parsed only once.
+
         Note 1: Taken from invenio.legacy.bibrecord:create_records
         Note 2: Use the DOTALL flag to include newlines.
         """
-        if schema in (None, 'xml'):
+        if schema == 'iso2709':
+            for record in split_iso2709(blob, buffer_size):
+                yield record
+            return
+        if schema not in (None, 'xml'):
+            return
+        if parsed:
+            if not hasattr(blob, 'read'):
+                if isinstance(blob, text_type):
+                    blob = blob.encode('utf-8')
+                blob = BytesIO(blob)
+            for rec_tree in iterparse_records(blob):
+                yield rec_tree
+            return
+        if not hasattr(blob, 'read'):
             for match in MarcReader.split_marc.finditer(blob):
                 yield match.group()
-        else:
-            raise StopIteration()
+            return
+
+        buf = ''
+        while True:
+            data = blob.read(buffer_size)
+            buf += data
+            end = 0
+            for match in MarcReader.split_marc.finditer(buf):
+                yield match.group()
+                end = match.end()
+            if not data:
+                return
+            # Keep only what might be the beginning of the next record
+            start = buf.find('<record', end)
+            buf = buf[start:] if start >= 0 else buf[-len('<record'):]
 
     def guess_model_from_input(self):
         """Guess from the input Marc the model to be used in this record.
@@ -158,52 +621,42 @@ class MarcReader(Reader):
         if regex_key in ('entire_record', '*'):
             return self.rec_tree
         for k in regex_key:
-            regex = re.compile(k)
-            keys = filter(regex.match, self.rec_tree.keys())
-            for key in keys:
-                if key in self.rec_tree:
-                    return (key, self.rec_tree.get(key, []))
+            keys = self._source_tag_keys(k, self.rec_tree)
+            if keys:
+                return (keys[0], self.rec_tree.get(keys[0], []))
         return ('', [])
 
     def _prepare_blob(self, *args, **kwargs):
-        """Transform the incoming blob into recstruct.
+        """Transform the incoming blob into the intermediate structure.
+
+        The blob could be a MARCXML string, a ``<record>`` element (see
+        :func:`iterparse_records`), a binary MARC21 record (see
+        :func:`create_rec_tree_iso2709`) or the intermediate structure itself.
+        The ``schema`` given to the reader (``'xml'`` or ``'iso2709'``, as in
+        :meth:`split_blob`) tells the strings apart, without it the records
+        split from binary MARC21 are recognized by their type and any other
+        string by the record length at the beginning of its leader.
+        The elements are usually cleared after the translation, therefore
+        they are replaced by their intermediate structure.
 
         FIXME: stop using recstruct!
         """
+        if isinstance(self._blob, SaveDict):
+            self.rec_tree = self._blob
+        elif etree.iselement(self._blob):
+            self.rec_tree = self._blob = create_rec_tree(self._blob)
+        elif self._schema == 'iso2709' or self._schema is None and (
+                isinstance(self._blob, _binary_types) or
+                self._blob[:5].isdigit()):
+            self.rec_tree = create_rec_tree_iso2709(self._blob)
+        elif isinstance(self._blob, _binary_types):
+            self.rec_tree = create_rec_tree(etree.parse(
+                BytesIO(_bytes(self._blob)), xml_parser()))
+        else:
+            self.rec_tree = create_rec_tree(etree.parse(
+                StringIO(self._blob), xml_parser()))
 
-        class SaveDict(dict):
-            __getitem__ = dict.get
-
-        def dict_extend_helper(d, key, value):
-            """Helper function.
-
-            If the key is present inside the dictionary it creates a list (if
-            not present) and extends it with the new value.
-            Almost as in `list.extend`
-            """
-            if key in d:
-                current_value = d.get(key)
-                if not isinstance(current_value, list):
-                    current_value = [current_value]
-                current_value.append(value)
-                value = current_value
-            d[key] = value
-        self.rec_tree = SaveDict()
-        record = create_record(self._blob)
-
-        for key, values in iteritems(record):
-            if key < '010' and key.isdigit():
-                self.rec_tree[key] = [value[3] for value in values]
-            else:
-                for value in values:
-                    field = SaveDict()
-                    for subfield in value[0]:
-                        dict_extend_helper(field, subfield[0], subfield[1])
-                    dict_extend_helper(
-                        self.rec_tree,
-                        (key + value[1] + value[2]).replace(' ', '_'), field)
-
-    def _apply_rules(self, json_id, field_name, rule):
+    def _apply_rules(self, json_id, field_name, field_plan):
         """Override default behavior.
 
         See :meth:`~jsonalchemy.readers.Reader._apply_rules`.
@@ -217,30 +670,26 @@ class MarcReader(Reader):
             :meth:`~jsonalchemy.readers.Reader._apply_rules`
         :param field_name: as in
             :meth:`~jsonalchemy.readers.Reader._apply_rules`
-        :param rule: as in
+        :param field_plan: as in
             :meth:`~jsonalchemy.readers.Reader._apply_rules`
         """
-        for field_def in rule['rules'].get(
-                self._json.additional_info.master_format, []):
-            if not self._evaluate_before_decorators(field_def):
+        for rule in field_plan.creator:
+            if not self._evaluate_before_decorators(rule):
                 continue
+            field_def = rule.field_def
             marc_tag, elements = self._get_elements_from_blob(
                 field_def['source_tags'])
             if not isinstance(elements, (list, tuple)):
                 elements = (elements, )
             for element in elements:
-                tmp_field_def = copy.deepcopy(field_def)
-                tmp_field_def['source_tags'] = [marc_tag, ]
-                if not self._evaluate_on_decorators(tmp_field_def, element):
+                if not self._evaluate_on_decorators(rule, element, marc_tag):
                     continue
                 try:
-                    value = try_to_eval(
-                        tmp_field_def['function'],
-                        self.metadata.functions,
-                        value=element, self=self._json)
+                    value = rule.function(element, self._json)
                     self._remove_none_values(value)
-                    info = self._find_field_metadata(json_id, field_name,
-                                                     'creator', tmp_field_def)
+                    info = self._find_field_metadata(
+                        json_id, field_name, 'creator', field_def,
+                        source_tags=[marc_tag])
                     self._json['__meta_metadata__'][field_name] = info
                     self._json.__setitem__(field_name, value, extend=True,
                                            exclude=['decorators',
@@ -20,13 +20,19 @@
 """Fields and models configuration loader.
 
 This module uses `pyparsing <http://pyparsing.wikispaces.com/>`_ to read
-from thedifferent configuration files the field and model definitions.
+from thedifferent configuration files the field and model definitions.  The
+field definitions are read by default with the faster
+:mod:`jsonalchemy.fast_parser`, using pyparsing only as a fallback.
 
 Default extensions to both parsers could be added inside
 :mod:`jsonalchemy.jsonext.parsers`
 """
+import multiprocessing
 import os
+import pickle
 import six
+import threading
+import warnings
 
 from pyparsing import ParseException, FollowedBy, Suppress, OneOrMore, Word, \
     LineEnd, ZeroOrMore, Optional, Literal, alphas, alphanums, \
@@ -34,7 +40,12 @@ from pyparsing import ParseException, FollowedBy, Suppress, OneOrMore, Word, \
     empty, col, restOfLine, delimitedList, Each, Keyword, commaSeparatedList, \
     Group
 
+from .cache import DefinitionsPickler, DefinitionsUnpickler, file_digest
 from .errors import FieldParserException, ModelParserException
+from .fast_parser import FastFieldParser
+from .plan import SourceTagIndex, create_execution_plan, \
+    create_field_plan, field_closure
+from .utils import FrozenDict, compile_expression
 
 ParseException.defaultWhitespaceChars = (' \r\t')
 
@@ -149,6 +160,7 @@ def _create_field_parser(metadata):
     ).setParseAction(lambda toks: {
         'source_format': toks[-3],
         'source_tags': toks[-2].split(' '),
+        'expression': toks[-1].strip(),
         'function': compile(toks[-1].strip(), '', 'eval'),
         'type': 'creator',
         'decorators': toks.decorators.asDict()}
@@ -165,6 +177,7 @@ def _create_field_parser(metadata):
     ).setParseAction(lambda toks: {
         'source_format': 'derived',
         'source_tags': None,
+        'expression': toks[-1].strip(),
         'function': compile(toks[-1].strip(), '', 'eval'),
         'type': 'derived',
         'decorators': toks.decorators.asDict()}).setResultsName('derived_def')
@@ -174,6 +187,7 @@ def _create_field_parser(metadata):
     ).setParseAction(lambda toks: {
         'source_format': 'calculated',
         'source_tags': None,
+        'expression': toks[-1].strip(),
         'function': compile(toks[-1].strip(), '', 'eval'),
         'type': 'calculated',
         'decorators': toks.decorators.asDict()
@@ -246,12 +260,109 @@ def _create_model_parser(metadata):
     return ZeroOrMore(COMMENT) & rules
 
 
+def _model_name(model_file):
+    """Get the model name from its file name."""
+    return os.path.basename(model_file).split('.')[0]
+
+
+def _parse_field_file(parser, field_file):
+    """Parse one configuration file and return the list of its rules."""
+    try:
+        return list(parser.parseFile(field_file, parseAll=True))
+    except ParseException as e:
+        raise FieldParserException(
+            "Cannot parse file '%s',\n%s" % (field_file, str(e)))
+
+
+def _create_field_file_parser(metadata):
+    """Create a function that parses one field configuration file.
+
+    Depending on ``metadata.parser_backend`` the files are parsed using
+    :class:`~jsonalchemy.fast_parser.FastFieldParser` or the pyparsing
+    grammar.  The fast parser falls back to the grammar for any file it can't
+    parse, so the error reported (if any) is always the one from pyparsing.
+    """
+    grammar = []
+
+    def parse_with_pyparsing(field_file):
+        if not grammar:
+            grammar.append(_create_field_parser(metadata))
+        return _parse_field_file(grammar[0], field_file)
+
+    if metadata.parser_backend == 'pyparsing':
+        return parse_with_pyparsing
+
+    fast_parser = FastFieldParser(metadata)
+
+    def parse(field_file):
+        try:
+            return fast_parser.parse_file(field_file)
+        except FieldParserException:
+            return parse_with_pyparsing(field_file)
+    return parse
+
+
+_pool_field_parser = None
+"""Field parser of the current process, see :func:`_parse_in_pool`."""
+
+
+def _init_pool_worker(packages, parser_backend):
+    """Create the field parser once per process of the pool."""
+    global _pool_field_parser
+    from .registry import MetaData
+    _pool_field_parser = _create_field_file_parser(
+        MetaData(packages, parser_backend=parser_backend))
+
+
+def _parse_in_pool_worker(field_file):
+    """Parse one file inside a process of the pool.
+
+    The parsed rules contain code objects, they are serialized using
+    :class:`~jsonalchemy.cache.DefinitionsPickler`.
+    """
+    try:
+        rules = _pool_field_parser(field_file)
+    except FieldParserException as e:
+        return field_file, None, str(e)
+    buf = six.BytesIO()
+    DefinitionsPickler(buf, pickle.HIGHEST_PROTOCOL).dump(rules)
+    return field_file, buf.getvalue(), None
+
+
+def _parse_in_pool(metadata, field_files):
+    """Parse the field configuration files using a pool of processes.
+
+    Each process builds its own grammar from the packages of ``metadata``,
+    parses some files and sends back the rules.  The rules are merged later on
+    by :meth:`FieldParser._resolve` inside the calling process.
+    """
+    pool = multiprocessing.Pool(
+        min(metadata.parse_processes, len(field_files)),
+        initializer=_init_pool_worker,
+        initargs=([package.package for package in metadata.packages],
+                  metadata.parser_backend))
+    try:
+        results = pool.map(_parse_in_pool_worker, field_files)
+    finally:
+        pool.close()
+        pool.join()
+
+    parsed_files = {}
+    for field_file, rules, error in results:
+        if error is not None:
+            raise FieldParserException(error)
+        parsed_files[field_file] = (
+            file_digest(field_file),
+            DefinitionsUnpickler(six.BytesIO(rules)).load())
+    return parsed_files
+
+
 class FieldParser(object):
 
     """Field definitions parser."""
 
     def __init__(self, metadata):
-        """Initialize."""
+        """Initialize and register it as the field parser of ``metadata``."""
         # Autodiscover cfg files
         self.metadata = metadata
         self.metadata.field_parser = self
@@ -259,6 +370,24 @@ class FieldParser(object):
         self._field_definitions = None
         """List of all the rules needed to create and validate json fields."""
 
+        self._lock = threading.RLock()
+        self._created = False
+        """Lock and flag for the creation of the field definitions."""
+
+        self._functions = {}
+        """Functions created from the expressions and their arguments."""
+
+        self._source_tag_indexes = {}
+        """Index of the source tags of the rules of each master format."""
+
+        self.info_templates = {}
+        """Meta-metadata of the fields, without timestamp, shared by the
+        readers, see :meth:`~jsonalchemy.reader.Reader._find_field_metadata`.
+        """
+
+        self._parsed_files = None
+        """Digest and parsed rules of each configuration file."""
+
     def field_extensions(self):
         """Get the field parser extensions from the parser registry."""
         return self.metadata.field_extensions
@@ -279,14 +408,144 @@ class FieldParser(object):
         """
         Get all the field definitions from a given namespace.
 
-        If the namespace does not exist, it tries to create it first
+        If the namespace does not exist, it tries to create it first, only
+        once even if several threads ask for them at the same time.
         """
-        if self._field_definitions is None:
-            self._create()
+        if not self._created:
+            with self._lock:
+                if self._field_definitions is None:
+                    self._create()
+                    self._created = True
         return self._field_definitions
 
+    def expression_function(self, expression, arguments=('value', 'self')):
+        """Get the function evaluating the python ``expression``.
+
+        The function is created only once for each expression, see
+        :func:`~jsonalchemy.utils.compile_expression`.  The names which can't
+        be resolved are reported with a warning when it gets created.
+
+        :param arguments: Names of the parameters of the function.
+        """
+        key = (expression, arguments)
+        try:
+            return self._functions[key]
+        except KeyError:
+            pass
+        function, unresolved = compile_expression(
+            expression, self.metadata.functions, arguments)
+        if unresolved:
+            warnings.warn("Unable to resolve %s in the expression '%s'"
+                          % (', '.join(unresolved), expression))
+        self._functions[key] = function
+        return function
+
+    def source_tag_index(self, master_format):
+        """Get the index of the source tags used by ``master_format`` rules.
+
+        It is created only once for each master format, see
+        :class:`~jsonalchemy.plan.SourceTagIndex`.
+        """
+        try:
+            return self._source_tag_indexes[master_format]
+        except KeyError:
+            pass
+        index = SourceTagIndex(
+            source_tag
+            for definition in six.itervalues(self.field_definitions())
+            for field_def in definition.get('rules', {}).get(master_format, [])
+            for source_tag in field_def['source_tags'])
+        self._source_tag_indexes[master_format] = index
+        return index
+
     def reparse(self):
-        self._create()
+        """Parse again the configuration files.
+
+        Only the files that changed since the last time they were parsed (or
+        that were added or removed) are parsed again, and only the field
+        definitions affected by them are created again.  A field definition is
+        affected if any of the rules defining, extending or overriding it comes
+        from one of those files, or if it is connected, using ``@connect``, to
+        another affected field.
+
+        The plans of the model parser of the metadata are created again too,
+        see :meth:`ModelParser.execution_plan`.
+
+        :return: set of json_ids whose definition has been created again.
+        """
+        self._source_tag_indexes = {}
+        self.info_templates = {}
+        model_parser = getattr(self.metadata, '_model_parser', None)
+        if model_parser is not None and model_parser.field_parser is self:
+            model_parser._clear_plans()  # pylint: disable=W0212
+        if self._parsed_files is None:
+            self._create()
+            return set(self._field_definitions.keys())
+
+        parsed_files = {}
+        dirty = set()
+        for field_file in self.metadata.fields:
+            if field_file in self._parsed_files and \
+                    self._parsed_files[field_file][0] == \
+                    file_digest(field_file):
+                parsed_files[field_file] = self._parsed_files[field_file]
+            else:
+                dirty.add(field_file)
+        parsed_files.update(self._parse_files(list(dirty)))
+        dirty.update(set(self._parsed_files) - set(parsed_files))
+
+        if not dirty:
+            return set()
+
+        json_ids = set()
+        for field_file in dirty:
+            for parsed in (self._parsed_files, parsed_files):
+                if field_file in parsed:
+                    json_ids.update(rule.field['json_id']
+                                    for rule in parsed[field_file][1])
+        json_ids = self._connected_fields(json_ids)
+
+        for json_id in json_ids:
+            self._field_definitions.pop(json_id, None)
+        self._remove_legacy_field_matchings(json_ids)
+
+        self._parsed_files = parsed_files
+        try:
+            self._resolve(json_ids)
+        except FieldParserException:
+            # Next time everything will be parsed again
+            self._parsed_files = None
+            raise
+        self._dump_to_cache()
+        return json_ids
+
+    def _connected_fields(self, json_ids):
+        """Extend ``json_ids`` with all the fields connected to them."""
+        json_ids = set(json_ids)
+        pending = list(json_ids)
+        while pending:
+            json_id = pending.pop()
+            definition = self._field_definitions.get(json_id, {})
+            for field_defs in six.itervalues(definition.get('rules', {})):
+                for field_def in field_defs:
+                    for connect in field_def['decorators']['after'].get(
+                            'connect', []):
+                        if connect['connected_field'] not in json_ids:
+                            json_ids.add(connect['connected_field'])
+                            pending.append(connect['connected_field'])
+        return json_ids
+
+    def _remove_legacy_field_matchings(self, json_ids):
+        """Remove the legacy matchings pointing to any of ``json_ids``."""
+        matchings = getattr(self.metadata, '_legacy_field_matchings', None)
+        for legacy_fields in six.itervalues(matchings or {}):
+            for legacy_field, json_fields in list(six.iteritems(
+                    legacy_fields)):
+                json_fields[:] = [
+                    json_field for json_field in json_fields
+                    if json_field.split('.')[0] not in json_ids]
+                if not json_fields:
+                    del legacy_fields[legacy_field]
 
     def _create(self):
         """
@@ -295,23 +554,73 @@ class FieldParser(object):
         Fills up _field_definitions dictionary with
         the rules defined inside the configuration files.
 
+        If the metadata has a definitions cache and it contains an entry for
+        the current configuration files, the definitions are loaded from it
+        instead.
+
         This method should not be used (unless you really know what your are
         doing), use instead :meth:`reparse`
         """
+        cache = self.metadata.definitions_cache
+        if cache is not None:
+            cached = cache.load('fields', cache.key(self.metadata, 'fields'))
+            if cached is not None:
+                self._field_definitions = cached['field_definitions']
+                self.metadata._legacy_field_matchings = \
+                    cached['legacy_field_matchings']
+                self._parsed_files = None
+                return
+
+        self._parse()
+        self._dump_to_cache()
+
+    def _dump_to_cache(self):
+        """Store the field definitions in the cache, if any."""
+        cache = self.metadata.definitions_cache
+        if cache is not None:
+            cache.dump('fields', cache.key(self.metadata, 'fields'), {
+                'field_definitions': self._field_definitions,
+                'legacy_field_matchings': getattr(
+                    self.metadata, '_legacy_field_matchings', None),
+            })
+
+    def _parse(self):
+        """Parse all the field configuration files."""
         self._field_definitions = {}
+        self.metadata._legacy_field_matchings = None
+        self._parsed_files = self._parse_files(self.metadata.fields)
+        self._resolve()
 
-        stand_by_rules = []
+    def _parse_files(self, field_files):
+        """Parse the given configuration files.
 
-        parser = _create_field_parser(self.metadata)
+        If the metadata defines ``parse_processes`` the files are parsed
+        concurrently by a pool of processes, see :func:`_parse_in_pool`.
 
-        for field_file in self.metadata.fields:
-            try:
-                rules = parser.parseFile(field_file, parseAll=True)
-            except ParseException as e:
-                raise FieldParserException(
-                    "Cannot parse file '%s',\n%s" % (field_file, str(e)))
+        :return: dictionary containing the digest and the list of rules of
+            each file.
+        """
+        if not field_files:
+            return {}
+        if (self.metadata.parse_processes or 0) > 1 and len(field_files) > 1:
+            return _parse_in_pool(self.metadata, field_files)
+
+        parse = _create_field_file_parser(self.metadata)
+        return dict((field_file, (file_digest(field_file), parse(field_file)))
+                    for field_file in field_files)
 
-            for rule in rules:
+    def _resolve(self, json_ids=None):
+        """Create the field definitions from the parsed rules.
+
+        :param json_ids: if set, only the rules for these fields are used.
+        """
+        stand_by_rules = []
+
+        for field_file in self.metadata.fields:
+            for rule in self._parsed_files[field_file][1]:
+                if json_ids is not None and \
+                        rule.field['json_id'] not in json_ids:
+                    continue
                 if (rule.field['json_id'] in self._field_definitions)\
                         and not rule.extend and not rule.override:
                     raise FieldParserException(
@@ -362,7 +671,8 @@ class FieldParser(object):
 
             {'source_format' : source_format/calculated/derived,
              'source_tag'    : source_tag/None,
-             'function'      : python code to apply to the master value,
+             'expression'    : python expression to apply to the master value,
+             'function'      : compiled expression,
              'decorators'    : {}
             }
 
@@ -382,6 +692,8 @@ class FieldParser(object):
             .get('rules', {}) if rule.extend else dict()
 
         for field_def in all_type_def:
+            # Keep the parsed rule untouched, it might be used again
+            field_def = dict(field_def)
             self.__create_decorators_content(rule, field_def)
             if field_def['source_format'] not in rules:
                 rules[field_def['source_format']] = list()
@@ -390,6 +702,7 @@ class FieldParser(object):
         if 'json' not in rules:
             rules['json'] = [{'source_format': 'json',
                               'source_tags': [json_id],
+                              'expression': 'value',
                               'function': compile('value', '', 'eval'),
                               'type': 'creator',
                               'decorators': {'before': {},
@@ -399,7 +712,7 @@ class FieldParser(object):
                               }]
 
         rule_dict = dict()
-        rule_dict['aliases'] = rule.field['aliases']
+        rule_dict['aliases'] = list(rule.field['aliases'])
         rule_dict['pid'] = rule.pid if rule.pid is not '' else None
         rule_dict['override'] = rule.override if rule.override else False
         rule_dict['extend'] = rule.extend if rule.extend else False
@@ -469,17 +782,40 @@ class ModelParser(object):
 
     """Record model parser."""
 
-    def __init__(self, metadata):
-        """Initialize the model parser with the given namespace."""
+    def __init__(self, metadata, field_parser=None):
+        """Initialize the model parser with the given namespace.
+
+        It becomes the model parser of ``metadata``.
+
+        :param field_parser: :class:`FieldParser` to use, a new one is
+            created if it is not set.
+        """
         self.metadata = metadata
-        self.field_parser = FieldParser(metadata)
+        self.field_parser = field_parser or FieldParser(metadata)
+        self.metadata.model_parser = self
 
         self._model_definitions = None
         """Contain all the model definitions order by namespace."""
 
+        self._lock = threading.RLock()
+        self._created = False
+        """Lock and flag for the creation of the model definitions."""
+
         self._parser_extensions = None
         """Model only parser extensions."""
 
+        self._parsed_files = None
+        """Digest and model definition of each model file."""
+
+        self._resolved_models = {}
+        """Resolved models and field name index by model names."""
+
+        self._field_plans = {}
+        """Field plans by json_id and master format."""
+
+        self._execution_plans = {}
+        """Execution plans by model names and master format."""
+
     def parser_extensions(self):
         """Get only the model parser extensions from the parser registry."""
         if self._parser_extensions is None:
@@ -494,10 +830,20 @@ class ModelParser(object):
         """
         Get all the model definitions given a namespace.
 
-        If the namespace does not exist, it tries to create it first.
+        If the namespace does not exist, it tries to create it first (only
+        once, see :meth:`FieldParser.field_definitions`).
         """
-        if self._model_definitions is None:
-            self._create()
+        if not self._created:
+            with self._lock:
+                if self._model_definitions is None:
+                    self._create()
+                    try:
+                        self.check_execution_plans()
+                    except ModelParserException:
+                        # Fail again next time
+                        self._model_definitions = None
+                        raise
+                    self._created = True
         return self._model_definitions
 
     def field_definition_model_based(self, field_name, model_name):
@@ -507,33 +853,8 @@ class ModelParser(object):
         Based on a model name (and namespace) it gets the real field
         definition.
         """
-        model_index = ','.join(model_name) if isinstance(model_name, list) \
-            else model_name
-
-        if getattr(self, '_resolve_models', None) is None:
-            self._resolve_models = {}
-
-        if getattr(self, '_resolve_models_field', None) is None:
-            self._resolve_models_field = {}
-
-        new_model = self._resolve_models.get(
-            model_index,
-            self.resolve_models(model_name)
-        )
-        self._resolve_models[model_index] = new_model
-        self._resolve_models_field.setdefault(model_index, {})
-
-        json_id = self._resolve_models_field.get(model_index, {}).get(
-            field_name, None)
-
-        if json_id is None:
-            json_id = field_name
-            for j, f in six.iteritems(new_model['fields']):
-                if f == field_name:
-                    json_id = j
-                    break
-            self._resolve_models_field[model_index][field_name] = json_id
-
+        json_id = self.resolve_field_names(model_name).get(field_name,
+                                                           field_name)
         return self.field_parser.field_definitions().get(json_id, None)
 
     def resolve_models(self, model_list):
@@ -544,10 +865,42 @@ class ModelParser(object):
         the model list.
         The field definitions are resolved from left-to-right.
 
+        The result is computed only once for each model list (until
+        :meth:`reparse`), hence it can't be modified.
+
         :param model_list: It could be also a string, in which case the model
             definition is returned as it is.
-        :return: Dictionary containing the union of the model definitions.
+        :return: Read-only dictionary containing the union of the model
+            definitions.
+        """
+        return self._resolved(model_list)[0]
+
+    def resolve_field_names(self, model_list):
+        """Get the json_id of each field name of the resolved model.
+
+        :param model_list: as in :meth:`resolve_models`.
+        :return: Read-only dictionary ``{field_name: json_id}``.
         """
+        return self._resolved(model_list)[1]
+
+    def _resolved(self, model_list):
+        """Get the resolved model and its field name index from the cache."""
+        key = model_list if isinstance(model_list, six.string_types) \
+            else tuple(model_list)
+        try:
+            return self._resolved_models[key]
+        except KeyError:
+            pass
+        model = self._resolve_models(model_list)
+        fields = FrozenDict(model['fields'])
+        model = FrozenDict(model, fields=fields, bases=tuple(model['bases']))
+        field_names = FrozenDict((field_name, json_id) for json_id, field_name
+                                 in six.iteritems(fields))
+        self._resolved_models[key] = (model, field_names)
+        return self._resolved_models[key]
+
+    def _resolve_models(self, model_list):
+        """Resolve the model list, see :meth:`resolve_models`."""
         if model_list == '__default__':
             keys = self.field_parser.field_definitions().keys()
             return {
@@ -582,9 +935,161 @@ class ModelParser(object):
 
         return new_model
 
+    def field_plan(self, json_id, master_format):
+        """Get the :data:`~jsonalchemy.plan.FieldPlan` of ``json_id``.
+
+        :return: the field plan or ``None`` if the field is not defined.
+        """
+        key = (json_id, master_format)
+        if key not in self._field_plans:
+            self._field_plans[key] = create_field_plan(
+                self.field_parser, json_id, master_format)
+        return self._field_plans[key]
+
+    def create_execution_plan(self, fields, master_format, projection=None):
+        """Create the execution plan to add ``fields`` to a record.
+
+        :param fields: dictionary ``{json_id: field_name}``.
+        :param projection: as in
+            :func:`~jsonalchemy.plan.create_execution_plan`.
+        :return: :data:`~jsonalchemy.plan.ExecutionPlan`
+        """
+        return create_execution_plan(
+            fields, master_format,
+            lambda json_id: self.field_plan(json_id, master_format),
+            projection)
+
+    def execution_plan(self, model_list, master_format, fields=None):
+        """Get the execution plan to translate records of a model.
+
+        The plan is created only the first time, see
+        :mod:`jsonalchemy.plan`.
+
+        :param model_list: model name or list of model names, as in
+            :meth:`resolve_models`.
+        :param fields: if set, names of the only fields of the model to add,
+            together with the fields needed to create them, see
+            :func:`~jsonalchemy.plan.field_closure`.
+        :return: :data:`~jsonalchemy.plan.ExecutionPlan`
+        """
+        if isinstance(model_list, six.string_types):
+            model_list = (model_list, )
+        if fields is not None:
+            fields = frozenset(fields)
+        key = (tuple(model_list), master_format, fields)
+        if key not in self._execution_plans:
+            projection = None
+            if fields is not None:
+                field_names = self.resolve_field_names(model_list)
+                projection = field_closure(
+                    [field_names.get(field_name, field_name)
+                     for field_name in fields],
+                    lambda json_id: self.field_plan(json_id, master_format))
+            self._execution_plans[key] = self.create_execution_plan(
+                self.resolve_models(model_list)['fields'], master_format,
+                projection)
+        return self._execution_plans[key]
+
+    def check_execution_plans(self):
+        """Create the execution plans of all the fields.
+
+        It is done once the definitions are loaded, so a cycle of
+        ``@depends_on`` is reported right away instead of by the first
+        translation using it.  The fields of any model are part of the
+        ``__default__`` model, hence its plan is created for each master
+        format (the ones with a reader and the ones used by the rules).
+
+        :raises: :class:`~jsonalchemy.errors.ModelParserException` if there
+            is a cycle of ``@depends_on``.
+        """
+        master_formats = set(self.metadata.readers)
+        for definition in six.itervalues(
+                self.field_parser.field_definitions()):
+            master_formats.update(definition.get('rules', {}))
+        master_formats.difference_update(('calculated', 'derived'))
+        for master_format in sorted(master_formats):
+            self.execution_plan('__default__', master_format)
+
     def reparse(self):
-        self.field_parser._create()
-        self._create()
+        """Parse again the field and model configuration files.
+
+        As in :meth:`FieldParser.reparse` only the files that changed are
+        parsed again.  The model definitions created again are the ones from
+        those files, the ones using a field definition that changed and all the
+        models inheriting from any of them.
+
+        :return: set of model names whose definition has been created again.
+        :raises: :class:`~jsonalchemy.errors.ModelParserException` if there
+            is a cycle of ``@depends_on``, see :meth:`check_execution_plans`.
+        """
+        model_names = self._reparse()
+        self.check_execution_plans()
+        return model_names
+
+    def _clear_plans(self):
+        """Forget the resolved models and the plans created from them."""
+        self._resolved_models = {}
+        self._field_plans = {}
+        self._execution_plans = {}
+
+    def _reparse(self):
+        """Parse again the configuration files, see :meth:`reparse`."""
+        json_ids = self.field_parser.reparse()
+        self._clear_plans()
+
+        if self._parsed_files is None:
+            self._create()
+            return set(self._model_definitions.keys())
+
+        parser = None
+        parsed_files = {}
+        model_names = set()
+        for model_file in self.metadata.models:
+            digest = file_digest(model_file)
+            if model_file in self._parsed_files and \
+                    self._parsed_files[model_file][0] == digest:
+                parsed_files[model_file] = self._parsed_files[model_file]
+                continue
+            if parser is None:
+                parser = _create_model_parser(self.metadata)
+            parsed_files[model_file] = (digest,
+                                        self._parse_file(parser, model_file))
+            model_names.add(_model_name(model_file))
+        model_names.update(_model_name(model_file)
+                           for model_file in self._parsed_files
+                           if model_file not in parsed_files)
+
+        for model_file, (digest, model_def) in six.iteritems(parsed_files):
+            if json_ids.intersection(six.itervalues(model_def['fields'])):
+                model_names.add(_model_name(model_file))
+
+        # All the models inheriting from the affected ones
+        pending = True
+        while pending:
+            pending = False
+            for model_file, (digest, model_def) in \
+                    six.iteritems(parsed_files):
+                model_name = _model_name(model_file)
+                if model_name not in model_names and \
+                        model_names.intersection(model_def['bases']):
+                    model_names.add(model_name)
+                    pending = True
+
+        if not model_names:
+            return model_names
+
+        for model_name in model_names:
+            self._model_definitions.pop(model_name, None)
+
+        self._parsed_files = parsed_files
+        try:
+            self._resolve(model_names)
+        except ModelParserException:
+            # Next time everything will be parsed again
+            self._parsed_files = None
+            raise
+        self._dump_to_cache()
+        return model_names
 
     def _create(self):
         """Fill up _model_definitions dictionary.
@@ -614,46 +1119,94 @@ class ModelParser(object):
                  (helpful if we use inheritance) or in case of unknown field
                  name.
         """
+        cache = self.metadata.definitions_cache
+        if cache is not None:
+            cached = cache.load('models', cache.key(self.metadata, 'models'))
+            if cached is not None:
+                self._model_definitions = cached
+                self._parsed_files = None
+                return
+
+        self._parse()
+        self._dump_to_cache()
+
+    def _dump_to_cache(self):
+        """Store the model definitions in the cache, if any."""
+        cache = self.metadata.definitions_cache
+        if cache is not None:
+            cache.dump('models', cache.key(self.metadata, 'models'),
+                       self._model_definitions)
+
+    def _parse(self):
+        """Parse all the model configuration files."""
         self._model_definitions = {}
+        self._parsed_files = {}
 
         parser = _create_model_parser(self.metadata)
         for model_file in self.metadata.models:
-            model_name = os.path.basename(model_file).split('.')[0]
-            if model_name in self._model_definitions:
-                raise ModelParserException(
-                    "Already defined model: %s" % (model_name,))
+            self._parsed_files[model_file] = (
+                file_digest(model_file), self._parse_file(parser, model_file))
 
-            self._model_definitions[model_name] = {
-                'fields': {},
-                'bases': [],
-            }
+        self._resolve()
 
-            try:
-                model_definition = parser.parseFile(model_file, parseAll=True)
-            except ParseException as e:
-                raise ModelParserException(
-                    "Cannot parse file %s,\n%s" % (model_file, str(e)))
+    def _parse_file(self, parser, model_file):
+        """Parse one model file.
+
+        :return: the model definition before resolving the inheritance.
+        """
+        try:
+            model_definition = parser.parseFile(model_file, parseAll=True)
+        except ParseException as e:
+            raise ModelParserException(
+                "Cannot parse file %s,\n%s" % (model_file, str(e)))
+
+        if not model_definition.fields:
+            raise ModelParserException("Field definition needed")
+
+        model_def = {
+            'fields': model_definition.fields,
+            'bases': model_definition.bases.asList()
+            if model_definition.bases else [],
+        }
+        for name, parser in six.iteritems(self.parser_extensions()):
+            if name in model_definition:
+                model_def[name] = parser.create_element(model_definition,
+                                                        self.metadata)
+        return model_def
 
-            if not model_definition.fields:
-                raise ModelParserException("Field definition needed")
+    def _resolve(self, model_names=None):
+        """Create the model definitions from the parsed model files.
 
+        :param model_names: if set, only these models are created.
+        """
+        defined = set()
+        for model_file in self.metadata.models:
+            model_name = _model_name(model_file)
+            if model_name in defined:
+                raise ModelParserException(
+                    "Already defined model: %s" % (model_name,))
+            defined.add(model_name)
+            if model_names is not None and model_name not in model_names:
+                continue
+
+            model_def = dict(self._parsed_files[model_file][1])
             if any([json_id not in self.field_parser.field_definitions()
-                    for json_id in model_definition.fields.values()]):
+                    for json_id in model_def['fields'].values()]):
                 raise ModelParserException(
                     "At least one field is no find in the field "
                     "definitions for file '%s'" % (model_file))
-            self._model_definitions[model_name][
-                'fields'] = model_definition.fields
-            self._model_definitions[model_name][
-                'bases'] = model_definition.bases.asList() \
-                if model_definition.bases else []
+            model_def['fields'] = dict(model_def['fields'])
+            model_def['bases'] = list(model_def['bases'])
+            self._model_definitions[model_name] = model_def
 
-            self.__resolve_parser_extensions(model_name, model_definition)
+        self.__resolve_inheritance(model_names)
 
-        self.__resolve_inheritance()
+    def __resolve_inheritance(self, model_names=None):
+        """Resolve the inheritance.
 
-    def __resolve_inheritance(self):
-        """Resolve the inheritance."""
+        :param model_names: if set, only the inheritance of these models is
+            resolved.
+        """
         def resolve_ext_inheritance(ext_name, model_definition):
             for inherit_from in model_definition['bases']:
                 base_model = self.model_definitions[inherit_from]
@@ -680,7 +1233,10 @@ class ModelParser(object):
                 fields.update(model_definition['fields'])
             return fields
 
-        for model_definition in self.model_definitions.values():
+        for model_name, model_definition in \
+                six.iteritems(self.model_definitions):
+            if model_names is not None and model_name not in model_names:
+                continue
             model_definition['fields'] = resolve_field_inheritance(
                 model_definition)
             for name, model_ext in \
@@ -688,13 +1244,6 @@ class ModelParser(object):
                 model_definition[name] = resolve_ext_inheritance(
                     name, model_definition)
 
-    def __resolve_parser_extensions(self, model_name, model_def):
-        """Apply the incoming rule for each available extension."""
-        for name, parser in six.iteritems(self.parser_extensions()):
-            if name in model_def:
-                self._model_definitions[model_name][name] = \
-                    parser.create_element(model_def, self.metadata)
-
 
 def guess_legacy_field_names(fields, master_format, metadata):
     """Find the equivalent JSON field for the legacy field(s).
@@ -744,9 +1293,6 @@ def get_producer_rules(field, code, metadata, model=['__default__']):
         [[((), {'245__a': 'title', '245__b': 'subtitle', '245__k': 'form'})]
 
     """
-    if getattr(metadata, 'model_parser', None) is None:
-        metadata.model_parser = ModelParser(metadata)
-
     try:
         return metadata.model_parser.field_definition_model_based(
             field, model).get('producer', {}).get(code, [])
@@ -777,6 +1323,29 @@ class BaseExtensionParser(type):  # pylint: disable=E501,R0921
         """
         raise NotImplementedError()
 
+    def parse_lines(cls, lines):
+        """
+        Parse the element from its logical lines.
+
+        Used by :class:`~jsonalchemy.fast_parser.FastFieldParser` instead of
+        :meth:`parse_element`.  ``lines`` contains the decorator, e.g.
+        ``["@depends_on('title')"]``, or the section header followed by the
+        lines of its body, e.g. ``['schema:', "{'title': {}}"]``.
+
+        This default implementation feeds the lines to the grammar from
+        :meth:`parse_element`, extensions should override it with something
+        faster.
+
+        :return: the same content :meth:`parse_element` sets in the rule or
+            ``None`` if the lines don't belong to this extension.
+        """
+        source = '\n'.join([lines[0]] + ['    ' + line for line in lines[1:]])
+        try:
+            return cls.parse_element([1]).parseString(
+                source, parseAll=True).get(cls.__parsername__)
+        except ParseException:
+            return None
+
     @classmethod
     def create_element(mcs, *args, **kwargs):
         """
@@ -861,6 +1430,16 @@ class ModelBaseExtensionParser(six.with_metaclass(BaseExtensionParser)):
         """
         raise NotImplementedError()
 
+    @classmethod
+    def needed_for(cls, args, projection):
+        """Check if ``evaluate`` is needed when only some fields are added.
+
+        :param projection: json_ids of the fields added to the record, see
+            :meth:`ModelParser.execution_plan`.
+        :return: by default ``True``.
+        """
+        return True
+
     @classmethod
     def add_info_to_field(cls, info):
         """
@@ -887,7 +1466,17 @@ class DecoratorBaseExtensionParser(six.with_metaclass(BaseExtensionParser)):
 
     """Base class for decorator parser extension."""
 
-    pass
+    @classmethod
+    def prepare_arguments(cls, args, field_parser):
+        """Prepare the arguments of ``evaluate`` only once.
+
+        It is called when the :mod:`execution plan <jsonalchemy.plan>` of the
+        field is created, i.e. to turn an expression into a function using
+        :meth:`FieldParser.expression_function`.
+
+        :return: the arguments for ``evaluate``, by default ``args``.
+        """
+        return args
 
 
 class DecoratorBeforeEvalBaseExtensionParser(DecoratorBaseExtensionParser):
@@ -915,10 +1504,12 @@ class DecoratorOnEvalBaseExtensionParser(DecoratorBaseExtensionParser):
     """
 
     @classmethod
-    def evaluate(cls, value, metadata, args):
+    def evaluate(cls, value, metadata, args, source_tag=None):
         """
         Evaluate ``args`` with the master value from the input.
 
+        :param source_tag: the tag of the input where ``value`` comes from, if
+            the reader knows it (like ``'100__'`` in MARC).
         :returns: a boolean depending on them.
         """
         raise NotImplementedError()
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of JSONAlchemy.
+# Copyright (C) 2015 CERN.
+#
+# JSONAlchemy is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# JSONAlchemy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JSONAlchemy; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Execution plans used by the readers to translate records.
+
+An :data:`ExecutionPlan` is created once per model and master format by
+:meth:`~jsonalchemy.parser.ModelParser.execution_plan` and it contains
+everything :class:`~jsonalchemy.reader.Reader` needs to fill up a record:
+
+* the fields of the model sorted so that the fields used by ``@depends_on``
+  and ``@parse_first`` come before the fields using them,
+* for each field only the rules for the master format (plus the derived and
+  calculated ones),
+* for each rule the function evaluating its expression, see
+  :meth:`~jsonalchemy.parser.FieldParser.expression_function`,
+* for each rule the ``evaluate`` methods of its *before* and *on*
+  decorators together with their prepared arguments.
+
+The ``@connect`` decorator takes part in the ordering through the
+``@parse_first`` it adds to the connected field.  Two connected fields
+usually end up using each other with ``@parse_first``, therefore cycles of
+``@parse_first`` are broken (the reader resolves them at run time as it did
+before), whereas a cycle of ``@depends_on`` means none of those fields could
+ever be created and it is reported as soon as the plan is created.
+
+The source tags of the rules are looked up in the records through a
+:class:`SourceTagIndex`, shared by all the records of the same master format.
+"""
+
+import inspect
+import re
+
+from collections import namedtuple
+
+import six
+
+from .errors import ModelParserException
+
+RulePlan = namedtuple('RulePlan', ('field_def', 'function', 'before', 'on'))
+"""Rule ready to be applied.
+
+``function`` evaluates the expression of the rule, it takes the master value
+and the json for creator rules and only the json for derived and calculated
+ones.  ``before`` and ``on`` are tuples of ``(evaluate, args)`` pairs, one
+for each of the decorators of the rule.
+"""
+
+FieldPlan = namedtuple('FieldPlan', ('json_id', 'definition', 'creator',
+                                     'calculated', 'derived'))
+"""Field definition with the rules for one master format.
+
+``creator``, ``calculated`` and ``derived`` are tuples of :data:`RulePlan`.
+"""
+
+ExecutionPlan = namedtuple('ExecutionPlan',
+                           ('master_format', 'steps', 'projection'))
+"""Fields to add to a record, in order.
+
+``steps`` is a tuple of ``(json_id, field_name, field_plan)``, where
+``field_plan`` is ``None`` if the field has no definition.  ``projection`` is
+the set of json_ids the plan is restricted to (see :func:`field_closure`) or
+``None`` if the plan adds all the fields of the model.
+"""
+
+
+class SourceTagIndex(object):
+
+    """Dispatch table from the keys of a record to the source tags using them.
+
+    The source tags of the rules are regular expressions matched against the
+    beginning of the keys of a record (like ``'100__'`` in MARC or the name of
+    the field in JSON).  Most of them are plain strings, which are looked up
+    by prefix in a dictionary, the rest are combined in one regular expression
+    to discard at once the keys none of them matches.  The source tags
+    matching each key are remembered, as the same keys appear over and over
+    again in the records.
+    """
+
+    _special_chars = frozenset('.^$*+?{}[]\\|()')
+
+    max_cached_keys = 100000
+    """Maximum number of keys whose source tags are remembered."""
+
+    def __init__(self, source_tags):
+        """Compile ``source_tags``, the invalid ones are left out."""
+        self._literals = {}
+        self._patterns = []
+        for source_tag in sorted(set(source_tags)):
+            if self._special_chars.isdisjoint(source_tag):
+                self._literals.setdefault(
+                    len(source_tag), {})[source_tag] = source_tag
+                continue
+            try:
+                self._patterns.append((source_tag, re.compile(source_tag)))
+            except re.error:
+                pass
+        self.source_tags = frozenset(
+            [source_tag for source_tag, dummy in self._patterns] +
+            [source_tag for literals in six.itervalues(self._literals)
+             for source_tag in literals])
+        self._lengths = sorted(self._literals)
+        try:
+            self._any_pattern = re.compile('|'.join(
+                '(?:%s)' % (source_tag, )
+                for source_tag, dummy in self._patterns))
+        except re.error:
+            # Some patterns can't be combined (i.e. back references)
+            self._any_pattern = re.compile('')
+        self._matches = {}
+
+    def __contains__(self, source_tag):
+        """Check if ``source_tag`` is part of the index."""
+        return source_tag in self.source_tags
+
+    def match(self, key):
+        """Get the source tags matching ``key``, literal ones first."""
+        try:
+            return self._matches[key]
+        except KeyError:
+            pass
+        matches = []
+        for length in self._lengths:
+            source_tag = self._literals[length].get(key[:length])
+            if source_tag is not None:
+                matches.append(source_tag)
+        if self._patterns and self._any_pattern.match(key):
+            matches.extend(source_tag for source_tag, regex in self._patterns
+                           if regex.match(key))
+        matches = tuple(matches)
+        if len(self._matches) < self.max_cached_keys:
+            self._matches[key] = matches
+        return matches
+
+    def lookup(self, keys):
+        """Map each source tag to the keys matching it.
+
+        :param keys: iterable with the keys of one record.
+        :return: dictionary ``{source_tag: [key, ...]}`` keeping the order of
+            ``keys``, without the source tags not matching any key.
+        """
+        found = {}
+        for key in keys:
+            for source_tag in self.match(key):
+                found.setdefault(source_tag, []).append(key)
+        return found
+
+
+def _on_evaluate(extension):
+    """Get the ``evaluate`` of an *on* decorator accepting ``source_tag``.
+
+    The extensions written before ``source_tag`` was passed to them only take
+    ``(value, metadata, args)``, they are called without it.
+    """
+    evaluate = extension.evaluate
+    getargspec = getattr(inspect, 'getfullargspec', None) or \
+        inspect.getargspec
+    try:
+        spec = getargspec(evaluate)
+    except TypeError:
+        # Not a python function, it can't be checked
+        return evaluate
+    if 'source_tag' in spec[0] or spec[2] is not None or \
+            'source_tag' in getattr(spec, 'kwonlyargs', ()):
+        return evaluate
+
+    def evaluate_without_source_tag(value, metadata, args, source_tag=None):
+        return evaluate(value, metadata, args)
+    return evaluate_without_source_tag
+
+
+def create_field_plan(field_parser, json_id, master_format):
+    """Create the :data:`FieldPlan` of ``json_id``.
+
+    :return: the field plan or ``None`` if there is no definition for
+        ``json_id``.
+    """
+    definition = field_parser.field_definitions().get(json_id)
+    if definition is None:
+        return None
+    before_extensions = field_parser.decorator_before_extensions()
+    on_extensions = field_parser.decorator_on_extensions()
+
+    def decorators(extensions, content, get_evaluate=None):
+        return tuple(
+            (get_evaluate(extensions[name]) if get_evaluate is not None
+             else extensions[name].evaluate,
+             extensions[name].prepare_arguments(args, field_parser))
+            for name, args in six.iteritems(content))
+
+    def rule_plans(source_format, arguments):
+        return tuple(
+            RulePlan(field_def,
+                     field_parser.expression_function(
+                         field_def['expression'], arguments),
+                     decorators(before_extensions,
+                                field_def['decorators']['before']),
+                     decorators(on_extensions,
+                                field_def['decorators']['on'],
+                                _on_evaluate))
+            for field_def in definition['rules'].get(source_format, []))
+
+    return FieldPlan(json_id, definition,
+                     rule_plans(master_format, ('value', 'self')),
+                     rule_plans('calculated', ('self', )),
+                     rule_plans('derived', ('self', )))
+
+
+def _dependencies(field_plan, decorator):
+    """Get the json_ids used by ``decorator`` in any rule of the field."""
+    if field_plan is None:
+        return []
+    dependencies = []
+    for rule in field_plan.creator + field_plan.calculated + \
+            field_plan.derived:
+        for json_id in rule.field_def['decorators']['before'].get(
+                decorator, []):
+            if json_id not in dependencies:
+                dependencies.append(json_id)
+    return dependencies
+
+
+def _connected_fields(field_plan):
+    """Get the json_ids connected to the field using ``@connect``."""
+    if field_plan is None:
+        return []
+    return [connect['connected_field']
+            for rule in field_plan.creator + field_plan.calculated +
+            field_plan.derived
+            for connect in rule.field_def['decorators']['after'].get(
+                'connect', [])]
+
+
+def field_closure(json_ids, get_field_plan):
+    """Get the json_ids needed to create the fields ``json_ids``.
+
+    Besides ``json_ids`` themselves, the fields they use with ``@depends_on``
+    and ``@parse_first`` and the fields connected to them with ``@connect``
+    are needed, and the same for each of those, recursively.  The fields
+    only used inside the expressions of the rules can't be known, they are
+    created anyway when the expressions use them.
+
+    :param get_field_plan: function returning the :data:`FieldPlan` of a
+        json_id.
+    :return: frozenset of json_ids
+    """
+    closure = set()
+    pending = list(json_ids)
+    while pending:
+        json_id = pending.pop()
+        if json_id in closure:
+            continue
+        closure.add(json_id)
+        field_plan = get_field_plan(json_id)
+        pending.extend(_dependencies(field_plan, 'depends_on'))
+        pending.extend(_dependencies(field_plan, 'parse_first'))
+        pending.extend(_connected_fields(field_plan))
+    return frozenset(closure)
+
+
+def _check_depends_on_cycles(json_ids, get_field_plan):
+    """Raise :class:`ModelParserException` if ``@depends_on`` has cycles."""
+    done = set()
+    for json_id in json_ids:
+        if json_id in done:
+            continue
+        path = [json_id]
+        pending = [iter(_dependencies(get_field_plan(json_id),
+                                      'depends_on'))]
+        while pending:
+            dependency = next(pending[-1], None)
+            if dependency is None:
+                done.add(path.pop())
+                pending.pop()
+            elif dependency in path:
+                cycle = path[path.index(dependency):] + [dependency]
+                raise ModelParserException(
+                    "Circular dependency between fields: %s"
+                    % (' -> '.join(cycle), ))
+            elif dependency not in done:
+                path.append(dependency)
+                pending.append(iter(_dependencies(
+                    get_field_plan(dependency), 'depends_on')))
+
+
+def create_execution_plan(fields, master_format, get_field_plan,
+                          projection=None):
+    """Create the :data:`ExecutionPlan` to add ``fields`` to a record.
+
+    :param fields: dictionary ``{json_id: field_name}``.
+    :param get_field_plan: function returning the :data:`FieldPlan` of a
+        json_id.
+    :param projection: if set, only the fields with these json_ids are
+        added, see :func:`field_closure`.
+    :raises: :class:`~jsonalchemy.errors.ModelParserException` if there is a
+        cycle of ``@depends_on``.
+    """
+    if projection is not None:
+        fields = dict((json_id, field_name)
+                      for json_id, field_name in six.iteritems(fields)
+                      if json_id in projection)
+    json_ids = sorted(fields)
+    _check_depends_on_cycles(json_ids, get_field_plan)
+
+    def uses(json_id):
+        field_plan = get_field_plan(json_id)
+        return iter(_dependencies(field_plan, 'depends_on') +
+                    _dependencies(field_plan, 'parse_first'))
+
+    steps = []
+    visited = set()
+    for json_id in json_ids:
+        if json_id in visited:
+            continue
+        # Iterative depth first search, each field is added after the
+        # fields it uses.  A dependency still being visited closes a cycle
+        # of ``@parse_first``, it is simply skipped.
+        visited.add(json_id)
+        path = [json_id]
+        pending = [uses(json_id)]
+        while pending:
+            dependency = next(pending[-1], None)
+            if dependency is None:
+                current = path.pop()
+                pending.pop()
+                steps.append((current, fields[current],
+                              get_field_plan(current)))
+            elif dependency in fields and dependency not in visited:
+                visited.add(dependency)
+                path.append(dependency)
+                pending.append(uses(dependency))
+
+    return ExecutionPlan(master_format, tuple(steps), projection)
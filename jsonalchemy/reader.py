@@ -27,15 +27,19 @@ reader depending of the master format of the input.
     >>> from invenio.modules.records.api import Record
     >>> record = Reader.translate(blob, 'marc', Record, model=['picture'])
 """
+import collections
 import itertools
 import datetime
+import hashlib
+import multiprocessing
+import re
 import six
-
-from jsonalchemy.utils import try_to_eval
+import sys
 
 from .errors import ReaderException
-from .parser import FieldParser, ModelParser
+from .plan import ExecutionPlan
 from .registry import MetaData
+from .utils import FrozenDict, OverlayDict, freeze
 
 
 def split_blob(blob, master_format, slice_size=0, metadata=None, **kwargs):
@@ -65,41 +69,302 @@ def split_blob(blob, master_format, slice_size=0, metadata=None, **kwargs):
 
 
 def translate(blob, json_class=None, master_format='json', metadata=None,
-              **kwargs):
+              lazy=False, fields=None, **kwargs):
     """Transform the incoming blob into a json structure (``json_class``).
 
     It uses the rules described in the field and model definitions.
 
+    Several threads can translate records at the same time using the same
+    ``metadata``: the parsers and execution plans are shared read-only once
+    created and every rule, decorator and producer expression is evaluated
+    in its own namespace, see :func:`~jsonalchemy.utils.try_to_eval` and
+    :func:`~jsonalchemy.utils.compile_expression`.  The functions called by
+    the rules must be thread-safe themselves.
+
     :param blob: incoming blob (like MARC)
     :param json_class: Any subclass of
         :class:`~jsonalchemy.wrappers.SmartJson`
     :param master_format: Master format of the input blob.
+    :param lazy: if ``True`` the fields are only added to the json the first
+        time they are used (with the fields they depend on), or all of them
+        at once when the json is dumped, see :meth:`Reader.materialize`.
+    :param fields: if set, names of the only fields to add, together with
+        the fields needed to create them, see
+        :meth:`~jsonalchemy.parser.ModelParser.execution_plan`.
     :param kwargs: parameter to pass to json_class
 
     :return: New object of ``json_class`` type containing the result of the
         translation
     """
+    return next(translate_many((blob, ), json_class=json_class,
+                               master_format=master_format, metadata=metadata,
+                               lazy=lazy, fields=fields, **kwargs))
+
+
+def translate_many(blobs, json_class=None, master_format='json',
+                   metadata=None, lazy=False, fields=None, **kwargs):
+    """Transform each of the incoming blobs into a json structure.
+
+    The result is the same as calling :func:`translate` for each blob, but
+    the metadata, the reader class and the execution plans are looked up only
+    once for all of them.
+
+    .. code-block:: python
+
+        >>> for json in translate_many(split_blob(blob, 'marc'), SmartJson,
+        ...                            master_format='marc'):
+        ...     storage.save_one(json.dumps())
+
+    :param blobs: Iterable with the incoming blobs
+    :param json_class: as in :func:`translate`
+    :param master_format: Master format of the input blobs.
+    :param lazy: as in :func:`translate`
+    :param fields: as in :func:`translate`
+    :param kwargs: parameter to pass to json_class
+
+    :return: Generator of new objects of ``json_class`` type, one for each
+        blob
+    """
     from .wrappers import SmartJson
     json_class = json_class or SmartJson
     metadata = metadata or MetaData()
 
-    if blob is None:
-        raise ReaderException(
-            "To perform a 'translate' operation a blob is needed")
-
     if not issubclass(json_class, SmartJson):
         raise ReaderException("The json class must be of type 'SmartJson'")
 
-    json = json_class(master_format=master_format, metadata=metadata, **kwargs)
-    # resorve reader class from metadata
+    # resorve reader class and plans from metadata
     cls = metadata.readers[master_format]
-    reader = cls(json, blob=blob, metadata=metadata, **kwargs)
-    # fill up with all possible fields
-    fields = reader.model_parser.resolve_models(
-        json.model_info.names).get('fields')
+    model_parser = metadata.model_parser
+    plans = {}
+
+    for blob in blobs:
+        if blob is None:
+            raise ReaderException(
+                "To perform a 'translate' operation a blob is needed")
+
+        json = json_class(master_format=master_format, metadata=metadata,
+                          **kwargs)
+        reader = cls(json, blob=blob, metadata=metadata, **kwargs)
+        # fill up with all possible fields
+        model_names = tuple(json.model_info.names)
+        plan = plans.get(model_names)
+        if plan is None:
+            plan = plans[model_names] = model_parser.execution_plan(
+                model_names, master_format, fields)
+
+        reader.add(plan, blob, metadata=metadata, fetch_model_info=True,
+                   lazy=lazy)
+        yield json
+
 
-    reader.add(fields, blob, metadata=metadata, fetch_model_info=True)
-    return json
+_pool_translate = None
+"""Arguments of :func:`translate` in the current process, see
+:func:`translate_parallel`."""
+
+
+def _fork_start_method():
+    """Check if the processes of a pool are forked from the current one."""
+    get_start_method = getattr(multiprocessing, 'get_start_method', None)
+    if get_start_method is None:
+        return sys.platform != 'win32'
+    return get_start_method() == 'fork'
+
+
+def _init_translate_worker(metadata, json_class, master_format, kwargs):
+    """Set up the arguments of :func:`translate` once per process.
+
+    ``metadata`` is either the :class:`~jsonalchemy.registry.MetaData` of the
+    parent process (inherited by forking) or the arguments to build a new
+    one.
+    """
+    global _pool_translate
+    if not isinstance(metadata, MetaData):
+        packages, cache_dir, parser_backend = metadata
+        metadata = MetaData(packages, cache_dir=cache_dir,
+                            parser_backend=parser_backend)
+    _pool_translate = (json_class, master_format, metadata, kwargs)
+
+
+def _translate_in_pool_worker(blobs):
+    """Translate a chunk of blobs inside a process of the pool.
+
+    An error only affects its own blob, the result has one
+    ``(payload, error)`` pair for each of the blobs.
+    """
+    json_class, master_format, metadata, kwargs = _pool_translate
+    results = []
+    for blob in blobs:
+        try:
+            json = translate(blob, json_class=json_class,
+                             master_format=master_format, metadata=metadata,
+                             **kwargs)
+            results.append((json.dumps(), None))
+        except Exception as e:  # pylint: disable=W0703
+            results.append((None, '%s: %s' % (e.__class__.__name__, e)))
+    return results
+
+
+def _pop_result(pending, ordered):
+    """Remove the next result to return from the ``pending`` ones.
+
+    It is the first one if ``ordered``, otherwise the first one to be ready.
+    Callbacks are not used for the latter because they are not called if the
+    chunk fails in the pool (i.e. the results can't be pickled) and python 2
+    has no ``error_callback``.
+    """
+    if ordered:
+        return pending.popleft()
+    while True:
+        for index, result in enumerate(pending):
+            if result.ready():
+                del pending[index]
+                return result
+        pending[0].wait(0.01)
+
+
+def translate_parallel(blob, master_format='json', workers=None,
+                       chunk_size=100, json_class=None, metadata=None,
+                       ordered=True, max_chunks=None, split_kwargs=None,
+                       **kwargs):
+    """Translate all the records of ``blob`` using a pool of processes.
+
+    The blob (or open file) is split with :func:`split_blob` in chunks of
+    ``chunk_size`` records which are translated by ``workers`` processes.
+    At most ``max_chunks`` chunks (by default twice the number of workers)
+    are sent to the pool at any time, the following ones are only read from
+    the blob once the results of the previous ones are consumed, so the
+    memory used doesn't depend on the size of the input.
+
+    .. code-block:: python
+
+        >>> with open('dump.xml') as f:
+        ...     for payload, error in translate_parallel(f, 'marc',
+        ...                                              workers=4):
+        ...         if error is None:
+        ...             storage.save_one(payload)
+
+    The processes inherit the field and model definitions of ``metadata``
+    when they are forked, otherwise each of them loads the definitions once
+    (use ``cache_dir`` in the metadata to load them quickly).
+
+    :param blob: incoming blob or file with several records
+    :param master_format: Master format of the input blob.
+    :param workers: number of processes, by default the number of CPUs.
+    :param chunk_size: number of records translated at once by a process.
+    :param json_class: as in :func:`translate`
+    :param ordered: if ``False`` the results are returned as soon as their
+        chunk is translated instead of in the order of the input.
+    :param max_chunks: maximum number of chunks in the pool.
+    :param split_kwargs: parameters to pass to the ``split_blob`` of the
+        reader, like the ``schema`` of the blob.
+    :param kwargs: parameter to pass to json_class
+
+    :return: Generator of ``(payload, error)``, where ``payload`` is the
+        result of :meth:`~jsonalchemy.wrappers.SmartJson.dumps` or ``None``
+        and ``error`` the message of the exception raised by the translation
+        of the record.
+    :raises: the exception of a chunk failing in the pool, like
+        ``MaybeEncodingError`` if its results can't be pickled.
+    """
+    metadata = metadata or MetaData()
+    workers = workers or multiprocessing.cpu_count()
+    max_chunks = max_chunks or 2 * workers
+
+    if _fork_start_method():
+        # Parse the definitions once, before the processes are forked
+        metadata.field_parser.field_definitions()
+        metadata.model_parser.model_definitions  # pylint: disable=W0104
+        pool_metadata = metadata
+    else:
+        pool_metadata = ([package.package for package in metadata.packages],
+                         metadata.cache_dir, metadata.parser_backend)
+
+    chunks = split_blob(blob, master_format, slice_size=chunk_size,
+                        metadata=metadata, **(split_kwargs or {}))
+    pool = multiprocessing.Pool(
+        workers, initializer=_init_translate_worker,
+        initargs=(pool_metadata, json_class, master_format, kwargs))
+    pending = collections.deque()
+    try:
+        for chunk in chunks:
+            pending.append(
+                pool.apply_async(_translate_in_pool_worker, (chunk, )))
+            if len(pending) >= max_chunks:
+                for result in _pop_result(pending, ordered).get():
+                    yield result
+        while pending:
+            for result in _pop_result(pending, ordered).get():
+                yield result
+        pool.close()
+    finally:
+        # Stops the remaining work if the generator is not consumed or a
+        # chunk fails.  The chunks already in the pool are finished first,
+        # python 2 can hang terminating a pool whose results are not read.
+        for result in pending:
+            result.wait()
+        pool.terminate()
+        pool.join()
+
+
+class FieldInfoTemplate(FrozenDict):
+
+    """Meta-metadata of a field shared by all the records.
+
+    It is created once for each rule and source tags, see
+    :meth:`Reader._field_metadata_template`.  The records keep on top of it,
+    inside an :class:`~jsonalchemy.utils.OverlayDict`, only their own
+    meta-metadata, like the timestamp.  The values inside it are read-only
+    too, see :func:`~jsonalchemy.utils.freeze`.
+
+    ``ref`` identifies it in the compact form of the records, see
+    :meth:`~jsonalchemy.wrappers.SmartJson.dumps`: ``(json_id, field_type,
+    rule_index, source_tags, digest)``, where ``rule_index`` is the position
+    of the rule in the field definition and ``digest`` the hash of the
+    content of the template, see :func:`_template_digest`.  The position of
+    a rule changes with the field definitions, the digest tells if the
+    template is still the same one.  ``ref`` is ``None`` if the rule is not
+    part of the field definition.
+    """
+
+    __slots__ = ('ref', )
+
+    def __init__(self, info, ref=None):
+        """Initialize the template with the content of ``info``."""
+        super(FieldInfoTemplate, self).__init__(
+            (key, freeze(value)) for key, value in six.iteritems(info))
+        self.ref = ref
+
+    def __reduce__(self):
+        """Pickle it with its reference."""
+        return (type(self), (dict(self), self.ref))
+
+
+def _template_digest(info):
+    """Return the hash of the content of a meta-metadata template."""
+    digest = hashlib.sha1()
+
+    def update(value):
+        if isinstance(value, dict):
+            digest.update(b'{')
+            for key in sorted(value):
+                update(key)
+                update(value[key])
+            digest.update(b'}')
+        elif isinstance(value, (list, tuple)):
+            digest.update(b'[')
+            for item in value:
+                update(item)
+            digest.update(b']')
+        else:
+            if isinstance(value, six.text_type):
+                value = value.encode('utf-8')
+            elif not isinstance(value, six.binary_type):
+                value = repr(value).encode('utf-8')
+            digest.update(value)
+            digest.update(b'\0')
+
+    update(info)
+    return digest.hexdigest()
 
 
 class Reader(object):  # pylint: disable=R0921
@@ -111,13 +376,19 @@ class Reader(object):  # pylint: disable=R0921
         self._blob = blob if blob is not None or kwargs.get('no_blob', False) \
             else json.get_blob()
         self._json = json
-        self._parsed = []
+        self._parsed = set()
+        self._source_tag_matches = None
+        self._timestamp = None
+        self._lazy_steps = ()
+        self._lazy_fields = {}
+        self._lazy_timestamp = None
         self.metadata = metadata or MetaData()
 
         # FIXME
         self._json._reader = self
 
-        self.model_parser = ModelParser(self.metadata)
+        # Shared by all the readers, see MetaData.model_parser
+        self.model_parser = self.metadata.model_parser
         self.field_parser = self.model_parser.field_parser
 
         self._json.bind(metadata)
@@ -132,7 +403,7 @@ class Reader(object):  # pylint: disable=R0921
         raise NotImplementedError()
 
     def add(self, fields, blob=None, metadata=None,
-            fetch_model_info=False):
+            fetch_model_info=False, lazy=False):
         """Add the list of fields to the json structure.
 
         If fields is ``None`` it adds all the possible fields from the current
@@ -140,25 +411,83 @@ class Reader(object):  # pylint: disable=R0921
 
         :param json: Any ``SmartJson`` object
         :param fields: Dict of fields to be added to the json structure
-            containing field_name:json_id
+            containing field_name:json_id, or the
+            :data:`~jsonalchemy.plan.ExecutionPlan` to add them.
+        :param lazy: if ``True`` the fields are not added yet, they are kept
+            pending until the json needs them, see :meth:`materialize`.
+
+        All the fields added get the same timestamp in their meta-metadata.
         """
         self._prepare_blob()
+        self._source_tag_matches = None
 
         if fetch_model_info:
-            self._process_model_info()
+            self._process_model_info(getattr(fields, 'projection', None))
+
+        if not isinstance(fields, ExecutionPlan):
+            if isinstance(fields, six.string_types):
+                fields = (fields, )
+            if isinstance(fields, (list, tuple)):
+                model_fields = self.model_parser.resolve_models(
+                    self._json.model_info.names).get('fields')
+                fields = dict(
+                    (json_id, model_fields.get(json_id, json_id))
+                    for json_id in fields)
+            fields = self.model_parser.create_execution_plan(
+                fields, self._json.additional_info.master_format)
+
+        if lazy:
+            self._lazy_steps = fields.steps
+            self._lazy_fields = {}
+            for step in fields.steps:
+                self._lazy_fields[step[1]] = step
+                if step[2] is not None:
+                    for alias in step[2].definition.get('aliases', []):
+                        self._lazy_fields.setdefault(alias, step)
+            self._lazy_timestamp = datetime.datetime.now().isoformat()
+            self._json._lazy_reader = self
+            return
 
-        if isinstance(fields, six.string_types):
-            fields = (fields, )
-        if isinstance(fields, (list, tuple)):
-            model_fields = self.model_parser.resolve_models(
-                self._json.model_info.names).get('fields')
-            fields = dict(
-                (field_name, model_fields.get(field_name, field_name))
-                for field_name in fields)
+        self._timestamp = datetime.datetime.now().isoformat()
+        try:
+            for json_id, field_name, field_plan in fields.steps:
+                self._apply_field_plan(json_id, field_name, field_plan)
+            self._post_process_json()
+        finally:
+            self._timestamp = None
+
+    def materialize(self, field_name=None):
+        """Add the fields kept pending by ``add(..., lazy=True)``.
+
+        The json calls it the first time one of its fields is used.  The
+        fields needed by the rules (``@depends_on``, ``@parse_first`` or just
+        used inside the expressions) are pulled in the same way.  All the
+        fields get the timestamp of the call to :meth:`add`.
+
+        :param field_name: name or alias of the field to add, if ``None`` all
+            the pending fields are added, in the same order as
+            :meth:`add` would do it, and the translation is over.
+        """
+        if field_name is None:
+            steps = self._lazy_steps
+            self._lazy_steps = ()
+            self._lazy_fields = {}
+            self._json._lazy_reader = None
+        else:
+            step = self._lazy_fields.pop(field_name, None)
+            if step is None:
+                return
+            steps = (step, )
 
-        for json_id, field_name in six.iteritems(fields):
-            self._unpack_rule(json_id, field_name)
-        self._post_process_json()
+        previous_timestamp = self._timestamp
+        self._timestamp = self._lazy_timestamp
+        try:
+            for json_id, name, field_plan in steps:
+                self._apply_field_plan(json_id, name, field_plan)
+            if field_name is None:
+                self._post_process_json()
+        finally:
+            self._timestamp = previous_timestamp
 
     def set(self, field, value=None, set_default_value=False):
         """Set new field value to json object.
@@ -177,8 +506,8 @@ class Reader(object):  # pylint: disable=R0921
         json_id = None
         if field not in self._json.meta_metadata:
             # We don't have any meta_metadata, look for it.
-            json_id = self.model_parser.resolve_models(
-                self._json.model_info)['fields'].get(field, field)
+            json_id = self.model_parser.resolve_field_names(
+                self._json.model_info.names).get(field, field)
             self._json['__meta_metadata__'][field] = self._find_field_metadata(
                 json_id, field)
 
@@ -229,11 +558,14 @@ class Reader(object):  # pylint: disable=R0921
         reader._update_meta_metadata(fields, section, keep_core_values,
                                      store_backup)
 
-    def _process_model_info(self):
+    def _process_model_info(self, projection=None):
         """Dummy method to guess the model of a given input.
 
         Should be redefined in the dedicated readers.
 
+        :param projection: json_ids of the only fields added to the record,
+            the model extensions not needed by them are skipped.
+
         :return: List of models found in the blob
         """
         if self._json.model_info.names == ['__default__']:
@@ -246,8 +578,11 @@ class Reader(object):  # pylint: disable=R0921
         for key, value in six.iteritems(model):
             if key in ('fields', 'bases'):
                 continue
-            self.model_parser.parser_extensions()[key].evaluate(self._json,
-                                                                value)
+            parser = self.model_parser.parser_extensions()[key]
+            if projection is not None and \
+                    not parser.needed_for(value, projection):
+                continue
+            parser.evaluate(self._json, value)
 
     def _guess_model_from_input(self):
         """Dummy method to guess the model of a given input.
@@ -288,6 +623,26 @@ class Reader(object):  # pylint: disable=R0921
         """
         raise NotImplementedError()
 
+    def _source_tag_keys(self, source_tag, record):
+        """Get the keys of the intermediate structure matching ``source_tag``.
+
+        The keys of ``record`` are matched only once against all the source
+        tags of the master format, see
+        :meth:`~jsonalchemy.parser.FieldParser.source_tag_index`, any other
+        source tag is used as a regular expression.
+
+        :return: List of keys, in the same order as in ``record``
+        """
+        if self._source_tag_matches is None:
+            index = self.field_parser.source_tag_index(
+                self._json.additional_info.master_format)
+            self._source_tag_matches = (index, index.lookup(record))
+        index, matches = self._source_tag_matches
+        if source_tag in index:
+            return matches.get(source_tag, [])
+        regex = re.compile(source_tag)
+        return [key for key in record if regex.match(key)]
+
     def _unpack_rule(self, json_id, field_name=None):
         """Extract the rules from the field definitions and try to apply them.
 
@@ -301,9 +656,19 @@ class Reader(object):  # pylint: disable=R0921
         :return: ``True`` if the rule for ``json_id`` was applied successfully,
             ``False`` otherwise.
         """
-        try:
-            rule = self.field_parser.field_definitions()[json_id]
-        except KeyError:
+        return self._apply_field_plan(
+            json_id, field_name, self.model_parser.field_plan(
+                json_id, self._json.additional_info.master_format))
+
+    def _apply_field_plan(self, json_id, field_name, field_plan):
+        """Apply the rules from ``field_plan`` to the current json.
+
+        :param field_plan: :data:`~jsonalchemy.plan.FieldPlan` of
+            ``json_id``, ``None`` if there is no definition for it.
+
+        :return: as :meth:`_unpack_rule`.
+        """
+        if field_plan is None:
             self._json.continuable_errors.append(
                 "Error - Unable to find '%s' field definition" % (json_id, ))
             return False
@@ -314,44 +679,42 @@ class Reader(object):  # pylint: disable=R0921
         if (json_id, field_name) in self._parsed:
             return field_name in self._json
 
-        self._parsed.append((json_id, field_name))
+        self._parsed.add((json_id, field_name))
 
         # In this two method calls the decorators are never apply because of
         # default types, i.e. when keywords are evaluated the first keyword
         # which is parsed creates a string not a list, therefore all the
         # extensions and decorator that are expecting a list will fail.
-        self._apply_rules(json_id, field_name, rule)
-        self._apply_virtual_rules(json_id, field_name, rule)
+        self._apply_rules(json_id, field_name, field_plan)
+        self._apply_virtual_rules(json_id, field_name, field_plan)
 
         self._set_default_value(json_id, field_name)
         self._set_default_type(json_id, field_name)
         self._evaluate_after_decorators(field_name)
         return field_name in self._json
 
-    def _apply_rules(self, json_id, field_name, rule):
+    def _apply_rules(self, json_id, field_name, field_plan):
         """Try to apply a 'creator' rule.
 
         :param json_id: Name os the json field in the configuration file.
         :param field_name: Final name of the field, taken from the model
             definiti, if any, otherwise is equal to the `json_id`
-        :param rule: Current rule for the `json_id`
+        :param field_plan: :data:`~jsonalchemy.plan.FieldPlan` of the
+            `json_id`
         """
-        for field_def in rule['rules'].get(
-                self._json.additional_info.master_format, []):
-            if not self._evaluate_before_decorators(field_def):
+        for rule in field_plan.creator:
+            if not self._evaluate_before_decorators(rule):
                 continue
+            field_def = rule.field_def
             for elements in \
                     self._get_elements_from_blob(field_def['source_tags']):
                 if not isinstance(elements, (list, tuple)):
                     elements = (elements, )
                 for element in elements:
-                    if not self._evaluate_on_decorators(field_def, element):
+                    if not self._evaluate_on_decorators(rule, element):
                         continue
                     try:
-                        value = try_to_eval(
-                            field_def['function'],
-                            self.metadata.functions,
-                            value=element, self=self._json)
+                        value = rule.function(element, self._json)
                         self._remove_none_values(value)
                         info = self._find_field_metadata(json_id, field_name,
                                                          'creator', field_def)
@@ -365,26 +728,23 @@ class Reader(object):  # pylint: disable=R0921
                             "'%s' with value '%s'. \n%s"
                             % (field_name, element, str(e)),)
 
-    def _apply_virtual_rules(self, json_id, field_name, rule):
+    def _apply_virtual_rules(self, json_id, field_name, field_plan):
         """Try to apply either a 'derived' or 'calculated' rule.
 
         :param json_id: Name os the json field in the configuration file.
         :param field_name: Final name of the field, taken from the model
             definiti, if any, otherwise is equal to the `json_id`
-        :param rule: Current rule for the `json_id`
+        :param field_plan: :data:`~jsonalchemy.plan.FieldPlan` of the
+            `json_id`
         """
-        field_defs = []
-        field_defs.append(('calculated', rule['rules'].get('calculated', [])))
-        field_defs.append(('derived', rule['rules'].get('derived', [])))
-        for (field_type, _field_def) in field_defs:
-            for field_def in _field_def:
-                if not self._evaluate_before_decorators(field_def):
+        for field_type, rules in (('calculated', field_plan.calculated),
+                                  ('derived', field_plan.derived)):
+            for rule in rules:
+                if not self._evaluate_before_decorators(rule):
                     continue
+                field_def = rule.field_def
                 try:
-                    value = try_to_eval(
-                        field_def['function'],
-                        self.metadata.functions,
-                        self=self._json)
+                    value = rule.function(self._json)
                     self._remove_none_values(value)
                     info = self._find_field_metadata(json_id, field_name,
                                                      field_type, field_def)
@@ -475,7 +835,8 @@ class Reader(object):  # pylint: disable=R0921
         raise NotImplementedError('Missing implementation in current version')
 
     def _find_field_metadata(self, json_id, field_name,
-                             field_type=None, field_def=None):
+                             field_type=None, field_def=None,
+                             source_tags=None):
         """Find field metadata and fill up needed meta-metadata.
 
         Given one field definition fills up the parallel dictionary with the
@@ -489,18 +850,119 @@ class Reader(object):  # pylint: disable=R0921
 
         If no rule is found the field info will be tag as ``UNKNOWN``
 
+        :param source_tags: for ``creator`` rules, the source tags the value
+            comes from if they are not the ones of ``field_def`` (which is
+            shared and never modified).
+
         :return: dictionary
         """
-        try:
-            rule = self.field_parser.field_definitions()[json_id]
-        except KeyError:
+        rule = self.field_parser.field_definitions().get(json_id)
+        if rule is None:
             self._json.continuable_errors.append(
                 "Adding a new field '%s' ('%s') without definition"
                 % (field_name, json_id))
-            rule = {}
-            field_def = {}
-            field_type = 'UNKNOWN'
+            info = self._create_field_metadata(json_id, {}, 'UNKNOWN', {})
+        else:
+            for alias in rule.get('aliases', []):
+                self._json['__meta_metadata__']['__aliases__'][alias] = \
+                    field_name
+            info = OverlayDict(self._field_metadata_template(
+                json_id, rule, field_type, field_def, source_tags))
+        info['timestamp'] = self._timestamp or \
+            datetime.datetime.now().isoformat()
+        return info
 
+    def resolve_field_metadata(self, field_name, ref, changes):
+        """Rebuild the meta-metadata of a field from its compact form.
+
+        The shared meta-metadata is the template with the same digest, the
+        rule at ``rule_index`` is tried first.  If the field definition
+        changed and none of its rules has the same template anymore the
+        meta-metadata is found again, as for a field without information
+        about its rule, see :meth:`_find_field_metadata`.
+
+        :param ref: :attr:`FieldInfoTemplate.ref` of the shared
+            meta-metadata, lists are accepted instead of tuples.
+        :param changes: meta-metadata of the field only for this record, like
+            the timestamp.
+
+        :return: dictionary
+        """
+        json_id, field_type, rule_index, source_tags, digest = ref
+        if source_tags is not None:
+            source_tags = list(source_tags)
+        rule = self.field_parser.field_definitions().get(json_id)
+        if rule is not None:
+            field_defs = [None]
+            if field_type is not None:
+                field_defs = rule.get('rules', {}).get(
+                    self._json.additional_info.master_format
+                    if field_type == 'creator' else field_type, [])
+                if rule_index is not None and rule_index < len(field_defs):
+                    field_defs = [field_defs[rule_index]] + field_defs
+            for field_def in field_defs:
+                info = self._field_metadata_template(
+                    json_id, rule, field_type if field_def is not None
+                    else None, field_def, source_tags)
+                if info.ref is not None and info.ref[-1] == digest:
+                    return OverlayDict(info, changes)
+        info = self._find_field_metadata(json_id, field_name,
+                                         source_tags=source_tags)
+        info.update(changes)
+        return info
+
+    def _field_metadata_template(self, json_id, rule, field_type, field_def,
+                                 source_tags):
+        """Get the meta-metadata of a field without its timestamp.
+
+        It is created once for each rule and source tags and shared by all
+        the records, see :class:`FieldInfoTemplate` and
+        :attr:`~jsonalchemy.parser.FieldParser.info_templates`.
+        """
+        master_format = None
+        if field_def is None:
+            # The first rule available is used, whatever the field type
+            field_type = None
+            master_format = self._json.additional_info.master_format
+        key = (json_id, field_type, id(field_def), master_format,
+               None if source_tags is None else tuple(source_tags))
+        templates = self.field_parser.info_templates
+        try:
+            cached_field_def, info = templates[key]
+            # The identity of the definition can't be reused while cached
+            if cached_field_def is field_def:
+                return info
+        except KeyError:
+            pass
+        info = self._create_field_metadata(json_id, rule, field_type,
+                                           field_def, source_tags)
+        info = FieldInfoTemplate(
+            info, self._field_metadata_ref(json_id, rule, field_type,
+                                           field_def, source_tags, info))
+        templates[key] = (field_def, info)
+        return info
+
+    def _field_metadata_ref(self, json_id, rule, field_type, field_def,
+                            source_tags, info):
+        """Create the :attr:`FieldInfoTemplate.ref` of a field."""
+        rule_index = None
+        if field_def is not None:
+            rules = rule.get('rules', {}).get(
+                self._json.additional_info.master_format
+                if field_type == 'creator' else field_type, [])
+            for index, other in enumerate(rules):
+                if other is field_def:
+                    rule_index = index
+                    break
+            else:
+                return None
+        return (json_id, field_type, rule_index,
+                None if source_tags is None else tuple(source_tags),
+                _template_digest(info))
+
+    def _create_field_metadata(self, json_id, rule, field_type, field_def,
+                               source_tags=None):
+        """Create the meta-metadata of a field without the timestamp."""
         if field_def is None:
             if self._json.additional_info.master_format in \
                     rule.get('rules', {}):
@@ -517,12 +979,8 @@ class Reader(object):  # pylint: disable=R0921
                 field_def = {}
                 field_type = 'UNKNOWN'
 
-        for alias in rule.get('aliases', []):
-            self._json['__meta_metadata__']['__aliases__'][alias] = field_name
-
         info = {}
         info['json_id'] = json_id
-        info['timestamp'] = datetime.datetime.now().isoformat()
         info['pid'] = rule.get('pid', None)
         info['type'] = field_type
         info['hidden'] = rule.get('hidden', False)
@@ -531,7 +989,8 @@ class Reader(object):  # pylint: disable=R0921
         elif field_type == 'UNKNOWN':
             info['function'] = 'UNKNOWN'
         else:
-            info['function'] = field_def['source_tags']
+            info['function'] = source_tags if source_tags is not None \
+                else field_def['source_tags']
 
         # Decorator extensions
         info['after'] = dict()
@@ -575,19 +1034,26 @@ class Reader(object):  # pylint: disable=R0921
         # TODO
         raise NotImplementedError('Missing implementation on this version')
 
-    def _evaluate_before_decorators(self, field_def):
-        """Evaluate all the before decorators (they must return a boolean)."""
-        for name, content in six.iteritems(field_def['decorators']['before']):
-            if not self.field_parser.decorator_before_extensions()[name]\
-                    .evaluate(self, content):
+    def _evaluate_before_decorators(self, rule):
+        """Evaluate all the before decorators (they must return a boolean).
+
+        :param rule: :data:`~jsonalchemy.plan.RulePlan`
+        """
+        for evaluate, content in rule.before:
+            if not evaluate(self, content):
                 return False
         return True
 
-    def _evaluate_on_decorators(self, field_def, master_value):
-        """Evaluate all the on decorators (they must return a boolean."""
-        for name, content in six.iteritems(field_def['decorators']['on']):
-            if not self.field_parser.decorator_on_extensions()[name]\
-                    .evaluate(master_value, self.metadata, content):
+    def _evaluate_on_decorators(self, rule, master_value, source_tag=None):
+        """Evaluate all the on decorators (they must return a boolean.
+
+        :param rule: :data:`~jsonalchemy.plan.RulePlan`
+        :param source_tag: tag of the input where ``master_value`` comes from,
+            if known.
+        """
+        for evaluate, content in rule.on:
+            if not evaluate(master_value, self.metadata, content,
+                            source_tag=source_tag):
                 return False
         return True
 
@@ -22,6 +22,7 @@ import re
 import six
 import importlib
 import pkgutil
+import threading
 
 from functools import partial
 from pkg_resources import resource_listdir, resource_isdir
@@ -107,9 +108,26 @@ class MetaData(object):
 
     __default_package__ = 'jsonalchemy.jsonext'
 
-    def __init__(self, packages=None):
-        """Initialize metadata with a list of packages."""
+    def __init__(self, packages=None, cache_dir=None, parse_processes=None,
+                 parser_backend='fast'):
+        """Initialize metadata with a list of packages.
+
+        :param cache_dir: if set, the parsed field and model definitions are
+            stored in this directory and reused by any other metadata with
+            the same configuration, see :mod:`jsonalchemy.cache`.
+        :param parse_processes: if bigger than one, the field configuration
+            files are parsed concurrently using this number of processes.
+        :param parser_backend: parser used for the field configuration files,
+            ``'fast'`` (see :mod:`jsonalchemy.fast_parser`) or
+            ``'pyparsing'``.
+        """
         self.packages = map(Package, packages or [self.__default_package__])
+        self.cache_dir = cache_dir
+        self.parse_processes = parse_processes
+        self.parser_backend = parser_backend
+        self._parsers_lock = threading.RLock()
+        self._field_parser = None
+        self._model_parser = None
 
     def _dict_merge(self, attr):
         value = getattr(self, '_cache_' + attr, None)
@@ -157,6 +175,54 @@ class MetaData(object):
     def models(self):
         return self._list_merge('models')
 
+    @property
+    def definitions_cache(self):
+        """Get the definitions cache or ``None`` if it is not enabled."""
+        if self.cache_dir is None:
+            return None
+        if getattr(self, '_definitions_cache', None) is None:
+            from .cache import DefinitionsCache
+            self._definitions_cache = DefinitionsCache(self.cache_dir)
+        return self._definitions_cache
+
+    @property
+    def field_parser(self):
+        """Get the field parser shared by everything using this metadata.
+
+        It is created the first time it is needed.  Any
+        :class:`~jsonalchemy.parser.FieldParser` created later for this
+        metadata replaces it.
+        """
+        if self._field_parser is None:
+            with self._parsers_lock:
+                if self._field_parser is None:
+                    from .parser import FieldParser
+                    FieldParser(self)
+        return self._field_parser
+
+    @field_parser.setter
+    def field_parser(self, field_parser):
+        self._field_parser = field_parser
+
+    @property
+    def model_parser(self):
+        """Get the model parser shared by everything using this metadata.
+
+        As :attr:`field_parser` it is created the first time it is needed,
+        using the current field parser, and replaced by any
+        :class:`~jsonalchemy.parser.ModelParser` created later.
+        """
+        if self._model_parser is None:
+            with self._parsers_lock:
+                if self._model_parser is None:
+                    from .parser import ModelParser
+                    ModelParser(self, field_parser=self.field_parser)
+        return self._model_parser
+
+    @model_parser.setter
+    def model_parser(self, model_parser):
+        self._model_parser = model_parser
+
     def legacy_field_matchings(self):
         """Get all the legacy mappings for a given namespace.
 
@@ -165,9 +231,6 @@ class MetaData(object):
         :see: guess_legacy_field_names()
         """
         if getattr(self, '_legacy_field_matchings', None) is None:
-            if getattr(self, 'field_parser', None) is None:
-                from .parser import FieldParser
-                self.field_parser = FieldParser(self)
             self.field_parser.field_definitions()
         return self._legacy_field_matchings
 
@@ -22,7 +22,13 @@
 
 class Storage(object):
 
-    """Default storage engine interface."""
+    """Default storage engine interface.
+
+    The storage engines save the JSON friendly form of the records, use
+    ``json.dumps(compact=True)`` to leave out the meta-metadata shared by the
+    records and ``SmartJson(stored, metadata=metadata)`` to load them back,
+    see :meth:`~jsonalchemy.wrappers.SmartJson.dumps`.
+    """
 
     # TODO: set return values on success and error and setup a log function
     # TODO: create a query class to mimic SQLAlchemy query object
@@ -19,8 +19,15 @@
 
 """Utility functions."""
 
+import copy
 import importlib
+import itertools
 import os
+import six
+import symtable
+
+from collections import MutableMapping
+from six.moves import builtins
 
 
 def try_to_eval(string, context={}, **general_context):
@@ -28,6 +35,10 @@ def try_to_eval(string, context={}, **general_context):
 
     If an exception happens, it tries to import the needed module.
 
+    Each evaluation uses its own namespace, built from ``context`` and
+    ``general_context``, and the imported modules only go there, therefore it
+    can be used from several threads at the same time.
+
     :param string: String to evaluate
     :param context: Context needed, in some cases, to evaluate the string
 
@@ -38,12 +49,13 @@ def try_to_eval(string, context={}, **general_context):
 
     res = None
     imports = []
-    general_context.update(context)
+    namespace = dict(general_context)
+    namespace.update(context)
     simple = False
     while True:
         try:
             # kwalitee: disable=eval
-            res = eval(string, globals().update(general_context), locals())
+            res = eval(string, namespace)
         except NameError as err:
             # Try first to import using werkzeug import_string
             try:
@@ -62,22 +74,234 @@ def try_to_eval(string, context={}, **general_context):
             import_name = str(err).split("'")[1]
             if import_name not in imports:
                 if import_name in context:
-                    globals()[import_name] = context[import_name]
+                    namespace[import_name] = context[import_name]
                 else:
-                    globals()[import_name] = __import__(import_name)
+                    namespace[import_name] = __import__(import_name)
                     imports.append(import_name)
                 continue
             elif simple:
                 import_name = str(err).split("'")[0]
                 if import_name in context:
-                    globals()[import_name] = context[import_name]
+                    namespace[import_name] = context[import_name]
                 else:
-                    globals()[import_name] = __import__(import_name)
+                    namespace[import_name] = __import__(import_name)
                     imports.append(import_name)
                 continue
 
             raise ImportError("Can't import the needed module to evaluate %s"
-                              (string, ))
+                              % (string, ))
         if isinstance(res, type(os)):
             raise ImportError
         return res
+
+
+def compile_expression(expression, namespace, arguments=('value', 'self')):
+    """Create a function evaluating the python ``expression``.
+
+    The ``arguments`` are the parameters of the function, all of them
+    default to ``None``.  Any other name used by the expression is resolved
+    only once, when the function is created, looking for it in
+    ``namespace``, in the builtins and finally importing the module with that
+    name.
+
+    :param expression: String with the python expression
+    :param namespace: Dictionary with the names available to the expression,
+        usually ``metadata.functions``
+
+    :return: The function and the list of names which couldn't be resolved,
+        the function raises :exc:`NameError` if it gets to use any of them.
+    """
+    source = 'lambda %s: (\n%s\n)' % (
+        ', '.join('%s=None' % (argument, ) for argument in arguments),
+        expression)
+
+    names = set()
+    tables = [symtable.symtable(source, '<expression>', 'eval')]
+    while tables:
+        table = tables.pop()
+        names.update(symbol.get_name() for symbol in table.get_symbols()
+                     if symbol.is_global() and symbol.is_referenced())
+        tables.extend(table.get_children())
+
+    context = {}
+    unresolved = []
+    for name in sorted(names):
+        if name in namespace:
+            context[name] = namespace[name]
+        elif not hasattr(builtins, name):
+            try:
+                context[name] = importlib.import_module(name)
+            except ImportError:
+                unresolved.append(name)
+
+    # kwalitee: disable=eval
+    return eval(compile(source, '<expression>', 'eval'), context), unresolved
+
+
+class LRUCache(object):
+
+    """Cache keeping at most ``maxsize`` values, the least recently used go.
+
+    Reading a value costs a dictionary lookup and the update of its time of
+    use, no order is kept.  Once the cache is full the least recently used
+    quarter of the values is dropped at once, so the cost of the eviction is
+    shared by many insertions.  It can be used from several threads.
+    """
+
+    def __init__(self, maxsize):
+        """Initialize an empty cache."""
+        self.maxsize = maxsize
+        self._data = {}
+        self._clock = itertools.count()
+
+    def get(self, key, default=None):
+        """Get the value of ``key`` or ``default`` if it is not cached."""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        entry[1] = next(self._clock)
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        if len(self._data) >= self.maxsize:
+            entries = sorted(list(self._data.items()),
+                             key=lambda item: item[1][1])
+            for old_key, dummy in entries[:max(1, len(entries) // 4)]:
+                self._data.pop(old_key, None)
+        self._data[key] = [value, next(self._clock)]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        """Remove all the values."""
+        self._data.clear()
+
+
+class FrozenDict(dict):
+
+    """Dictionary which can't be modified once created.
+
+    It is still a :class:`dict`, so reading from it is as fast as from any
+    other dictionary.  Use ``dict(frozen)`` to get a modifiable copy.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("'%s' object is read-only" % (type(self).__name__, ))
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _read_only
+
+    def __reduce__(self):
+        """Pickle it as a plain dictionary."""
+        return (type(self), (dict(self), ))
+
+    def copy(self):
+        """Get a modifiable copy."""
+        return dict(self)
+
+
+class FrozenList(list):
+
+    """List which can't be modified once created, see :class:`FrozenDict`.
+
+    Use ``list(frozen)`` to get a modifiable copy.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("'%s' object is read-only" % (type(self).__name__, ))
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = extend = \
+        insert = pop = remove = reverse = sort = _read_only
+    __setslice__ = __delslice__ = _read_only  # python 2
+
+    def __reduce__(self):
+        """Pickle it as a plain list."""
+        return (type(self), (list(self), ))
+
+
+def freeze(value):
+    """Get a read-only copy of ``value`` and of the values inside it.
+
+    The dictionaries become :class:`FrozenDict` and the lists
+    :class:`FrozenList`, any other value is kept as it is.
+    """
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item))
+                          for key, item in six.iteritems(value))
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    if isinstance(value, tuple):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class OverlayDict(MutableMapping):
+
+    """Dictionary made of a shared read-only ``base`` and its own changes.
+
+    Only the changes are stored, so many dictionaries differing in a few keys
+    from the same ``base`` take little memory.  Setting a key never modifies
+    ``base``, it goes to ``changes``.  Use ``overlay.copy()`` to get a plain
+    dictionary with the content of both.
+    """
+
+    __slots__ = ('base', 'changes')
+
+    def __init__(self, base, changes=None):
+        """Initialize the dictionary on top of ``base``."""
+        self.base = base
+        self.changes = {} if changes is None else changes
+
+    def __getitem__(self, key):
+        if key in self.changes:
+            return self.changes[key]
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        self.changes[key] = value
+
+    def __delitem__(self, key):
+        if key in self.base:
+            # The base can't be modified, keep a copy of it instead
+            changes = dict(self.base)
+            changes.update(self.changes)
+            self.base = {}
+            self.changes = changes
+        del self.changes[key]
+
+    def __contains__(self, key):
+        return key in self.changes or key in self.base
+
+    def __iter__(self):
+        for key in self.changes:
+            yield key
+        for key in self.base:
+            if key not in self.changes:
+                yield key
+
+    def __len__(self):
+        return len(self.base) + sum(1 for key in self.changes
+                                    if key not in self.base)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.copy())
+
+    def __reduce__(self):
+        return (type(self), (self.base, self.changes))
+
+    def __copy__(self):
+        return type(self)(self.base, dict(self.changes))
+
+    def __deepcopy__(self, memo):
+        # The base is shared, it is read-only
+        return type(self)(self.base, copy.deepcopy(self.changes, memo))
+
+    def copy(self):
+        """Get a plain dictionary with the same content."""
+        dict_ = dict(self.base)
+        dict_.update(self.changes)
+        return dict_
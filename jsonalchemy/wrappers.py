@@ -23,11 +23,52 @@ import copy
 import re
 import six
 
-from collections import MutableMapping
+from collections import MutableMapping, namedtuple
 from six import iteritems
 
-from .parser import ModelParser
 from .reader import Reader
+from .utils import LRUCache, OverlayDict
+
+SmartKey = namedtuple('SmartKey', ('main_key', 'rest_of_key', 'keys',
+                                   'steps'))
+"""Key of :class:`SmartDict` parsed once, see :meth:`SmartDict.smart_key`.
+
+``main_key`` is the first level key and ``rest_of_key`` the remaining part
+of the key, starting with ``.`` or ``[``.  ``keys`` are the parts of the key
+used to set values and ``steps`` the ``(key, index)`` pairs used to get
+them, where ``index`` is the list index or slice of the part, if any.
+"""
+
+_INVALID_INDEX = object()
+
+_MISSING = object()
+
+
+def _parse_index(key):
+    """Get the list index or slice from the part of a key like ``'1:]'``."""
+    key = key[:-1].replace('n', '-1')
+    try:
+        return int(key)
+    except ValueError:
+        return slice(*map(
+            lambda x: int(x.strip()) if x.strip() else None,
+            key.split(':')
+        ))
+
+
+def _get_step(step, value):
+    """Apply one of the ``steps`` of a :data:`SmartKey` to ``value``."""
+    key, index = step
+    if isinstance(value, (dict, OverlayDict)):
+        return value[key]
+    elif index is None:
+        if isinstance(value, six.string_types):
+            # Iterating the characters would never end
+            raise KeyError(key)
+        return [_get_step(step, inner_value) for inner_value in value]
+    elif index is _INVALID_INDEX:
+        _parse_index(key)  # raises the error
+    return value[index]
 
 
 class SmartDict(object):
@@ -70,53 +111,66 @@ class SmartDict(object):
     split_key_pattern = re.compile('\.|\[')
     main_key_pattern = re.compile('\..*|\[.*')
 
+    _smart_keys = LRUCache(10000)
+    """Keys already parsed by :meth:`smart_key`, shared by all the
+    instances."""
+
     def __init__(self, d=None):
         self._dict = d if d is not None else dict()
 
+    @staticmethod
+    def smart_key(key):
+        """Parse ``key`` into a :data:`SmartKey`.
+
+        The keys are parsed only once, the result is kept in a cache of the
+        most recently used ones.
+        """
+        smart_key = SmartDict._smart_keys.get(key)
+        if smart_key is None:
+            keys = tuple(SmartDict.split_key_pattern.split(key))
+            steps = []
+            for k in keys:
+                index = None
+                if ']' in k:
+                    try:
+                        index = _parse_index(k)
+                    except ValueError:
+                        index = _INVALID_INDEX
+                steps.append((k, index))
+            rest_of_key = SmartDict.main_key_pattern.findall(key)
+            smart_key = SmartDict._smart_keys[key] = SmartKey(
+                SmartDict.main_key_pattern.sub('', key),
+                rest_of_key[0] if rest_of_key else '', keys, tuple(steps))
+        return smart_key
+
     def __getitem__(self, key):
         """Return item as `dict.__getitem__` but using 'smart queries'.
 
         .. note::
             Accessing one value in a normal way, meaning d['a'], is almost as
             fast as accessing a regular dictionary. But using the special
-            name convention is a bit slower than using the regular access:
+            name convention is a bit slower than using the regular access,
+            even if the key is parsed only once (see :meth:`smart_key`):
 
             .. code-block:: python
 
                 >>> %timeit x = dd['a[0].b']
-                100000 loops, best of 3: 3.94 us per loop
+                1000000 loops, best of 3: 1.7 us per loop
                 >>> %timeit x = dd['a'][0]['b']
                 1000000 loops, best of 3: 598 ns per loop
         """
-        def getitem(k, v):
-            if isinstance(v, dict):
-                return v[k]
-            elif ']' in k:
-                k = k[:-1].replace('n', '-1')
-                # Work around for list indexes and slices
-                try:
-                    return v[int(k)]
-                except ValueError:
-                    return v[slice(*map(
-                        lambda x: int(x.strip()) if x.strip() else None,
-                        k.split(':')
-                    ))]
-            else:
-                tmp = []
-                for inner_v in v:
-                    tmp.append(getitem(k, inner_v))
-                return tmp
-
         # Check if we are using python regular keys
-        try:
-            return self._dict[key]
-        except KeyError:
-            pass
+        value = self._dict.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
 
-        keys = SmartDict.split_key_pattern.split(key)
+        smart_key = SmartDict._smart_keys.get(key) or self.smart_key(key)
         value = self._dict
-        for k in keys:
-            value = getitem(k, value)
+        for step in smart_key.steps:
+            if isinstance(value, dict):
+                value = value[step[0]]
+            else:
+                value = _get_step(step, value)
         return value
 
     def __setitem__(self, key, value, extend=False, **kwargs):
@@ -128,7 +182,7 @@ class SmartDict(object):
         if '.' not in key and ']' not in key and not extend:
             self._dict[key] = value
         else:
-            keys = SmartDict.split_key_pattern.split(key)
+            keys = self.smart_key(key).keys
             self.__setitem(self._dict, keys[0], keys[1:], value, extend)
 
     def __delitem__(self, key):
@@ -248,6 +302,100 @@ class SmartDict(object):
         """Proxy `dict` update method."""
         self._dict.update(E, **F)
 
+    @staticmethod
+    def extract(records, paths, default=None, dtypes=None):
+        """Get the values of several smart keys from many records at once.
+
+        The keys are parsed only once and each record is walked once for all
+        of them, the keys sharing a beginning (like ``'authors.full_name'``
+        and ``'authors.affiliation'``) share also the lookups.  The first
+        level of each record is accessed as ``record[main_key]``, so for
+        :class:`SmartJson` the aliases, extensions and decorators apply as
+        usual.
+
+        .. code-block:: python
+
+            >>> columns = SmartDict.extract(records,
+            ...                             ['recid', 'authors.full_name'])
+            >>> columns['authors.full_name']
+            [['Ellis, J', 'Smith, A'], ['Efstathiou, G P']]
+
+        :param records: iterable of :class:`SmartDict` (or dictionaries).
+        :param paths: smart keys to extract.
+        :param default: value used when a key is not in a record.
+        :param dtypes: if set, the columns are NumPy arrays instead of lists,
+            it is either the dtype of all of them or a dictionary
+            ``{path: dtype}``, using ``object`` for the missing paths.
+        :return: dictionary ``{path: column}``, with one value per record in
+            each column.
+        """
+        paths = list(paths)
+        columns = [[] for dummy in paths]
+
+        # Tree of the steps of all the keys, each node is
+        # [step, children, columns ending here, columns of the subtree]
+        root = [None, {}, [], []]
+        nodes = [root]
+        for column, path in enumerate(paths):
+            node = root
+            node[3].append(column)
+            for step in SmartDict.smart_key(path).steps:
+                child = node[1].get(step[0])
+                if child is None:
+                    child = node[1][step[0]] = [step, {}, [], []]
+                    nodes.append(child)
+                node = child
+                node[3].append(column)
+            node[2].append(column)
+        for node in nodes:
+            node[1] = tuple(sorted(six.itervalues(node[1]),
+                                   key=lambda child: child[3][0]))
+
+        def missing(node):
+            for column in node[3]:
+                columns[column].append(default)
+
+        def fill(node, value):
+            for column in node[2]:
+                columns[column].append(value)
+            for child in node[1]:
+                try:
+                    if isinstance(value, dict):
+                        child_value = value[child[0][0]]
+                    else:
+                        child_value = _get_step(child[0], value)
+                except (KeyError, IndexError, TypeError):
+                    missing(child)
+                else:
+                    fill(child, child_value)
+
+        for record in records:
+            for node in root[1]:
+                try:
+                    value = record[node[0][0]]
+                except (KeyError, IndexError, TypeError):
+                    missing(node)
+                else:
+                    fill(node, value)
+
+        if dtypes is not None:
+            import numpy
+
+            arrays = []
+            for path, column in zip(paths, columns):
+                dtype = dtypes.get(path, object) \
+                    if isinstance(dtypes, dict) else dtypes
+                if numpy.dtype(dtype) == numpy.dtype(object):
+                    # Lists as values must not become new dimensions
+                    array = numpy.empty(len(column), dtype=object)
+                    for index, value in enumerate(column):
+                        array[index] = value
+                else:
+                    array = numpy.array(column, dtype=dtype)
+                arrays.append(array)
+            columns = arrays
+        return dict(zip(paths, columns))
+
 MutableMapping.register(SmartDict)
 
 
@@ -276,10 +424,101 @@ class DotableDict(dict):
         self[key] = value
 
 
+class DotableView(MutableMapping):
+
+    """Dot notation access to a dictionary, without copying it.
+
+    Unlike :class:`DotableDict` the changes go to the dictionary itself.
+
+    Example:
+
+    .. code-block:: python
+
+        >>> d = {'a': [{'b': 3, 'c': 5}]}
+        >>> view = DotableView(d)
+        >>> view.a
+        ...  [{'b': 3, 'c': 5}]
+        >>> view.d = 1
+        >>> d['d']
+        ... 1
+    """
+
+    __slots__ = ('_data', )
+
+    def __init__(self, data):
+        object.__setattr__(self, '_data', data)
+
+    def __getattr__(self, key):
+        """Return value from dictionary."""
+        try:
+            return self._data[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        """Set value for given key in dictionary."""
+        self._data[key] = value
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, DotableView):
+            other = other._data
+        return self._data == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        """Proxy to `dict.__repr__`."""
+        return repr(self._data)
+
+    def get(self, key, default=None):
+        """Proxy to `dict.get`."""
+        return self._data.get(key, default)
+
+    def keys(self):
+        """Proxy to `dict.keys`."""
+        return self._data.keys()
+
+    def items(self):
+        """Proxy to `dict.items`."""
+        return self._data.items()
+
+    def values(self):
+        """Proxy to `dict.values`."""
+        return self._data.values()
+
+    def copy(self):
+        """Get a copy of the dictionary."""
+        return DotableDict(self._data)
+
+
 class SmartJson(SmartDict):
 
     """Base class for Json structures."""
 
+    _lazy_reader = None
+    """Reader with the fields still pending of a lazy translation."""
+
     def __init__(self, json=None, set_default_values=False,
                  process_model_info=False, metadata=None, **kwargs):
         """If no JSON, a new structure will be created.
@@ -322,7 +561,8 @@ class SmartJson(SmartDict):
         """
         super(SmartJson, self).__init__(json)
         self._dict_bson = SmartDict()
-        self._metadata = metadata
+        self._bson_valid = set()
+        self.bind(metadata)
 
         if not json or '__meta_metadata__' not in json:
             model_names = kwargs.get('model', ['__default__', ])
@@ -352,6 +592,42 @@ class SmartJson(SmartDict):
 
     def bind(self, metadata):
         self._metadata = metadata
+        if metadata is not None and '__compact__' in \
+                self._dict.get('__meta_metadata__', ()):
+            self._expand_meta_metadata()
+
+    def _expand_meta_metadata(self):
+        """Resolve the meta-metadata of the fields stored in compact form.
+
+        See :meth:`dumps`, the shared meta-metadata is looked up by the
+        reader of the master format.  The stored dictionary given to the json
+        is left as it is, the json keeps a copy of it instead.
+        """
+        self._dict = dict(self._dict)
+        meta_metadata = self._dict['__meta_metadata__'] = dict(
+            self._dict['__meta_metadata__'])
+        del meta_metadata['__compact__']
+        reader = self.reader
+        for field_name, info in list(six.iteritems(meta_metadata)):
+            if isinstance(info, dict) and '__info__' in info:
+                changes = dict(info)
+                meta_metadata[field_name] = reader.resolve_field_metadata(
+                    field_name, changes.pop('__info__'), changes)
+
+    def _dumps_meta_metadata(self, compact=False):
+        """Get a JSON friendly copy of the meta-metadata, see `dumps`."""
+        meta_metadata = dict(self._dict['__meta_metadata__'])
+        for field_name, info in six.iteritems(self._dict['__meta_metadata__']):
+            if not isinstance(info, OverlayDict):
+                continue
+            ref = getattr(info.base, 'ref', None)
+            if compact and ref is not None:
+                meta_metadata[field_name] = dict(info.changes,
+                                                 __info__=list(ref))
+                meta_metadata['__compact__'] = True
+            else:
+                meta_metadata[field_name] = info.copy()
+        return meta_metadata
 
     @property
     def reader(self):
@@ -361,10 +637,20 @@ class SmartJson(SmartDict):
                                metadata=self.metadata)
         return self._reader
 
+    def _materialize(self, key=None):
+        """Add the pending fields of a lazy translation, if any.
+
+        :param key: only add the field used by ``key``, if ``None`` all.
+        """
+        if self._lazy_reader is not None:
+            self._lazy_reader.materialize(
+                None if key is None else self.smart_key(key).main_key)
+
     @property
     def additional_info(self):
         """Shortcut to `__meta_metadata__.__additional_info__`."""
-        return DotableDict(self['__meta_metadata__']['__additional_info__'])
+        return DotableView(
+            self._dict['__meta_metadata__']['__additional_info__'])
 
     @property
     def errors(self):
@@ -379,12 +665,12 @@ class SmartJson(SmartDict):
     @property
     def meta_metadata(self):
         """Shortcut to `__meta_metadata__`."""
-        return DotableDict(self._dict['__meta_metadata__'])
+        return DotableView(self._dict['__meta_metadata__'])
 
     @property
     def model_info(self):
         """Shortcut to `__meta_metadata__.__model_info__`."""
-        return DotableDict(self._dict['__meta_metadata__']['__model_info__'])
+        return DotableView(self._dict['__meta_metadata__']['__model_info__'])
 
     def __getitem__(self, key, reset=False, **kwargs):
         """Like in `dict.__getitem__`.
@@ -394,6 +680,11 @@ class SmartJson(SmartDict):
         the `key`, applies all the extensions and decorators and return the
         value that is stored in the BSON object as a cached version.
 
+        The fields whose BSON value is up to date are tracked apart from the
+        value, so any value (also ``0``, ``''`` or ``None``) is cached.  The
+        value of a field stops being valid when the field is deleted or an
+        extension invalidates it, see :meth:`invalidate`.
+
         If the key is not found inside the dictionary, it tries before raising
         `KeyError` to figure out if it is dealing with an alias.
 
@@ -407,14 +698,16 @@ class SmartJson(SmartDict):
 
         :return: Like in `dict.__getitem__`
         """
-        try:
-            value = self._dict_bson[key]
-            if value and not reset:
-                return value
-        except KeyError:
-            # Try to find the key inside the json dict and load it
-            pass
-        main_key = SmartDict.main_key_pattern.sub('', key)
+        if self._lazy_reader is not None:
+            self._materialize(key)
+        smart_key = self.smart_key(key)
+        main_key = smart_key.main_key
+        if main_key in self._bson_valid and not reset:
+            try:
+                return self._dict_bson[key]
+            except KeyError:
+                # Try to find the key inside the json dict and load it
+                pass
         if main_key == '__meta_metadata__':
             return super(SmartJson, self).__getitem__(key)
         elif main_key in self._dict:
@@ -437,15 +730,12 @@ class SmartJson(SmartDict):
                     self.metadata.decorator_after_extensions[ext].evaluate(
                         self, main_key, action, args)
 
+            self._bson_valid.add(main_key)
             return self._dict_bson[key]
         else:
-            try:
-                rest_of_key = SmartDict.main_key_pattern.findall(key)[0]
-            except IndexError:
-                rest_of_key = ''
             return self[
                 self._dict['__meta_metadata__']['__aliases__'][main_key] +
-                rest_of_key]
+                smart_key.rest_of_key]
 
     def __setitem__(self, key, value, extend=False, **kwargs):
         """Like in `dict.__setitem__`.
@@ -469,7 +759,9 @@ class SmartJson(SmartDict):
             *`exclude`, from the list of extensions and decorators excludes the
             ones that are not required.
         """
-        main_key = SmartDict.main_key_pattern.sub('', key)
+        if self._lazy_reader is not None:
+            self._materialize(key)
+        main_key = self.smart_key(key).main_key
         # If we have meta_metadata for the main key go ahead
         if main_key in self.meta_metadata:
             self._dict_bson.__setitem__(key, value, extend)
@@ -477,6 +769,8 @@ class SmartJson(SmartDict):
         else:
             self.reader.set(main_key)
             self._dict_bson.__setitem__(key, value, extend, **kwargs)
+        # The extensions might invalidate it
+        self._bson_valid.add(main_key)
         action = kwargs.get('action', 'set')
         exclude = kwargs.get('exclude', [])
         if 'decorators' not in exclude:
@@ -494,12 +788,34 @@ class SmartJson(SmartDict):
                 self.metadata.field_extensions[ext].evaluate(
                     self, main_key, action, args)
 
+    def __contains__(self, key):
+        """Like in `dict.__contains__`."""
+        if self._lazy_reader is not None:
+            self._materialize(key)
+        return super(SmartJson, self).__contains__(key)
+
+    def __eq__(self, other):
+        """Compare the content, once all the fields are there."""
+        self._materialize()
+        return super(SmartJson, self).__eq__(other)
+
+    def __iter__(self):
+        """Like in `dict.__iter__`."""
+        self._materialize()
+        return super(SmartJson, self).__iter__()
+
+    def __len__(self):
+        """Like in `dict.__len__`."""
+        self._materialize()
+        return super(SmartJson, self).__len__()
+
     def __str__(self):
         """Representation of the object **without** the meta_metadata."""
         return self.dumps(without_meta_metadata=True).__str__()
 
     def __repr__(self):
         """Full string representation of the JSON object."""
+        self._materialize()
         return self._dict.__repr__()
 
     def __delitem__(self, key):
@@ -507,13 +823,23 @@ class SmartJson(SmartDict):
 
         Note: It only works with default python keys
         """
+        self._materialize(key)
         self._dict.__delitem__(key)
         del self._dict['__meta_metadata__'][key]
+        self.invalidate(key)
         try:
             del self._dict_bson[key]
         except KeyError:
             pass
 
+    def invalidate(self, field_name):
+        """Stop using the BSON value of ``field_name``.
+
+        The next time the field is read its value is loaded again from the
+        JSON dictionary, applying the extensions and decorators.
+        """
+        self._bson_valid.discard(field_name)
+
     def get(self, key, default=None, reset=False, **kwargs):
         """Like in `dict.get`."""
         try:
@@ -531,10 +857,18 @@ class SmartJson(SmartDict):
 
     def keys(self, without_meta_metadata=False):
         """Like in `dict.keys`."""
+        self._materialize()
         for key in super(SmartJson, self).keys():
             if key == '__meta_metadata__' and without_meta_metadata:
                 continue
             yield key
+    iterkeys = keys
+
+    def values(self, without_meta_metadata=False):
+        """Like in `dict.values`."""
+        for dummy, value in self.items(without_meta_metadata):
+            yield value
+    itervalues = values
 
     def get_blob(self, *args, **kwargs):
         """To be override in the specific class.
@@ -545,11 +879,16 @@ class SmartJson(SmartDict):
         raise NotImplementedError()
 
     def dumps(self, without_meta_metadata=False, with_calculated_fields=False,
-              clean=False, keywords=None, filter_hidden=False):
+              clean=False, keywords=None, filter_hidden=False, compact=False):
         """Create the JSON friendly representation of the current object.
 
         :param without_meta_metadata: by default ``False``, if set to ``True``
             all the ``__meta_metadata__`` will be removed from the output.
+        :param compact: if set to ``True`` the meta-metadata shared with the
+            other records of the same fields is replaced by a reference
+            (``__info__``), which is how a storage should save the records.
+            Creating a ``SmartJson`` from the output with ``metadata`` set
+            restores it.
         :param wit_calculated_fields: by default the calculated fields are not
             dump, if they are needed in the output set it to ``True``
         :param clean: if set to ``True`` all the keys stating with ``_`` will
@@ -558,11 +897,14 @@ class SmartJson(SmartDict):
 
         :return: JSON friendly object
         """
+        self._materialize()
         dict_ = copy.copy(self._dict)
         filter_keywords = keywords is not None and any(keywords)
 
         if without_meta_metadata:
             del dict_['__meta_metadata__']
+        else:
+            dict_['__meta_metadata__'] = self._dumps_meta_metadata(compact)
 
         # skip the dict iteration
         if not any([clean, filter_keywords, filter_hidden,
@@ -604,6 +946,8 @@ class SmartJson(SmartDict):
 
         if without_meta_metadata:
             del dict_['__meta_metadata__']
+        else:
+            dict_['__meta_metadata__'] = self._dumps_meta_metadata()
         if not with_calculated_fields:
             for key in self.keys():
                 if self.meta_metadata[key]['type'] == 'calculated':
@@ -647,9 +991,8 @@ class SmartJson(SmartDict):
         if validator is None:
             from .validator import Validator as validator
         schema = dict()
-        model_fields = ModelParser.resolve_models(
-            self.model_info.names,
-            self.additional_info.namespace).get('fields', {})
+        model_fields = dict(self.metadata.model_parser.resolve_models(
+            self.model_info.names).get('fields', {}))
         for field in self.keys():
             if not field == '__meta_metadata__' and \
                     field not in model_fields and \
@@ -657,8 +1000,8 @@ class SmartJson(SmartDict):
                 model_fields[field] = self.meta_metadata[field]['json_id']
         for json_id in model_fields.keys():
             try:
-                schema.update(self.metadata.field_definitions[json_id].get(
-                    'schema', {}))
+                schema.update(self.metadata.field_parser.field_definitions()[
+                    json_id].get('schema', {}))
             except (TypeError, KeyError):
                 pass
         _validator = validator(schema=schema)
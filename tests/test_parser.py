@@ -30,6 +30,7 @@ from unittest import TestCase
 from jsonalchemy.parser import (
     ModelParser, guess_legacy_field_names, get_producer_rules
 )
+from jsonalchemy.reader import translate
 from jsonalchemy.registry import MetaData
 
 sys.path.append(dirname(realpath(__file__)))
@@ -187,6 +188,47 @@ class TestParser(TestCase):
                 ['test_base', 'test_model'])['fields'],
             test_model['fields'])
 
+    def test_resolved_models_cache(self):
+        """JSONAlchemy - resolved models are cached and read-only"""
+        model = self.model_parser.resolve_models(['test_base', 'test_model'])
+        self.assertTrue(model is self.model_parser.resolve_models(
+            ('test_base', 'test_model')))
+        self.assertRaises(TypeError, model.__setitem__, 'fields', {})
+        self.assertRaises(TypeError, model['fields'].update, {'foo': 'bar'})
+        self.assertRaises(TypeError, model['fields'].pop, 'title_title')
+
+        field_names = self.model_parser.resolve_field_names(
+            ['test_base', 'test_model'])
+        self.assertEquals(field_names['title'], 'title_title')
+        self.assertEquals(len(field_names), len(model['fields']))
+
+        self.model_parser.reparse()
+        self.assertFalse(model is self.model_parser.resolve_models(
+            ['test_base', 'test_model']))
+
+    def test_expression_function(self):
+        """JSONAlchemy - expressions compiled into functions"""
+        import warnings
+
+        function = self.field_parser.expression_function(
+            "dict((key, to_int(value[key])) for key in value)")
+        self.assertTrue(function is self.field_parser.expression_function(
+            "dict((key, to_int(value[key])) for key in value)"))
+        self.assertEquals(function({'a': '1', 'b': None}), {'a': 1, 'b': None})
+
+        function = self.field_parser.expression_function(
+            "datetime.date(2015, 1, len(self))", ('self', ))
+        self.assertEquals(function([1, 2]).day, 2)
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            function = self.field_parser.expression_function(
+                "value or not_a_function(value)", ('value', ))
+        self.assertEquals(len(caught), 1)
+        self.assertTrue('not_a_function' in str(caught[0].message))
+        self.assertEquals(function('a'), 'a')
+        self.assertRaises(NameError, function, '')
+
     def test_field_name_model_based(self):
         """JSONAlchemy - field name model based"""
         field_model_def = self.model_parser.field_definition_model_based(
@@ -218,3 +260,381 @@ class TestParser(TestCase):
         self.assertRaises(
             KeyError,
             lambda: get_producer_rules('foo', 'json_for_marc', self.metadata))
+
+    def test_definitions_cache(self):
+        """JSONAlchemy - field and model definitions cache"""
+        import os
+        import shutil
+        cache_dir = tempfile.mkdtemp()
+        try:
+            metadata = MetaData(['jsonalchemy.jsonext', 'testext'],
+                                cache_dir=cache_dir)
+            model_parser = ModelParser(metadata)
+            model_definitions = model_parser.model_definitions
+            field_definitions = model_parser.field_parser.field_definitions()
+            self.assertEquals(len(os.listdir(cache_dir)), 2)
+
+            # Warm start, nothing gets parsed
+            import jsonalchemy.parser
+            create_field_parser = jsonalchemy.parser._create_field_parser
+            create_model_parser = jsonalchemy.parser._create_model_parser
+
+            def fail(metadata):
+                raise AssertionError("Configuration parsed again")
+            jsonalchemy.parser._create_field_parser = fail
+            jsonalchemy.parser._create_model_parser = fail
+            try:
+                metadata = MetaData(['jsonalchemy.jsonext', 'testext'],
+                                    cache_dir=cache_dir)
+                model_parser = ModelParser(metadata)
+                cached_field_definitions = \
+                    model_parser.field_parser.field_definitions()
+                self.assertEquals(model_parser.model_definitions,
+                                  model_definitions)
+                self.assertEquals(sorted(cached_field_definitions.keys()),
+                                  sorted(field_definitions.keys()))
+            finally:
+                jsonalchemy.parser._create_field_parser = create_field_parser
+                jsonalchemy.parser._create_model_parser = create_model_parser
+
+            value = {'a': 'a', 'b': 'b', 'k': 'k'}  # noqa
+            self.assertEquals(
+                eval(cached_field_definitions['title']['rules']['marc'][1][
+                    'function']),
+                {'form': 'k', 'subtitle': 'b', 'title': 'a'})
+            self.assertEquals(
+                cached_field_definitions['version_history']['schema'][
+                    'version_history']['default'](), [])
+            self.assertEquals(
+                guess_legacy_field_names('245', 'marc', metadata),
+                {'245': ['title']})
+
+            # Stale cache, the new file must be taken into account
+            tmp_file = tempfile.NamedTemporaryFile(suffix='.cfg')
+            tmp_file.write('''
+cached_field:
+    derived:
+        1
+''')
+            tmp_file.flush()
+            metadata = MetaData(['jsonalchemy.jsonext', 'testext'],
+                                cache_dir=cache_dir)
+            metadata.fields.append(tmp_file.name)
+            model_parser = ModelParser(metadata)
+            self.assertTrue(
+                'cached_field' in model_parser.field_parser.field_definitions())
+            tmp_file.close()
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_incremental_reparse(self):
+        """JSONAlchemy - reparse only the changed files"""
+        import os
+        import shutil
+        tmp_dir = tempfile.mkdtemp()
+
+        def write(name, content):
+            with open(os.path.join(tmp_dir, name), 'w') as f:
+                f.write(content)
+            return os.path.join(tmp_dir, name)
+
+        try:
+            file_a = write('inc_a.cfg', '''
+inc_a:
+    derived:
+        1
+''')
+            file_b = write('inc_b.cfg', '''
+inc_b:
+    derived:
+        @connect('inc_a')
+        2
+
+@extend
+inc_a:
+    producer:
+        json_for_marc(), {'999__a': ''}
+''')
+            model_file = write('inc_model.cfg', '''
+bases:
+    test_base
+
+fields:
+    inc_a
+''')
+            self.metadata.fields.extend([file_a, file_b])
+            self.metadata.models.append(model_file)
+
+            field_definitions = self.field_parser.field_definitions()
+            model_definitions = self.model_parser.model_definitions
+            self.assertEquals(
+                model_definitions['inc_model']['fields']['inc_a'], 'inc_a')
+            title = field_definitions['title']
+            self.assertEquals(self.model_parser.reparse(), set())
+
+            write('inc_a.cfg', '''
+inc_a:
+    calculated:
+        3
+''')
+            self.assertEquals(self.model_parser.reparse(),
+                              set(['inc_model']))
+            self.assertTrue(field_definitions['title'] is title)
+            inc_a = field_definitions['inc_a']
+            self.assertTrue('calculated' in inc_a['rules'])
+            self.assertTrue('derived' not in inc_a['rules'])
+            self.assertTrue('producer' in inc_a)
+            self.assertEquals(
+                inc_a['rules']['calculated'][0]['decorators']['after'][
+                    'connect'],
+                [{'connected_field': 'inc_b', 'update_function': None}])
+            self.assertEquals(
+                len(field_definitions['inc_b']['rules']['derived'][0][
+                    'decorators']['after']['connect']), 1)
+
+            # The plans use the new rules after reparsing the fields only
+            for value in (4, 5):
+                write('inc_a.cfg', '''
+inc_a:
+    derived:
+        %d
+''' % (value, ))
+                self.field_parser.reparse()
+                self.assertEquals(translate(
+                    {}, master_format='json',
+                    metadata=self.metadata)['inc_a'], value)
+
+            # Same result as parsing everything from scratch
+            model_parser = ModelParser(self.metadata)
+            self.assertEquals(
+                sorted(model_parser.field_parser.field_definitions().keys()),
+                sorted(field_definitions.keys()))
+            self.assertEquals(model_parser.model_definitions,
+                              self.model_parser.model_definitions)
+
+            self.metadata.fields.remove(file_b)
+            field_parser = model_parser.field_parser
+            self.assertEquals(field_parser.reparse(), set(['inc_a', 'inc_b']))
+            self.assertTrue('inc_b' not in field_parser.field_definitions())
+            self.assertTrue(
+                'producer' not in field_parser.field_definitions()['inc_a'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_parallel_parsing(self):
+        """JSONAlchemy - parse field files using several processes"""
+        from jsonalchemy.errors import FieldParserException
+        from jsonalchemy.parser import FieldParser
+        metadata = MetaData(['jsonalchemy.jsonext', 'testext'],
+                            parse_processes=2)
+        field_definitions = FieldParser(metadata).field_definitions()
+        expected = self.field_parser.field_definitions()
+        self.assertEquals(sorted(field_definitions.keys()),
+                          sorted(expected.keys()))
+        for json_id, definition in expected.items():
+            self.assertEquals(
+                sorted(field_definitions[json_id].keys()),
+                sorted(definition.keys()))
+            self.assertEquals(field_definitions[json_id]['aliases'],
+                              definition['aliases'])
+            self.assertEquals(field_definitions[json_id].get('producer'),
+                              definition.get('producer'))
+        value = {'a': 'a', 'b': 'b', 'k': 'k'}  # noqa
+        self.assertEquals(
+            eval(field_definitions['title']['rules']['marc'][1]['function']),
+            {'form': 'k', 'subtitle': 'b', 'title': 'a'})
+        self.assertEquals(
+            field_definitions['authors']['rules']['derived'][0][
+                'decorators']['after']['connect'],
+            expected['authors']['rules']['derived'][0][
+                'decorators']['after']['connect'])
+        self.assertEquals(
+            guess_legacy_field_names('245', 'marc', metadata),
+            {'245': ['title']})
+
+        tmp_file = tempfile.NamedTemporaryFile()
+        tmp_file.write('''
+foo:
+    creator:
+bar, '1', foo()
+''')
+        tmp_file.flush()
+        metadata.fields.append(tmp_file.name)
+        self.assertRaises(FieldParserException, FieldParser(metadata).reparse)
+        tmp_file.close()
+
+    def test_fast_parser_conformance(self):
+        """JSONAlchemy - fast and pyparsing field parsers give same result"""
+        import types
+        from jsonalchemy.fast_parser import FastFieldParser
+        from jsonalchemy.parser import FieldParser
+
+        def normalize(value):
+            # Lambdas from schema or json sections are different objects
+            if isinstance(value, dict):
+                return dict((k, normalize(v)) for k, v in value.items())
+            if isinstance(value, (list, tuple)):
+                return type(value)(normalize(v) for v in value)
+            if isinstance(value, types.FunctionType):
+                return value.__code__
+            return value
+
+        def parse(metadata):
+            field_parser = FieldParser(metadata)
+            return (normalize(field_parser.field_definitions()),
+                    metadata.legacy_field_matchings())
+
+        fast_metadata = MetaData(['jsonalchemy.jsonext', 'testext'],
+                                 parser_backend='fast')
+        pyparsing_metadata = MetaData(['jsonalchemy.jsonext', 'testext'],
+                                      parser_backend='pyparsing')
+        self.assertTrue(any('testext' in f for f in fast_metadata.fields))
+        self.assertTrue(any('jsonext' in f for f in fast_metadata.fields))
+
+        # No file needs the pyparsing fallback
+        fast_parser = FastFieldParser(fast_metadata)
+        for field_file in fast_metadata.fields:
+            fast_parser.parse_file(field_file)
+
+        fast, pyparsing = parse(fast_metadata), parse(pyparsing_metadata)
+        self.assertEquals(sorted(fast[0].keys()), sorted(pyparsing[0].keys()))
+        for json_id, definition in pyparsing[0].items():
+            self.assertEquals(fast[0][json_id], definition, json_id)
+        self.assertEquals(fast[1], pyparsing[1])
+
+    def test_fast_parser_fallback(self):
+        """JSONAlchemy - fast parser falls back to pyparsing"""
+        from jsonalchemy.errors import FieldParserException
+        from jsonalchemy.fast_parser import FastFieldParser
+        from jsonalchemy.parser import FieldParser
+
+        # pyparsing doesn't mind the inconsistent indentation of 'schema'
+        tmp_file = tempfile.NamedTemporaryFile(suffix='.cfg')
+        tmp_file.write('''
+fallback:
+    creator:
+        @legacy(("100__z", ""), )
+        marc, "100__", value['a']
+  schema:
+        {'fallback': {'type': 'string'}}
+''')
+        tmp_file.flush()
+
+        metadata = MetaData(['jsonalchemy.jsonext', 'testext'])
+        metadata.fields.append(tmp_file.name)
+        self.assertRaises(FieldParserException,
+                          FastFieldParser(metadata).parse_file,
+                          tmp_file.name)
+
+        definition = FieldParser(metadata).field_definitions()['fallback']
+        self.assertEquals(definition['schema'],
+                          {'fallback': {'type': 'string'}})
+        value = {'a': 'John'}  # noqa
+        self.assertEquals(eval(definition['rules']['marc'][0]['function']),
+                          'John')
+        self.assertEquals(guess_legacy_field_names('100__z', 'marc',
+                                                   metadata),
+                          {'100__z': ['fallback']})
+        tmp_file.close()
+
+    def test_parse_lines_default(self):
+        """JSONAlchemy - default parse_lines uses the pyparsing element"""
+        from jsonalchemy.parser import BaseExtensionParser
+        parsers = self.metadata.parsers
+        samples = [
+            ('connect', ["@connect('title', sync_title )"]),
+            ('depends_on', ["@depends_on('title', 'authors')"]),
+            ('memoize', ['@memoize(300)']),
+            ('only_if', ["@only_if('BOOK' in self['collection'])"]),
+            ('description', ['description:', '"""Title"""']),
+            ('json_ext', ['json:', 'loads, int', 'dumps, str']),
+            ('producer', ['producer:', "json_for_marc(), {'245__a': ''}"]),
+            ('schema', ['schema:', "{'title': {'type': 'string'}}"]),
+        ]
+        for name, lines in samples:
+            fast = parsers[name].parse_lines(lines)
+            default = BaseExtensionParser.parse_lines(parsers[name], lines)
+            if hasattr(default, 'asList'):
+                self.assertEquals(fast.asList(), default.asList())
+            else:
+                self.assertEquals(fast, default)
+            self.assertEquals(parsers[name].parse_lines(['foo:', 'bar']),
+                              None)
+
+    def test_execution_plan(self):
+        """JSONAlchemy - execution plan order and caching"""
+        plan = self.model_parser.create_execution_plan(
+            {'dummy': 'dummy', 'number_of_authors': 'number_of_authors',
+             'authors': 'authors', 'foo': 'bar'}, 'marc')
+        json_ids = [json_id for json_id, _, _ in plan.steps]
+        self.assertTrue(json_ids.index('authors') <
+                        json_ids.index('number_of_authors') <
+                        json_ids.index('dummy'))
+        self.assertEquals(plan.steps[json_ids.index('foo')],
+                          ('foo', 'bar', None))
+        number_of_authors = plan.steps[json_ids.index('number_of_authors')][2]
+        self.assertEquals(number_of_authors.creator, ())
+        self.assertEquals(len(number_of_authors.derived), 1)
+
+        plan = self.model_parser.execution_plan(['test_model'], 'marc')
+        self.assertTrue(plan is
+                        self.model_parser.execution_plan('test_model', 'marc'))
+        self.assertEquals(plan.master_format, 'marc')
+        self.model_parser.reparse()
+        self.assertFalse(plan is
+                         self.model_parser.execution_plan('test_model', 'marc'))
+
+    def test_execution_plan_cycle(self):
+        """JSONAlchemy - cycle of depends_on in the execution plan"""
+        from jsonalchemy.errors import ModelParserException
+
+        tmp_file = tempfile.NamedTemporaryFile(suffix='.cfg')
+        tmp_file.write('''
+cycle_a:
+    derived:
+        @depends_on('cycle_b')
+        1
+
+cycle_b:
+    derived:
+        @depends_on('cycle_a')
+        2
+''')
+        tmp_file.flush()
+
+        metadata = MetaData(['jsonalchemy.jsonext', 'testext'])
+        metadata.fields.append(tmp_file.name)
+        model_parser = ModelParser(metadata)
+        with self.assertRaises(ModelParserException) as context:
+            model_parser.create_execution_plan(
+                {'cycle_a': 'cycle_a', 'cycle_b': 'cycle_b'}, 'json')
+        self.assertTrue('cycle_a -> cycle_b -> cycle_a'
+                        in str(context.exception))
+
+        # Reported as soon as the definitions are loaded
+        for dummy in range(2):
+            self.assertRaises(ModelParserException, getattr,
+                              model_parser, 'model_definitions')
+        tmp_file.close()
+
+    def test_source_tag_index(self):
+        """JSONAlchemy - index of the source tags of a master format"""
+        from jsonalchemy.plan import SourceTagIndex
+
+        index = SourceTagIndex(['100__', '245', '245_.', '8564_', '(', '100'])
+        self.assertTrue('245_.' in index)
+        self.assertFalse('(' in index)
+        self.assertEquals(index.match('100__'), ('100', '100__'))
+        self.assertEquals(index.match('2452_'), ('245', ))
+        self.assertEquals(index.match('245_2'), ('245', '245_.'))
+        self.assertEquals(index.match('700__'), ())
+        self.assertEquals(
+            index.lookup(['245__', '700__', '2451_', '100__']),
+            {'245': ['245__', '2451_'], '245_.': ['245__'],
+             '100': ['100__'], '100__': ['100__']})
+
+        metadata = MetaData(['jsonalchemy.jsonext', 'testext'])
+        index = metadata.field_parser.source_tag_index('marc')
+        self.assertTrue('100__' in index)
+        self.assertTrue('245..' in index)
+        self.assertTrue(index is metadata.field_parser.source_tag_index('marc'))
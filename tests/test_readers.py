@@ -19,6 +19,8 @@
 
 """Unit tests for the parser engine."""
 
+import mmap
+import six
 import sys
 import tempfile
 import testext
@@ -31,13 +33,48 @@ from jsonalchemy.errors import ReaderException
 from jsonalchemy.parser import (
     ModelParser, guess_legacy_field_names, get_producer_rules
 )
-from jsonalchemy.reader import Reader, split_blob, translate
+from jsonalchemy.reader import Reader, split_blob, translate, \
+    translate_many, translate_parallel
 from jsonalchemy.registry import MetaData
 from jsonalchemy.wrappers import SmartJson
 
 sys.path.append(dirname(realpath(__file__)))
 
 
+def marcxml_to_iso2709(marcxml):
+    """Write the ``<record>`` of ``marcxml`` as binary MARC21."""
+    from lxml import etree
+    directory, data = b'', b''
+    for element in etree.fromstring(marcxml).iter('{*}controlfield',
+                                                  '{*}datafield'):
+        if element.tag.endswith('controlfield'):
+            field = (element.text or u'').encode('utf-8')
+        else:
+            field = ((element.get('ind1') or ' ') +
+                     (element.get('ind2') or ' ')).encode('utf-8')
+            for subfield in element.iter('{*}subfield'):
+                field += b'\x1f' + (subfield.get('code') +
+                                    (subfield.text or u'')).encode('utf-8')
+        field += b'\x1e'
+        directory += ('%s%04d%05d' % (element.get('tag'), len(field),
+                                      len(data))).encode('ascii')
+        data += field
+    base_address = 24 + len(directory) + 1
+    leader = '%05dnam a22%05d   4500' % (base_address + len(data) + 1,
+                                         base_address)
+    return leader.encode('ascii') + directory + b'\x1e' + data + b'\x1d'
+
+
+class UnpicklableJson(SmartJson):
+
+    """Json whose output can't be sent back by the pool of processes."""
+
+    def dumps(self, *args, **kwargs):
+        dump = super(UnpicklableJson, self).dumps(*args, **kwargs)
+        dump['unpicklable'] = lambda: None
+        return dump
+
+
 class TestReader(TestCase):
 
     def setUp(self):
@@ -54,6 +91,134 @@ class TestReader(TestCase):
             ReaderException, translate, blob={}, json_class=dict,
             metadata=self.metadata)
 
+    def test_shared_parsers(self):
+        """JSONAlchemy - readers share the parsers of the metadata"""
+        import threading
+
+        self.assertTrue(self.metadata.model_parser is self.model_parser)
+        self.assertTrue(self.metadata.field_parser is self.field_parser)
+        first = translate({'title': 'A'}, SmartJson, master_format='json',
+                          metadata=self.metadata)
+        second = translate({'title': 'B'}, SmartJson, master_format='json',
+                           metadata=self.metadata)
+        self.assertTrue(first.reader.model_parser is self.model_parser)
+        self.assertTrue(second.reader.field_parser is self.field_parser)
+
+        metadata = MetaData(['jsonalchemy.jsonext', 'testext'])
+        parsers = []
+
+        def get_model_definitions():
+            model_parser = metadata.model_parser
+            parsers.append((model_parser, model_parser.model_definitions))
+
+        threads = [threading.Thread(target=get_model_definitions)
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(len(parsers), 8)
+        for model_parser, model_definitions in parsers:
+            self.assertTrue(model_parser is metadata.model_parser)
+            self.assertTrue(model_definitions is
+                            metadata.model_parser.model_definitions)
+            self.assertTrue(model_parser.field_parser is
+                            metadata.field_parser)
+
+    def test_field_metadata_templates(self):
+        """JSONAlchemy - meta-metadata created once, one timestamp per record"""
+        first = translate({'title': {'title': 'A'}}, SmartJson,
+                          master_format='json', metadata=self.metadata)
+        second = translate({'title': {'title': 'B'}}, SmartJson,
+                           master_format='json', metadata=self.metadata)
+
+        infos = dict((key, value) for key, value in
+                     six.iteritems(first['__meta_metadata__'])
+                     if not key.startswith('__'))
+        self.assertTrue('title' in infos)
+        self.assertEquals(
+            len(set(info['timestamp'] for info in infos.values())), 1)
+
+        first_info = first['__meta_metadata__']['title']
+        second_info = second['__meta_metadata__']['title']
+        self.assertFalse(first_info is second_info)
+        self.assertEquals(dict(first_info, timestamp=None),
+                          dict(second_info, timestamp=None))
+        self.assertTrue(first_info['after'] is second_info['after'])
+        self.assertTrue(self.field_parser.info_templates)
+
+    def test_translate_many(self):
+        """JSONAlchemy - translate many records"""
+        marc_record = """
+            <record>
+                <controlfield tag="001">%(recid)d</controlfield>
+                <datafield tag="100" ind1=" " ind2=" ">
+                <subfield code="a">Author, %(recid)d</subfield>
+                <subfield code="u">CERN</subfield>
+                </datafield>
+                <datafield tag="245" ind1=" " ind2=" ">
+                <subfield code="a">Title %(recid)d</subfield>
+                </datafield>
+                <datafield tag="700" ind1=" " ind2=" ">
+                <subfield code="a">Other, %(recid)d</subfield>
+                </datafield>
+                <datafield tag="980" ind1=" " ind2=" ">
+                <subfield code="a">BOOK</subfield>
+                </datafield>
+            </record>"""
+        blobs = {
+            'json': [{'title': {'title': 'Title %d' % (recid, )},
+                      'authors': [{'full_name': 'Author, %d' % (recid, )}]}
+                     for recid in range(200)],
+            'marc': [marc_record % {'recid': recid}
+                     for recid in range(1, 51)],
+        }
+
+        def clean(json):
+            result = json.dumps(clean=True)
+            # Timestamps and random values
+            for key in ('creation_date', 'modification_date', 'hidden_basic',
+                        'uuid', 'recid'):
+                result.pop(key, None)
+            return result
+
+        for master_format in ('json', 'marc'):
+            single = [clean(translate(blob, SmartJson,
+                                      master_format=master_format,
+                                      metadata=self.metadata))
+                      for blob in blobs[master_format]]
+            batch = [clean(json) for json in translate_many(
+                blobs[master_format], SmartJson, master_format=master_format,
+                metadata=self.metadata)]
+            self.assertEquals(batch, single)
+
+        # The execution plan is looked up once for all the blobs
+        model_parser = self.metadata.model_parser
+        calls = []
+
+        def execution_plan(*args, **kwargs):
+            calls.append(args)
+            return type(model_parser).execution_plan(model_parser, *args,
+                                                     **kwargs)
+
+        model_parser.execution_plan = execution_plan
+        try:
+            for blob in blobs['marc'][:3]:
+                translate(blob, SmartJson, master_format='marc',
+                          metadata=self.metadata)
+            self.assertEquals(len(calls), 3)
+            del calls[:]
+            jsons = list(translate_many(
+                blobs['marc'], SmartJson, master_format='marc',
+                metadata=self.metadata))
+        finally:
+            del model_parser.execution_plan
+        self.assertEquals(len(jsons), 50)
+        self.assertEquals(len(calls), 1)
+
+        self.assertRaises(ReaderException, list, translate_many(
+            [{'title': 'A'}, None], metadata=self.metadata))
+
 
 class TestJSONReader(TestCase):
 
@@ -83,6 +248,62 @@ class TestJSONReader(TestCase):
         self.assertEquals(json['default_values_test'],
                           {'field2': False, 'field3': False, 'field1': False})
 
+    def test_split_blob_ndjson(self):
+        """JSONAlchemy - split and decode newline delimited JSON"""
+        import json as json_module
+
+        blobs = [{'title': {'title': u'T\xeftle %d' % (recid, )},
+                  'authors': [{'full_name': 'Author, %d' % (recid, )}]}
+                 for recid in range(1, 21)]
+        text = u'\n'.join(json_module.dumps(blob) for blob in blobs)
+        text = text.replace(u'\n', u'\n\n', 1) + u'\n'
+        binary = text.encode('utf-8')
+
+        for source in (text, binary, six.StringIO(text),
+                       six.BytesIO(binary)):
+            self.assertEquals(list(split_blob(source, 'json',
+                                              metadata=self.metadata,
+                                              buffer_size=7)), blobs)
+        # The last line doesn't need to end with a new line
+        self.assertEquals(list(split_blob(binary.strip(), 'json',
+                                          metadata=self.metadata)), blobs)
+
+        decoded = []
+
+        def decoder(line):
+            decoded.append(line)
+            return json_module.loads(line)
+
+        records = split_blob(six.BytesIO(binary), 'json',
+                             metadata=self.metadata, decoder=decoder)
+        next(records)
+        self.assertEquals(len(decoded), 1)
+        self.assertEquals(len(list(records)), 19)
+        self.assertEquals(list(split_blob(binary, 'json',
+                                          metadata=self.metadata,
+                                          decoder='json')), blobs)
+
+        def clean(json):
+            result = json.dumps(clean=True)
+            for key in ('creation_date', 'modification_date', 'hidden_basic',
+                        'uuid', 'recid'):
+                result.pop(key, None)
+            return result
+
+        self.assertEquals(
+            [clean(json) for json in translate_many(
+                split_blob(six.BytesIO(binary), 'json',
+                           metadata=self.metadata),
+                SmartJson, master_format='json', metadata=self.metadata)],
+            [clean(json) for json in translate_many(
+                blobs, SmartJson, master_format='json',
+                metadata=self.metadata)])
+
+        self.assertRaises(ReaderException, list, split_blob(
+            text, 'json', metadata=self.metadata, decoder='no_such_codec'))
+        self.assertRaises(ReaderException, list, split_blob(
+            u'{"title": 1}\n{"title": ', 'json', metadata=self.metadata))
+
     def test_json_reader_add_and_set_fields(self):
         """JSONAlchemy - add and set fields"""
         blob = {'abstract': {'summary': 'Candidate for the associated production of the Higgs boson and Z boson. Both, the Higgs and Z boson decay into 2 jets each. The green and the yellow jets belong to the Higgs boson. They represent the fragmentation of a bottom andanti-bottom quark. The red and the blue jets stem from the decay of the Z boson into a quark anti-quark pair. Left: View of the event along the beam axis. Bottom right: Zoom around the interaction point at the centre showing detailsof the fragmentation of the bottom and anti-bottom quarks. As expected for b quarks, in each jet the decay of a long-lived B meson is visible. Top right: "World map" showing the spatial distribution of the jets in the event.'},
@@ -924,6 +1145,197 @@ class TestMarcReader(TestCase):
         self.assertTrue('foo' in json['title'])
         self.assertEquals(json['title.foo'], 'bar')
 
+    def test_concurrent_translate(self):
+        """JSONAlchemy - translate records from several threads"""
+        import threading
+
+        record = """
+            <record>
+                <controlfield tag="001">%(recid)d</controlfield>
+                <datafield tag="100" ind1=" " ind2=" ">
+                <subfield code="a">Author, %(recid)d</subfield>
+                </datafield>
+                %(additional_authors)s
+                <datafield tag="245" ind1=" " ind2=" ">
+                <subfield code="a">Title %(recid)d</subfield>
+                </datafield>
+                <datafield tag="980" ind1=" " ind2=" ">
+                <subfield code="a">%(collection)s</subfield>
+                </datafield>
+            </record>"""
+        blobs = [record % {
+            'recid': recid,
+            'additional_authors': ''.join(
+                '<datafield tag="700" ind1=" " ind2=" ">'
+                '<subfield code="a">Other, %d</subfield></datafield>' % (i, )
+                for i in range(recid % 4)),
+            'collection': ('BOOK', 'ARTICLE')[recid % 2]}
+            for recid in range(1, 41)]
+
+        def translate_blob(blob):
+            json = translate(blob, SmartJson, master_format='marc',
+                             metadata=self.metadata)
+            result = json.dumps(clean=True)
+            # Timestamps and random values
+            for key in ('creation_date', 'modification_date', 'hidden_basic'):
+                result.pop(key, None)
+            return result, json.errors
+
+        expected = [translate_blob(blob) for blob in blobs]
+        self.assertEquals(expected[4][0]['title']['title'], 'Title 5')
+
+        results = {}
+        failures = []
+
+        def worker(offset):
+            try:
+                for index in range(offset, len(blobs)):
+                    results.setdefault(index, []).append(
+                        translate_blob(blobs[index]))
+            except Exception as e:
+                failures.append(e)
+
+        threads = [threading.Thread(target=worker, args=(offset, ))
+                   for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(failures, [])
+        for index, result in enumerate(expected):
+            self.assertEquals(len(results[index]), min(index + 1, 8))
+            for concurrent_result in results[index]:
+                self.assertEquals(concurrent_result, result)
+
+    def test_translate_parallel(self):
+        """JSONAlchemy - translate records using a pool of processes"""
+        record = """
+            <record>
+                <controlfield tag="001">%(recid)d</controlfield>
+                <datafield tag="100" ind1=" " ind2=" ">
+                <subfield code="a">Author, %(recid)d</subfield>
+                </datafield>
+                <datafield tag="245" ind1=" " ind2=" ">
+                <subfield code="a">Title %(recid)d</subfield>
+                </datafield>
+                <datafield tag="980" ind1=" " ind2=" ">
+                <subfield code="a">%(collection)s</subfield>
+                </datafield>
+            </record>"""
+        collection = '<collection>%s</collection>' % ''.join(
+            record % {'recid': recid,
+                      'collection': ('BOOK', 'ARTICLE')[recid % 2]}
+            for recid in range(1, 61))
+
+        def summary(payload):
+            return (payload['recid'], payload['title'], payload['authors'],
+                    payload['collection'])
+
+        expected = [summary(json.dumps()) for json in translate_many(
+            split_blob(collection, 'marc', metadata=self.metadata),
+            SmartJson, master_format='marc', metadata=self.metadata)]
+        self.assertEquals(len(expected), 60)
+        self.assertEquals(expected[41][0], 42)
+
+        # The file is read in small pieces, cutting the records
+        self.assertEquals(
+            list(split_blob(six.StringIO(collection), 'marc',
+                            metadata=self.metadata, buffer_size=100)),
+            list(split_blob(collection, 'marc', metadata=self.metadata)))
+
+        results = list(translate_parallel(
+            six.StringIO(collection), 'marc', workers=2, chunk_size=7,
+            json_class=SmartJson, metadata=self.metadata, max_chunks=3))
+        self.assertEquals([error for dummy, error in results], [None] * 60)
+        self.assertEquals([summary(payload) for payload, dummy in results],
+                          expected)
+
+        results = translate_parallel(
+            collection, 'marc', workers=2, chunk_size=5,
+            metadata=self.metadata, ordered=False)
+        self.assertEquals(
+            sorted(summary(payload) for payload, dummy in results),
+            expected)
+
+        # Options of the reader to split the blob
+        for split_kwargs in ({'buffer_size': 100}, {'parsed': True}):
+            results = translate_parallel(
+                six.StringIO(collection), 'marc', workers=2, chunk_size=7,
+                metadata=self.metadata, split_kwargs=split_kwargs)
+            self.assertEquals(
+                [summary(payload) for payload, dummy in results], expected)
+        blob = b''.join(marcxml_to_iso2709(record % {
+            'recid': recid, 'collection': ('BOOK', 'ARTICLE')[recid % 2]})
+            for recid in range(1, 61))
+        results = translate_parallel(
+            six.BytesIO(blob), 'marc', workers=2, chunk_size=7,
+            metadata=self.metadata, split_kwargs={'schema': 'iso2709'})
+        self.assertEquals(
+            [summary(payload) for payload, dummy in results], expected)
+
+        # The pool fails to send the results back
+        from multiprocessing.pool import MaybeEncodingError
+        for ordered in (True, False):
+            self.assertRaises(MaybeEncodingError, list, translate_parallel(
+                collection, 'marc', workers=2, chunk_size=5,
+                json_class=UnpicklableJson, metadata=self.metadata,
+                ordered=ordered))
+
+    def test_split_blob_parsed(self):
+        """JSONAlchemy - translate the records parsed from a MARCXML file"""
+        record = """
+            <record>
+                <controlfield tag="001">%(recid)d</controlfield>
+                <datafield tag="100" ind1=" " ind2=" ">
+                <subfield code="a">Author, %(recid)d</subfield>
+                </datafield>
+                <datafield tag="245" ind1=" " ind2=" ">
+                <subfield code="a">Title %(recid)d</subfield>
+                </datafield>
+                <datafield tag="700" ind1=" " ind2=" ">
+                <subfield code="a">Other, %(recid)d</subfield>
+                </datafield>
+                <datafield tag="700" ind1=" " ind2=" ">
+                <subfield code="a">Another, %(recid)d</subfield>
+                </datafield>
+            </record>"""
+        collection = '<collection xmlns="http://www.loc.gov/MARC21/slim">' \
+            '%s</collection>' % ''.join(record % {'recid': recid}
+                                        for recid in range(1, 21))
+
+        def clean(json):
+            result = json.dumps(clean=True)
+            for key in ('creation_date', 'modification_date', 'hidden_basic'):
+                result.pop(key, None)
+            return result
+
+        expected = [clean(json) for json in translate_many(
+            split_blob(collection, 'marc', metadata=self.metadata),
+            SmartJson, master_format='marc', metadata=self.metadata)]
+        self.assertEquals(len(expected), 20)
+        self.assertEquals(expected[2]['authors'][2]['full_name'],
+                          'Another, 3')
+
+        records = split_blob(six.StringIO(collection), 'marc',
+                             metadata=self.metadata, parsed=True)
+        jsons = translate_many(records, SmartJson, master_format='marc',
+                               metadata=self.metadata)
+        self.assertEquals([clean(json) for json in jsons], expected)
+
+        # The records can be kept after reading the next ones
+        records = list(split_blob(collection, 'marc', metadata=self.metadata,
+                                  parsed=True))
+        self.assertEquals(records[0]['001'], ['1'])
+        jsons = translate_many(records, SmartJson, master_format='marc',
+                               metadata=self.metadata)
+        self.assertEquals([clean(json) for json in jsons], expected)
+        chunks = split_blob(collection, 'marc', slice_size=7,
+                            metadata=self.metadata, parsed=True)
+        jsons = [json for chunk in chunks for json in translate_many(
+            chunk, SmartJson, master_format='marc', metadata=self.metadata)]
+        self.assertEquals([clean(json) for json in jsons], expected)
+
     def test_translate_several_tag_different_indicator(self):
         """JSONAlchemy - translate several tag with different indicator."""
         blob = '''
@@ -960,6 +1372,362 @@ class TestMarcReader(TestCase):
         self.assertEquals(json['title']['title'], 'Title in 24522')
         self.assertEquals(json.meta_metadata.title['function'], ['24522', ])
 
+    def test_lazy_translate(self):
+        """JSONAlchemy - lazy translation, fields added when used"""
+        blob = """
+            <record>
+                <controlfield tag="001">5</controlfield>
+                <datafield tag="100" ind1=" " ind2=" ">
+                <subfield code="a">Ellis, J</subfield>
+                </datafield>
+                <datafield tag="245" ind1=" " ind2=" ">
+                <subfield code="a">Title</subfield>
+                </datafield>
+                <datafield tag="700" ind1=" " ind2=" ">
+                <subfield code="a">Smith, A</subfield>
+                </datafield>
+            </record>"""
+
+        def clean(json):
+            result = json.dumps(clean=True)
+            for key in ('creation_date', 'modification_date', 'hidden_basic'):
+                result.pop(key, None)
+            return result
+
+        eager = translate(blob, SmartJson, master_format='marc',
+                          metadata=self.metadata)
+        json = translate(blob, SmartJson, master_format='marc',
+                         metadata=self.metadata, lazy=True)
+        self.assertEquals(list(json._dict.keys()), ['__meta_metadata__'])
+
+        # The fields it depends on are pulled too
+        self.assertEquals(json['number_of_authors'], 2)
+        self.assertTrue('authors' in json._dict)
+        self.assertFalse('title' in json._dict)
+        # Aliases
+        self.assertEquals(json.get('creator'), eager.get('creator'))
+        self.assertTrue('title' in json)
+        self.assertEquals(json['title.title'], 'Title')
+        self.assertFalse('recid' in json._dict)
+
+        self.assertEquals(clean(json), clean(eager))
+        self.assertEquals(json.errors, eager.errors)
+        self.assertEquals(
+            len(set(info['timestamp'] for key, info in
+                    six.iteritems(json['__meta_metadata__'])
+                    if not key.startswith('__'))), 1)
+
+        # Every way of going through the fields adds them all
+        def content(items):
+            return dict((key, value) for key, value in items
+                        if not key.startswith('_') and key not in (
+                            'creation_date', 'modification_date',
+                            'hidden_basic'))
+
+        keys = sorted(eager.keys())
+        for accessor in ('keys', 'iterkeys', '__iter__', '__len__', 'items',
+                         'iteritems', 'values', 'itervalues'):
+            json = translate(blob, SmartJson, master_format='marc',
+                             metadata=self.metadata, lazy=True)
+            if accessor == '__len__':
+                self.assertEquals(len(json), len(keys))
+                continue
+            result = list(getattr(json, accessor)())
+            if accessor in ('items', 'iteritems'):
+                self.assertEquals(content(result), content(eager.items()))
+            elif accessor in ('values', 'itervalues'):
+                self.assertEquals(content(zip(json.keys(), result)),
+                                  content(eager.items()))
+            else:
+                self.assertEquals(sorted(result), keys)
+
+    def test_translate_fields(self):
+        """JSONAlchemy - translate only some fields and their dependencies"""
+        blob = """
+            <record>
+                <controlfield tag="001">5</controlfield>
+                <datafield tag="100" ind1=" " ind2=" ">
+                <subfield code="a">Ellis, J</subfield>
+                </datafield>
+                <datafield tag="245" ind1=" " ind2=" ">
+                <subfield code="a">Title</subfield>
+                </datafield>
+                <datafield tag="700" ind1=" " ind2=" ">
+                <subfield code="a">Smith, A</subfield>
+                </datafield>
+            </record>"""
+        eager = translate(blob, SmartJson, master_format='marc',
+                          metadata=self.metadata)
+
+        json = translate(blob, SmartJson, master_format='marc',
+                         metadata=self.metadata, fields=['title'])
+        self.assertEquals(sorted(json.keys()), ['__meta_metadata__', 'title'])
+        self.assertEquals(json['title'], eager['title'])
+
+        json = translate(blob, SmartJson, master_format='marc',
+                         metadata=self.metadata,
+                         fields=['number_of_authors', 'recid'])
+        self.assertEquals(
+            sorted(json.keys()),
+            ['__meta_metadata__', '_additional_authors', '_first_author',
+             '_id', 'authors', 'number_of_authors', 'recid', 'uuid'])
+        for key in json.keys(without_meta_metadata=True):
+            if key != 'uuid':
+                self.assertEquals(json[key], eager[key])
+
+        plan = self.model_parser.execution_plan(
+            '__default__', 'marc', ['number_of_authors', 'recid'])
+        self.assertTrue(plan is self.model_parser.execution_plan(
+            '__default__', 'marc', ('recid', 'number_of_authors')))
+        # recid is connected to _id, and _id to uuid
+        self.assertEquals(plan.projection, frozenset([
+            '_additional_authors', '_first_author', '_id', 'authors',
+            'number_of_authors', 'recid', 'uuid']))
+
+    def test_iso2709(self):
+        """JSONAlchemy - translate binary MARC21 records"""
+        from jsonalchemy.jsonext.readers.marc_reader import \
+            Iso2709RecTree, create_rec_tree, create_rec_tree_iso2709
+        from lxml import etree
+
+        record = """
+            <record>
+                <controlfield tag="001">%(recid)d</controlfield>
+                <datafield tag="100" ind1=" " ind2=" ">
+                <subfield code="a">Author, %(recid)d</subfield>
+                <subfield code="u">CERN</subfield>
+                </datafield>
+                <datafield tag="245" ind1="1" ind2="0">
+                <subfield code="a">T\xc3\xaftle %(recid)d</subfield>
+                </datafield>
+                <datafield tag="700" ind1=" " ind2=" ">
+                <subfield code="a">Other, %(recid)d</subfield>
+                </datafield>
+                <datafield tag="700" ind1=" " ind2=" ">
+                <subfield code="a">Another, %(recid)d</subfield>
+                </datafield>
+            </record>"""
+        records = [record % {'recid': recid} for recid in range(1, 6)]
+        blob = b'\n'.join(marcxml_to_iso2709(xml) for xml in records)
+
+        rec_tree = create_rec_tree_iso2709(marcxml_to_iso2709(records[0]))
+        self.assertTrue(isinstance(rec_tree, Iso2709RecTree))
+        self.assertEquals(sorted(rec_tree.keys()),
+                          ['001', '100__', '24510', '700__'])
+        # Only the used fields are decoded
+        self.assertEquals(rec_tree['700__'],
+                          [{'a': 'Other, 1'}, {'a': 'Another, 1'}])
+        self.assertEquals(sorted(rec_tree._pending), ['001', '100__', '24510'])
+        self.assertEquals(rec_tree, create_rec_tree(
+            etree.fromstring(records[0])))
+        self.assertEquals(rec_tree._pending, {})
+
+        def clean(json):
+            result = json.dumps(clean=True)
+            for key in ('creation_date', 'modification_date', 'hidden_basic'):
+                result.pop(key, None)
+            return result
+
+        expected = [clean(translate(xml, SmartJson, master_format='marc',
+                                    metadata=self.metadata))
+                    for xml in records]
+        self.assertEquals(expected[2]['title']['title'], 'T\xc3\xaftle 3')
+
+        for source in (blob, six.BytesIO(blob)):
+            jsons = translate_many(
+                split_blob(source, 'marc', schema='iso2709',
+                           metadata=self.metadata),
+                SmartJson, master_format='marc', metadata=self.metadata)
+            self.assertEquals([clean(json) for json in jsons], expected)
+
+        # Files are mapped in memory
+        with tempfile.TemporaryFile() as f:
+            f.write(blob)
+            f.flush()
+            f.seek(0)
+            jsons = translate_many(
+                split_blob(f, 'marc', schema='iso2709',
+                           metadata=self.metadata),
+                SmartJson, master_format='marc', metadata=self.metadata)
+            self.assertEquals([clean(json) for json in jsons], expected)
+
+        for source in (blob[:-10], six.BytesIO(blob[:-10]), b'x' + blob):
+            self.assertRaises(ReaderException, list, split_blob(
+                source, 'marc', schema='iso2709', metadata=self.metadata))
+
+        # The schema tells the strings apart, otherwise the leader does
+        iso2709 = marcxml_to_iso2709(records[0])
+        for schema in ('iso2709', None):
+            self.assertEquals(clean(translate(
+                iso2709, SmartJson, master_format='marc', schema=schema,
+                metadata=self.metadata)), expected[0])
+        json = translate(iso2709, SmartJson, master_format='marc',
+                         schema='xml', metadata=self.metadata)
+        self.assertEquals(json.reader.rec_tree, {})
+        self.assertFalse('recid' in json)
+
+        # The memory map is closed once the records are read
+        closed = []
+
+        class Mmap(mmap.mmap):
+
+            def close(self):
+                closed.append(self)
+                super(Mmap, self).close()
+
+        mmap_class, mmap.mmap = mmap.mmap, Mmap
+        try:
+            with tempfile.TemporaryFile() as f:
+                f.write(blob)
+                f.flush()
+                f.seek(0)
+                records = split_blob(f, 'marc', schema='iso2709',
+                                     metadata=self.metadata)
+                self.assertEquals(len([bytes(record) for record in records]),
+                                  5)
+                self.assertEquals(len(closed), 1)
+                f.seek(0)
+                records = split_blob(f, 'marc', schema='iso2709',
+                                     metadata=self.metadata)
+                next(records)
+                records.close()
+                self.assertEquals(len(closed), 2)
+        finally:
+            mmap.mmap = mmap_class
+
+    def test_create_record_dtd(self):
+        """JSONAlchemy - validate MARCXML with a DTD loaded once"""
+        import threading
+        import warnings
+        from jsonalchemy.jsonext.readers import marc_reader
+
+        dtd_file = tempfile.NamedTemporaryFile(suffix='.dtd')
+        dtd_file.write(b"""
+            <!ELEMENT collection (record*)>
+            <!ELEMENT record (leader?, controlfield*, datafield*)>
+            <!ELEMENT controlfield (#PCDATA)>
+            <!ATTLIST controlfield tag CDATA #REQUIRED>
+            <!ELEMENT datafield (subfield+)>
+            <!ATTLIST datafield tag CDATA #REQUIRED ind1 CDATA #REQUIRED
+                                ind2 CDATA #REQUIRED>
+            <!ELEMENT subfield (#PCDATA)>
+            <!ATTLIST subfield code CDATA #REQUIRED>""")
+        dtd_file.flush()
+        valid = """<record>
+            <controlfield tag="001">1</controlfield>
+            <datafield tag="100" ind1=" " ind2=" ">
+            <subfield code="a">Ellis, J</subfield>
+            </datafield>
+            </record>"""
+        invalid = """<record>
+            <datafield tag="100" ind1=" " ind2=" "><foo /></datafield>
+            </record>"""
+        expected = {'001': [([], ' ', ' ', '1', 1)],
+                    '100': [([('a', 'Ellis, J')], ' ', ' ', '', 2)]}
+
+        default_dtd = marc_reader.CFG_MARC21_DTD
+        marc_reader.CFG_MARC21_DTD = dtd_file.name
+        try:
+            self.assertEquals(marc_reader.create_record(valid), expected)
+            self.assertEquals(marc_reader.create_record(valid, correct=True),
+                              expected)
+            self.assertTrue(marc_reader.marc21_dtd() is
+                            marc_reader.marc21_dtd())
+            self.assertTrue(marc_reader.xml_parser() is
+                            marc_reader.xml_parser())
+            marc_reader.create_record(invalid)
+            self.assertRaises(ReaderException, marc_reader.create_record,
+                              invalid, correct=True)
+
+            # lxml objects are not shared between threads
+            objects = []
+            thread = threading.Thread(target=lambda: objects.extend([
+                marc_reader.marc21_dtd(), marc_reader.xml_parser()]))
+            thread.start()
+            thread.join()
+            self.assertFalse(objects[0] is marc_reader.marc21_dtd())
+            self.assertFalse(objects[1] is marc_reader.xml_parser())
+
+            marc_reader.CFG_MARC21_DTD = dtd_file.name + '.missing'
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                self.assertEquals(
+                    marc_reader.create_record(invalid, correct=True),
+                    marc_reader.create_record(invalid))
+                marc_reader.create_record(invalid, correct=True)
+            self.assertEquals(len(caught), 1)
+        finally:
+            marc_reader.CFG_MARC21_DTD = default_dtd
+
+    def test_only_if_master_value_source_tag(self):
+        """JSONAlchemy - matched tag in only_if_master_value, shared rule"""
+        tmp_file = tempfile.NamedTemporaryFile(suffix='.cfg')
+        tmp_file.write("""
+title_with_indicator:
+    creator:
+        @only_if_master_value(source_tag != '245__')
+        marc, "245..", value['a']
+""")
+        tmp_file.flush()
+        metadata = MetaData(['jsonalchemy.jsonext', 'testext'])
+        metadata.fields.append(tmp_file.name)
+
+        blob = '''
+            <record>
+            <datafield tag="%s" ind1="%s" ind2=" ">
+              <subfield code="a">Title</subfield>
+            </datafield>
+            </record>
+        '''
+        json = translate(blob % ('245', '1'), SmartJson, master_format='marc',
+                         metadata=metadata)
+        self.assertEquals(json['title_with_indicator'], 'Title')
+        self.assertEquals(
+            json.meta_metadata.title_with_indicator['function'], ['2451_'])
+        json = translate(blob % ('245', ' '), SmartJson, master_format='marc',
+                         metadata=metadata)
+        self.assertFalse('title_with_indicator' in json)
+
+        field_def = metadata.field_parser.field_definitions()[
+            'title_with_indicator']['rules']['marc'][0]
+        self.assertEquals(field_def['source_tags'], ['245..'])
+        tmp_file.close()
+
+    def test_on_decorator_without_source_tag(self):
+        """JSONAlchemy - on decorators not taking the source tag"""
+        tmp_file = tempfile.NamedTemporaryFile(suffix='.cfg')
+        tmp_file.write("""
+checked_title:
+    creator:
+        @only_if_master_value(value['a'] == 'Title')
+        marc, "245..", value['a']
+""")
+        tmp_file.flush()
+        metadata = MetaData(['jsonalchemy.jsonext', 'testext'])
+        metadata.fields.append(tmp_file.name)
+        only_if_master_value = \
+            metadata.decorator_on_extensions['only_if_master_value']
+        values = []
+
+        class OldOnlyIfMasterValue(only_if_master_value):
+
+            @classmethod
+            def evaluate(cls, value, metadata, args):
+                values.append(value['a'])
+                return True
+
+        metadata.decorator_on_extensions['only_if_master_value'] = \
+            OldOnlyIfMasterValue
+        json = translate('''
+            <record>
+            <datafield tag="245" ind1=" " ind2=" ">
+              <subfield code="a">Title</subfield>
+            </datafield>
+            </record>''', SmartJson, master_format='marc', metadata=metadata)
+        self.assertEquals(json['checked_title'], 'Title')
+        self.assertEquals(values, ['Title'])
+        tmp_file.close()
+
     def test_add_fields(self):
         """JSONAlchemy - add field"""
         from jsonalchemy.reader import Reader
@@ -1051,6 +1819,22 @@ class TestMarcReader(TestCase):
         self.assertEquals(
             json['title'], {'title': 'ALEPH experiment: Candidate of Higgs boson production'})
 
+    def test_add_json_ids(self):
+        """JSONAlchemy - add fields by json_id under their model names"""
+        json = SmartJson(master_format='marc', model=['test_model'],
+                         metadata=self.metadata)
+        reader = self.metadata.readers['marc'](
+            json, blob="""
+            <record>
+                <datafield tag="245" ind1=" " ind2=" ">
+                <subfield code="a">Title</subfield>
+                </datafield>
+            </record>""", metadata=self.metadata)
+        # 'title_title' is named 'title' in the model
+        reader.add(['title_title'])
+        self.assertEquals(sorted(json.keys()), ['__meta_metadata__', 'title'])
+        self.assertEquals(json['title.title'], 'Title')
+
     def test_update_json(self):
         """JSONAlchemy - set field"""
         blob = '''
@@ -1364,9 +2148,10 @@ class TestMarcReader(TestCase):
         json = translate(blob, SmartJson, master_format='marc',
                          metadata=self.metadata)
 
-        # To avoid duplicates we remove rules that overlap
-        del self.metadata.field_parser._field_definitions['title']['producer'][
-            'json_for_marc'][0]
+        # The overlapping rule removed above is still gone, the field
+        # definitions are shared by every translation using this metadata
+        self.assertEquals(self.metadata.field_parser.field_definitions()[
+            'title']['producer']['json_for_marc'], [])
 
         json_for_marc = json.produce('json_for_marc')
         for d in partial_result:
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of JSONAlchemy.
+# Copyright (C) 2015 CERN.
+#
+# JSONAlchemy is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# JSONAlchemy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JSONAlchemy; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the wrappers."""
+
+import copy
+import json as json_module
+import pickle
+import sys
+import tempfile
+
+from os.path import dirname, realpath
+from unittest import TestCase, skipIf
+
+from jsonalchemy.reader import FieldInfoTemplate, translate, translate_many
+from jsonalchemy.registry import MetaData
+from jsonalchemy.utils import FrozenList, LRUCache, OverlayDict, freeze
+from jsonalchemy.wrappers import DotableView, SmartDict, SmartJson
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+sys.path.append(dirname(realpath(__file__)))
+
+
+class TestSmartDict(TestCase):
+
+    def test_smart_keys(self):
+        """JSONAlchemy - smart keys parsed once"""
+        d = SmartDict()
+        d['foo'] = {'a': 'world', 'b': 'hello'}
+        d['a'] = [{'b': 1}, {'b': 2}, {'b': 3}]
+        d['c.d'] = {'e': [1, 2]}
+
+        for dummy in range(2):
+            self.assertEquals(d['a[0]'], {'b': 1})
+            self.assertEquals(d['a[n]'], {'b': 3})
+            self.assertEquals(d['a.b'], [1, 2, 3])
+            self.assertEquals(d['a[1:].b'], [2, 3])
+            self.assertEquals(d['a[:n]'], [{'b': 1}, {'b': 2}])
+            self.assertEquals(d['foo.b'], 'hello')
+            self.assertEquals(d['c.d.e[1]'], 2)
+            self.assertTrue('a[2].b' in d)
+            self.assertFalse('a[3].b' in d)
+            self.assertFalse('foo.c' in d)
+            self.assertEquals(d.get('foo.c', 'default'), 'default')
+            self.assertEquals(d.get('foo.a.c', 'default'), 'default')
+            self.assertRaises(ValueError, d.__getitem__, 'a[x]')
+
+        smart_key = SmartDict.smart_key('a[1:].b')
+        self.assertTrue(smart_key is SmartDict.smart_key('a[1:].b'))
+        self.assertEquals(smart_key.main_key, 'a')
+        self.assertEquals(smart_key.rest_of_key, '[1:].b')
+        self.assertEquals(smart_key.keys, ('a', '1:]', 'b'))
+        self.assertEquals(smart_key.steps,
+                          (('a', None), ('1:]', slice(1, None)), ('b', None)))
+
+        d.set('a[0].b', 5)
+        d.set('a[n].c', 6)
+        d.set('foo.b', '!', extend=True)
+        self.assertEquals(d['a'], [{'b': 5}, {'b': 2}, {'b': 3, 'c': 6}])
+        self.assertEquals(d['foo.b'], ['hello', '!'])
+
+    def test_extract(self):
+        """JSONAlchemy - extract several keys from many records"""
+        records = [
+            SmartDict({'title': {'title': 'A'},
+                       'authors': [{'full_name': 'Ellis, J', 'id': 1},
+                                   {'full_name': 'Smith, A'}]}),
+            SmartDict({'title': {'title': 'B'},
+                       'authors': [{'full_name': 'Efstathiou, G P'}]}),
+            SmartDict({'title': 'C'}),
+        ]
+        paths = ['title.title', 'authors.full_name', 'authors[0].full_name',
+                 'authors[1:].full_name', 'authors', 'authors[0].id']
+        columns = SmartDict.extract(iter(records), paths, default='-')
+        self.assertEquals(sorted(columns), sorted(paths))
+        for path in paths:
+            self.assertEquals(columns[path],
+                              [record.get(path, '-') for record in records])
+        self.assertEquals(columns['authors[0].id'], [1, '-', '-'])
+        self.assertEquals(SmartDict.extract([], paths)['authors'], [])
+
+        metadata = MetaData(['jsonalchemy.jsonext', 'testext'])
+        jsons = list(translate_many(
+            [{'title': {'title': 'Title %d' % (recid, )},
+              'authors': [{'full_name': 'Author, %d' % (recid, )},
+                          {'full_name': 'Other, %d' % (recid, )}]}
+             for recid in range(1, 4)],
+            SmartJson, master_format='json', metadata=metadata))
+        # The aliases of SmartJson are used
+        paths = ['title.title', 'creator.full_name', 'authors.full_name',
+                 'number_of_authors', 'recid']
+        columns = SmartDict.extract(jsons, paths)
+        for path in paths:
+            self.assertEquals(columns[path],
+                              [json.get(path) for json in jsons])
+        self.assertEquals(columns['creator.full_name'],
+                          ['Author, 1', 'Author, 2', 'Author, 3'])
+
+    @skipIf(numpy is None, 'NumPy is not installed')
+    def test_extract_numpy(self):
+        """JSONAlchemy - extract columns as NumPy arrays"""
+        records = [SmartDict({'n': recid, 'a': [{'b': recid}, {'b': 0}]})
+                   for recid in range(5)]
+        columns = SmartDict.extract(records, ['n', 'a.b'],
+                                    dtypes={'n': 'int64'})
+        self.assertEquals(columns['n'].dtype, numpy.dtype('int64'))
+        self.assertEquals(list(columns['n']), list(range(5)))
+        self.assertEquals(columns['a.b'].shape, (5, ))
+        self.assertEquals(columns['a.b'][3], [3, 0])
+        columns = SmartDict.extract(records, ['n'], dtypes=float)
+        self.assertEquals(columns['n'].dtype, numpy.dtype(float))
+
+    def test_meta_metadata_views(self):
+        """JSONAlchemy - meta_metadata shortcuts don't copy it"""
+        metadata = MetaData(['jsonalchemy.jsonext', 'testext'])
+        json = list(translate_many([{'title': {'title': 'Title'}}],
+                                   SmartJson, master_format='json',
+                                   metadata=metadata))[0]
+        meta_metadata = json._dict['__meta_metadata__']
+
+        self.assertTrue(isinstance(json.meta_metadata, DotableView))
+        self.assertEquals(json.meta_metadata, meta_metadata)
+        self.assertTrue(json.meta_metadata['title'] is
+                        meta_metadata['title'])
+        self.assertTrue('title' in json.meta_metadata)
+        self.assertEquals(json.additional_info.master_format, 'json')
+        self.assertEquals(json.model_info.names, ['__default__'])
+        self.assertRaises(AttributeError, getattr, json.model_info, 'foo')
+        self.assertEquals(getattr(json.model_info, 'foo', None), None)
+
+        # Changes go to the record
+        json.additional_info.foo = 'bar'
+        self.assertEquals(
+            meta_metadata['__additional_info__']['foo'], 'bar')
+        copy = json.additional_info.copy()
+        copy.foo = 'baz'
+        self.assertEquals(json.additional_info['foo'], 'bar')
+
+    def test_meta_metadata_templates(self):
+        """JSONAlchemy - meta-metadata shared and stored in compact form"""
+        metadata = MetaData(['jsonalchemy.jsonext', 'testext'])
+        first, second = translate_many(
+            [{'title': {'title': 'A'}}, {'title': {'title': 'B'}}],
+            SmartJson, master_format='json', metadata=metadata)
+        first.reader.set('foo', 'bar')
+        first_info = first.meta_metadata['title']
+        second_info = second.meta_metadata['title']
+        self.assertTrue(isinstance(first_info, OverlayDict))
+        self.assertTrue(isinstance(first_info.base, FieldInfoTemplate))
+        self.assertTrue(first_info.base is second_info.base)
+        self.assertEquals(sorted(first_info.changes), ['timestamp'])
+        self.assertRaises(TypeError, first_info.base.__setitem__, 'a', 1)
+
+        # Full meta-metadata by default, as plain dictionaries
+        dump = first.dumps()
+        self.assertEquals(type(dump['__meta_metadata__']['title']), dict)
+        self.assertEquals(dump['__meta_metadata__']['title'],
+                          first_info.copy())
+        self.assertEquals(first.loads()['__meta_metadata__']['title'],
+                          first_info.copy())
+        self.assertFalse('__compact__' in dump['__meta_metadata__'])
+
+        compact = json_module.loads(json_module.dumps(
+            first.dumps(compact=True)))
+        self.assertTrue(compact['__meta_metadata__']['__compact__'])
+        self.assertEquals(
+            sorted(compact['__meta_metadata__']['title']),
+            ['__info__', 'timestamp'])
+        # Fields without definition are kept as they are
+        self.assertEquals(compact['__meta_metadata__']['foo']['type'],
+                          'UNKNOWN')
+        self.assertTrue(len(json_module.dumps(compact)) <
+                        len(json_module.dumps(dump)))
+
+        stored = copy.deepcopy(compact)
+        json = SmartJson(compact, metadata=metadata)
+        self.assertFalse('__compact__' in json.meta_metadata)
+        self.assertTrue(json.meta_metadata['title'].base is first_info.base)
+        self.assertEquals(json.dumps(), dump)
+        self.assertEquals(json['title.title'], 'A')
+        # The stored dictionary is not modified
+        self.assertEquals(compact, stored)
+
+        # The shared meta-metadata is read-only, the changes are per record
+        info = json.meta_metadata['title']
+        self.assertRaises(TypeError, info['ext'].__setitem__, 'a', 1)
+        self.assertRaises(TypeError, info['ext']['json_ext'].pop, 'dumps')
+        self.assertRaises(TypeError, info['function'].append, 'a')
+        self.assertEquals(info['function'], ['title'])
+        info['ext'] = {}
+        self.assertEquals(json.meta_metadata['title']['ext'], {})
+        self.assertFalse(first_info['ext'] == {})
+        self.assertFalse(second.meta_metadata['title']['ext'] == {})
+
+        # Bound later by the reader
+        json = SmartJson(json_module.loads(json_module.dumps(
+            first.dumps(compact=True))))
+        self.assertTrue('__compact__' in json.meta_metadata)
+        json.bind(metadata)
+        self.assertEquals(json.dumps(), dump)
+
+        for info in (pickle.loads(pickle.dumps(first_info)),
+                     copy.deepcopy(first_info)):
+            self.assertEquals(info, first_info)
+            self.assertEquals(info.base.ref, first_info.base.ref)
+        info = copy.copy(first_info)
+        info['timestamp'] = None
+        self.assertTrue(info.base is first_info.base)
+        self.assertFalse(first_info['timestamp'] is None)
+
+    def test_meta_metadata_compact_definitions_changed(self):
+        """JSONAlchemy - compact meta-metadata after changing the rules"""
+        tmp_file = tempfile.NamedTemporaryFile(suffix='.cfg')
+
+        def load_metadata(rules):
+            tmp_file.seek(0)
+            tmp_file.truncate()
+            tmp_file.write("""
+compact_copy:
+    creator:
+        marc, "999__", value['a']
+
+compact_title:
+    creator:
+%s
+""" % (rules, ))
+            tmp_file.flush()
+            metadata = MetaData(['jsonalchemy.jsonext', 'testext'])
+            metadata.fields.append(tmp_file.name)
+            return metadata
+
+        connected = """
+        @connect('compact_copy')
+        marc, "245__", value['a']"""
+        plain = """
+        marc, "246__", value['a']"""
+        blob = """
+            <record>
+                <datafield tag="246" ind1=" " ind2=" ">
+                <subfield code="a">Title</subfield>
+                </datafield>
+            </record>"""
+        json = translate(blob, SmartJson, master_format='marc',
+                         metadata=load_metadata(connected + plain))
+        info = json.meta_metadata['compact_title']
+        self.assertEquals(info['after'], {})
+        compact = json_module.loads(json_module.dumps(
+            json.dumps(compact=True)))
+
+        # The rules are swapped, the one with the same template is used
+        metadata = load_metadata(plain + connected)
+        loaded = SmartJson(copy.deepcopy(compact), metadata=metadata)
+        self.assertEquals(loaded.meta_metadata['compact_title'].copy(),
+                          info.copy())
+
+        # No rule has the same template, it is found again
+        metadata = load_metadata(connected.replace('245', '246'))
+        loaded = SmartJson(copy.deepcopy(compact), metadata=metadata)
+        expected = translate(blob, SmartJson, master_format='marc',
+                             metadata=metadata).meta_metadata['compact_title']
+        self.assertEquals(expected['after'], {'connect': (
+            {'connected_field': 'compact_copy', 'update_function': None}, )})
+        self.assertEquals(loaded.meta_metadata['compact_title'].copy(),
+                          dict(expected.copy(), timestamp=info['timestamp']))
+        tmp_file.close()
+
+    def test_bson_cache(self):
+        """JSONAlchemy - falsy values are cached too"""
+        metadata = MetaData(['jsonalchemy.jsonext', 'testext'])
+        json = translate("""
+            <record>
+                <controlfield tag="001">0</controlfield>
+                <datafield tag="245" ind1=" " ind2=" ">
+                <subfield code="a">Title</subfield>
+                </datafield>
+            </record>""", SmartJson, master_format='marc', metadata=metadata)
+        self.assertEquals(json['recid'], 0)
+        self.assertEquals(json['_id'], 0)
+
+        json_ext = metadata.field_extensions['json_ext']
+        loads = []
+
+        class CountingJsonExtra(json_ext):
+
+            @classmethod
+            def evaluate(cls, json, field_name, action, args):
+                if action == 'get':
+                    loads.append(field_name)
+                return json_ext.evaluate(json, field_name, action, args)
+
+        metadata.field_extensions['json_ext'] = CountingJsonExtra
+        try:
+            json = SmartJson(json.dumps(), metadata=metadata)
+            for dummy in range(3):
+                self.assertEquals(json['recid'], 0)
+                self.assertEquals(json['title.title'], 'Title')
+            self.assertEquals(loads, ['recid', 'title'])
+
+            self.assertEquals(json.get('recid', reset=True), 0)
+            self.assertEquals(loads, ['recid', 'title', 'recid'])
+
+            json['recid'] = ''
+            self.assertEquals(json['recid'], '')
+            self.assertEquals(loads, ['recid', 'title', 'recid'])
+
+            json.invalidate('recid')
+            self.assertEquals(json['recid'], '')
+            self.assertEquals(loads, ['recid', 'title', 'recid', 'recid'])
+
+            del json['recid']
+            self.assertFalse('recid' in json)
+            self.assertEquals(json.get('recid'), None)
+        finally:
+            metadata.field_extensions['json_ext'] = json_ext
+
+    def test_lru_cache(self):
+        """JSONAlchemy - least recently used values are dropped first"""
+        cache = LRUCache(8)
+        for key in range(8):
+            cache[key] = str(key)
+        self.assertEquals(cache.get(0), '0')
+        cache[8] = '8'
+        # The least recently used quarter is dropped, 0 was just used
+        self.assertEquals(len(cache), 7)
+        self.assertTrue(0 in cache)
+        self.assertFalse(1 in cache)
+        self.assertFalse(2 in cache)
+        self.assertEquals(cache.get(1, 'missing'), 'missing')
+        cache.clear()
+        self.assertEquals(len(cache), 0)
+
+    def test_freeze(self):
+        """JSONAlchemy - read-only copies of nested values"""
+        value = {'a': [1, {'b': 2}], 'c': ({'d': []}, )}
+        frozen = freeze(value)
+        self.assertEquals(frozen, value)
+        self.assertTrue(isinstance(frozen['a'], FrozenList))
+        for change in (lambda: frozen['a'].append(3),
+                       lambda: frozen['a'].__setitem__(0, 3),
+                       lambda: frozen['a'][1].__setitem__('b', 3),
+                       lambda: frozen['c'][0]['d'].extend([3])):
+            self.assertRaises(TypeError, change)
+        self.assertEquals(value, {'a': [1, {'b': 2}], 'c': ({'d': []}, )})
+        self.assertEquals(pickle.loads(pickle.dumps(frozen)), value)
+        self.assertTrue(isinstance(pickle.loads(pickle.dumps(frozen['a'])),
+                                   FrozenList))
+        self.assertEquals(list(frozen['a']) + [3], [1, {'b': 2}, 3])
+
+    def test_overlay_dict(self):
+        """JSONAlchemy - changes on top of a shared dictionary"""
+        base = {'a': 1, 'b': 2}
+        overlay = OverlayDict(base)
+        overlay['b'] = 3
+        overlay['c'] = 4
+        self.assertEquals(overlay, {'a': 1, 'b': 3, 'c': 4})
+        self.assertEquals(len(overlay), 3)
+        self.assertEquals(sorted(overlay), ['a', 'b', 'c'])
+        self.assertTrue('a' in overlay)
+        self.assertEquals(overlay.get('d'), None)
+        self.assertEquals(base, {'a': 1, 'b': 2})
+        self.assertEquals(overlay.changes, {'b': 3, 'c': 4})
+        self.assertEquals(type(overlay.copy()), dict)
+
+        del overlay['a']
+        self.assertEquals(overlay, {'b': 3, 'c': 4})
+        self.assertEquals(base, {'a': 1, 'b': 2})
+        self.assertRaises(KeyError, overlay.__delitem__, 'a')